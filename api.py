@@ -1,10 +1,64 @@
-from fastapi import FastAPI, HTTPException
+import os
+import json
+import time
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 
-from worker import generate_preview, post_to_facebook, post_next_approved, load_config
-from db import create_post, list_posts, update_post
+from worker import (
+    generate_preview,
+    publish_approved_post,
+    post_next_approved,
+    load_config,
+    warm_page_token_cache,
+    _uploads_dir,
+)
+from db import (
+    create_post,
+    list_posts,
+    get_post,
+    get_posts,
+    update_post,
+    schedule_post,
+    schedule_value,
+    list_post_targets,
+    upsert_post_targets,
+    remove_post_target,
+    get_media,
+    list_post_media,
+    list_post_attempts,
+    list_llm_usage,
+    list_caption_variants,
+    select_caption_variant,
+    attempt_stats,
+    changes_since,
+    get_change_counter,
+)
+from llm_client import llm_providers
+from llm_router import llm_router
+from metrics import render_prometheus
+from prefetch import schedule_prefetch
+from publish_jobs import submit_publish, get_job, list_jobs
+from media_cache import THUMB_MAX_SIDE, PREVIEW_MAX_SIDE, thumbnail_for_file, thumbnail_for_url
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    cfg = load_config()
+    if cfg.fb_page_access_token:
+        # Validate the default token in the background so startup never waits on Graph.
+        threading.Thread(
+            target=warm_page_token_cache,
+            args=(cfg.db_path, [cfg.fb_page_access_token], cfg.fb_app_token),
+            daemon=True,
+        ).start()
+    yield
 
-app = FastAPI(title="ADG AI FB Poster API (DB)", version="2.0.0")
+app = FastAPI(title="ADG AI FB Poster API (DB)", version="2.0.0", lifespan=lifespan)
 
 class CreatePostIn(BaseModel):
     topic: str
@@ -19,37 +73,237 @@ def health():
     cfg = load_config()
     return {"ok": True, "db_path": cfg.db_path}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
 @app.get("/posts")
 def posts(status: str | None = None, limit: int = 200):
     cfg = load_config()
     return list_posts(cfg.db_path, status=status, limit=limit)
 
+# Long-poll / SSE clients check the change counter this often; it is a single-row lookup.
+CHANGES_POLL_SECONDS = 0.5
+CHANGES_MAX_WAIT_SECONDS = 30
+SSE_HEARTBEAT_SECONDS = 15
+
+@app.get("/posts/changes")
+async def post_changes(since: int = 0, limit: int = 500, wait: float = 0, include_posts: bool = False):
+    """Changes after seq `since`. With `wait` > 0, long-poll up to that many seconds for the first change."""
+    cfg = load_config()
+    deadline = time.monotonic() + min(max(wait, 0), CHANGES_MAX_WAIT_SECONDS)
+    while True:
+        res = await asyncio.to_thread(changes_since, cfg.db_path, since, limit)
+        if res["changes"] or res["reset"] or time.monotonic() >= deadline:
+            break
+        await asyncio.sleep(CHANGES_POLL_SECONDS)
+    if include_posts:
+        res["posts"] = await asyncio.to_thread(get_posts, cfg.db_path, res["post_ids"])
+    return res
+
+@app.get("/posts/changes/stream")
+async def post_changes_stream(request: Request, since: int | None = None):
+    """Server-Sent Events: one `change` event per post_changes row (id = seq).
+
+    Resumes from the Last-Event-ID header on reconnect; without `since` it starts
+    at the current seq (only new changes). A `reset` event means the client fell
+    behind the pruned log and should reload.
+    """
+    cfg = load_config()
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        since = int(last_event_id)
+    if since is None:
+        since = await asyncio.to_thread(get_change_counter, cfg.db_path)
+
+    async def events():
+        seq = int(since)
+        last_sent = time.monotonic()
+        yield "retry: 2000\n\n"
+        while not await request.is_disconnected():
+            if await asyncio.to_thread(get_change_counter, cfg.db_path) != seq:
+                res = await asyncio.to_thread(changes_since, cfg.db_path, seq, 500)
+                if res["reset"]:
+                    yield f"id: {res['last_seq']}\nevent: reset\ndata: {json.dumps(res)}\n\n"
+                for c in res["changes"]:
+                    yield f"id: {c['seq']}\nevent: change\ndata: {json.dumps(c, ensure_ascii=False)}\n\n"
+                seq = res["last_seq"]
+                last_sent = time.monotonic()
+                if res["more"] and res["changes"]:
+                    continue
+            elif time.monotonic() - last_sent >= SSE_HEARTBEAT_SECONDS:
+                yield ": ping\n\n"
+                last_sent = time.monotonic()
+            await asyncio.sleep(CHANGES_POLL_SECONDS)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @app.post("/posts")
 def create_post_api(inp: CreatePostIn):
     cfg = load_config()
     pid = create_post(cfg.db_path, inp.model_dump())
     return {"id": pid}
 
+@app.get("/posts/{post_id}/media")
+def post_media(post_id: int):
+    cfg = load_config()
+    return list_post_media(cfg.db_path, post_id)
+
+@app.get("/posts/{post_id}/attempts")
+def post_attempts(post_id: int):
+    cfg = load_config()
+    return list_post_attempts(cfg.db_path, post_id)
+
+@app.get("/posts/{post_id}/llm-usage")
+def post_llm_usage(post_id: int):
+    cfg = load_config()
+    return list_llm_usage(cfg.db_path, post_id)
+
+@app.get("/llm/providers")
+def llm_provider_stats():
+    """Rolling latency/error stats per LLM provider of this process, in routing order."""
+    providers = llm_providers(load_config())
+    return llm_router(providers).snapshot() if providers else []
+
+@app.get("/stats/publish")
+def publish_stats(since: str = ""):
+    """Failure rate and p95 publish time per page (optionally since an ISO timestamp)."""
+    cfg = load_config()
+    return attempt_stats(cfg.db_path, since=since)
+
+@app.get("/media/{media_id}/thumbnail")
+def media_thumbnail(media_id: int, size: str = "thumb"):
+    cfg = load_config()
+    m = get_media(cfg.db_path, media_id)
+    if not m:
+        raise HTTPException(status_code=404, detail="Media not found")
+    if m["kind"] not in ("image_file", "image_url"):
+        raise HTTPException(status_code=415, detail="Thumbnails are only available for images")
+    max_side = PREVIEW_MAX_SIDE if size == "preview" else THUMB_MAX_SIDE
+    if m["kind"] == "image_file":
+        src = os.path.join(_uploads_dir(cfg), m["source"])
+        if not os.path.isfile(src):
+            raise HTTPException(status_code=404, detail="Upload missing on disk")
+        path = thumbnail_for_file(cfg.db_path, src, max_side)
+    else:
+        path = thumbnail_for_url(cfg.db_path, m["source"], max_side)
+        if not path:
+            raise HTTPException(status_code=502, detail="Could not fetch remote image")
+    return FileResponse(path, headers={"Cache-Control": "public, max-age=86400"})
+
 @app.post("/posts/{post_id}/approve")
 def approve(post_id: int):
     cfg = load_config()
     update_post(cfg.db_path, post_id, {"status": "APPROVED", "last_error": ""})
+    schedule_prefetch(cfg.db_path, post_id)
     return {"ok": True}
 
 @app.post("/posts/{post_id}/preview")
-def preview(post_id: int):
+def preview(post_id: int, variants: int = 1):
     try:
-        return generate_preview(post_id)
+        return generate_preview(post_id, variants=variants)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/posts/{post_id}/caption-variants")
+def caption_variants(post_id: int):
+    """Latest batch of caption alternatives for the post."""
+    cfg = load_config()
+    return list_caption_variants(cfg.db_path, [post_id])[post_id]
+
+@app.post("/caption-variants/{variant_id}/select")
+def choose_caption_variant(variant_id: int):
+    """Use a stored variant as the post's caption (no LLM call)."""
+    cfg = load_config()
+    row = select_caption_variant(cfg.db_path, variant_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Variant not found")
+    return row
+
 @app.post("/posts/{post_id}/post")
 def post(post_id: int):
     try:
-        return post_to_facebook(post_id)
+        return publish_approved_post(post_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+class ScheduleIn(BaseModel):
+    scheduled_at: datetime | None = None  # ISO 8601; null clears the schedule
+
+@app.post("/posts/{post_id}/schedule")
+def schedule(post_id: int, inp: ScheduleIn):
+    """Publish automatically (scheduler daemon) once `scheduled_at` has passed."""
+    cfg = load_config()
+    if not get_post(cfg.db_path, post_id):
+        raise HTTPException(status_code=404, detail="Post not found")
+    return {"post_id": post_id, "scheduled_at": schedule_post(cfg.db_path, post_id, inp.scheduled_at)}
+
+class TargetIn(BaseModel):
+    page_id: str
+    page_name: str | None = None
+    caption_override: str | None = None  # "" = use the post's caption
+    scheduled_at: datetime | None = None  # null = publish with the post
+
+@app.get("/posts/{post_id}/targets")
+def post_targets(post_id: int):
+    cfg = load_config()
+    return list_post_targets(cfg.db_path, post_id)
+
+@app.put("/posts/{post_id}/targets")
+def put_post_targets(post_id: int, inp: list[TargetIn]):
+    """Add Pages to publish this post to, or update their caption/schedule (only fields sent).
+
+    Publishing (publish-jobs, scheduler) then fans out to every target and
+    retries only the ones not POSTED yet.
+    """
+    cfg = load_config()
+    if not get_post(cfg.db_path, post_id):
+        raise HTTPException(status_code=404, detail="Post not found")
+    rows = []
+    for t in inp:
+        row = {"page_id": t.page_id.strip()}
+        for k in ("page_name", "caption_override"):
+            if k in t.model_fields_set:
+                row[k] = getattr(t, k) or ""
+        if "scheduled_at" in t.model_fields_set:
+            row["scheduled_at"] = schedule_value(t.scheduled_at)
+        rows.append(row)
+    upsert_post_targets(cfg.db_path, post_id, rows)
+    return list_post_targets(cfg.db_path, post_id)
+
+@app.delete("/posts/{post_id}/targets/{page_id}")
+def delete_post_target(post_id: int, page_id: str):
+    cfg = load_config()
+    if not remove_post_target(cfg.db_path, post_id, page_id):
+        raise HTTPException(status_code=409, detail="Target not found or already posted")
+    return {"ok": True}
+
+class PublishJobIn(BaseModel):
+    page_access_tokens: list[str] | None = None
+
+@app.post("/posts/{post_id}/publish-jobs")
+def create_publish_job_api(post_id: int, inp: PublishJobIn | None = None):
+    """Publish in the background; poll GET /publish-jobs/{job_id} for progress."""
+    cfg = load_config()
+    try:
+        job_id = submit_publish(cfg.db_path, post_id, inp.page_access_tokens if inp else None)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"job_id": job_id}
+
+@app.get("/posts/{post_id}/publish-jobs")
+def post_publish_jobs(post_id: int, limit: int = 20):
+    cfg = load_config()
+    return list_jobs(cfg.db_path, post_id=post_id, limit=limit)
+
+@app.get("/publish-jobs/{job_id}")
+def publish_job(job_id: int):
+    cfg = load_config()
+    job = get_job(cfg.db_path, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 @app.post("/post-next-approved")
 def post_next():
     try:
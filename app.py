@@ -1,13 +1,38 @@
 import os
 import uuid
-import json
-from typing import Any, Dict
+import hashlib
+import datetime as dt
+from typing import Any, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
 
 import streamlit as st
 from dotenv import load_dotenv
 
-from db import init_db, create_post, list_posts, get_post, update_post
-from worker import load_config, generate_preview, post_to_facebook, post_to_facebook_multi
+from db import (
+    init_db,
+    create_post,
+    list_posts,
+    count_posts,
+    get_change_counter,
+    get_post,
+    update_post,
+    get_media_sources,
+    get_post_media_sources,
+    list_post_media,
+    set_post_media,
+    remove_post_media,
+    schedule_post,
+    list_post_targets,
+    upsert_post_targets,
+    remove_post_target,
+    list_caption_variants,
+    select_caption_variant,
+)
+from prefetch import schedule_prefetch
+from publish_jobs import list_jobs, submit_publish
+from repository import data_dir
+from media_cache import PREVIEW_MAX_SIDE, THUMB_MAX_SIDE, thumbnail_for_file, thumbnail_for_url
+from worker import CAPTION_VARIANTS, load_config, generate_preview
 
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), ".env"), override=True)
 cfg = load_config()
@@ -42,21 +67,24 @@ def badge(status: str) -> str:
 
 
 def ensure_upload_dir() -> str:
-    db_dir = os.path.dirname(cfg.db_path) or "."
+    db_dir = data_dir(cfg.db_path)
     up = os.path.join(db_dir, "uploads")
     os.makedirs(up, exist_ok=True)
     return up
 
 
-def save_upload(file) -> str:
+def save_upload(file, content_hashes: Optional[Dict[str, str]] = None) -> str:
     up = ensure_upload_dir()
     ext = ""
     if file.name and "." in file.name:
         ext = "." + file.name.split(".")[-1]
     fn = f"{uuid.uuid4().hex}{ext}"
     path = os.path.join(up, fn)
+    buf = file.getbuffer()
     with open(path, "wb") as f:
-        f.write(file.getbuffer())
+        f.write(buf)
+    if content_hashes is not None:
+        content_hashes[fn] = hashlib.sha256(buf).hexdigest()
     return fn
 
 
@@ -74,17 +102,7 @@ def _parse_multi_urls(raw: str) -> list[str]:
     return out
 
 
-def _json_list(val: str) -> list[str]:
-    try:
-        arr = json.loads(val or "[]")
-        if isinstance(arr, list):
-            return [str(x) for x in arr if str(x).strip()]
-    except Exception:
-        pass
-    return []
-
-
-def render_post_row(p: Dict[str, Any]) -> None:
+def render_post_row(p: Dict[str, Any], media: Optional[Dict[str, List[str]]] = None) -> None:
     st.markdown(f"#### Post #{p['id']}  {badge(p.get('status',''))}", unsafe_allow_html=True)
     st.markdown('<div class="hr"></div>', unsafe_allow_html=True)
     c1, c2 = st.columns([2, 1])
@@ -97,9 +115,11 @@ def render_post_row(p: Dict[str, Any]) -> None:
         if p.get("fb_post_url"):
             st.markdown(f"**Link bài**: {p.get('fb_post_url')}")
         media_bits = []
-        if p.get("image_file_name") or p.get("image_url"):
+        if media is None:
+            media = get_post_media_sources(cfg.db_path, int(p["id"]))
+        if media.get("image_file") or media.get("image_url"):
             media_bits.append("ảnh")
-        if p.get("video_file_name") or p.get("video_url"):
+        if media.get("video_file") or media.get("video_url"):
             media_bits.append("video")
         if media_bits:
             st.markdown(f"**Media:** {', '.join(media_bits)}")
@@ -112,6 +132,172 @@ def render_post_row(p: Dict[str, Any]) -> None:
     st.markdown('</div>', unsafe_allow_html=True)
 
 
+DRAFT_PAGE_SIZES = [10, 20, 50]
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def load_post_count(db_path: str, status: str, version: int) -> int:
+    # `version` is the DB change counter: any write to posts/post_media invalidates the cache.
+    return count_posts(db_path, status=status)
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def load_posts_page(
+    db_path: str, status: str, limit: int, offset: int, version: int
+) -> Tuple[List[Dict[str, Any]], Dict[int, Dict[str, List[str]]]]:
+    posts = list_posts(db_path, status=status, limit=limit, offset=offset)
+    media = get_media_sources(db_path, [int(p["id"]) for p in posts]) if posts else {}
+    return posts, media
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def load_caption_variants(db_path: str, post_ids: Tuple[int, ...], version: int) -> Dict[int, List[Dict[str, Any]]]:
+    return list_caption_variants(db_path, list(post_ids))
+
+
+def _on_variant_picked(radio_key: str, caption_key: str, variants_key: str, variants: List[Dict[str, Any]]) -> None:
+    # Runs before the card is drawn again, so the caption widget can still be set.
+    choice = int(st.session_state[radio_key])
+    row = select_caption_variant(cfg.db_path, choice)
+    if row is not None:
+        st.session_state[caption_key] = row["caption"]
+        st.session_state[variants_key] = [dict(v, selected=int(int(v["id"]) == choice)) for v in variants]
+
+
+def render_caption_variants(post_id: int, variants: List[Dict[str, Any]], caption_key: str, variants_key: str) -> None:
+    """Radio over the latest AI variants; picking one swaps the caption in without calling the AI again."""
+    st.markdown(f"**Phương án AI ({len(variants)})** — chọn để dùng ngay")
+    by_id = {int(v["id"]): v for v in variants}
+    current = next((i for i, v in by_id.items() if v["selected"]), next(iter(by_id)))
+    radio_key = f"variant_{post_id}_{variants[0]['batch']}"
+    st.radio(
+        " ",
+        list(by_id),
+        index=list(by_id).index(current),
+        format_func=lambda i: f"{int(by_id[i]['position']) + 1}. {by_id[i]['title'][:90]}",
+        key=radio_key,
+        label_visibility="collapsed",
+        on_change=_on_variant_picked,
+        args=(radio_key, caption_key, variants_key, variants),
+    )
+
+
+@st.fragment
+def render_draft_card(p: Dict[str, Any], media: Dict[str, List[str]], variants: List[Dict[str, Any]]) -> None:
+    """One DRAFT card; typing, regenerating or picking a caption variant reruns only this card."""
+    render_post_row(p, media)
+    caption_val = str(p.get("caption", "") or "")
+    widget_key = f"cap_draft_{p['id']}"
+    pending_key = f"cap_draft_pending_{p['id']}"
+    # Variants generated or picked in this fragment are newer than the page's cached ones.
+    variants_key = f"cap_variants_{p['id']}"
+    fresh = st.session_state.get(variants_key)
+    if fresh and (not variants or fresh[0]["batch"] >= variants[0]["batch"]):
+        variants = fresh
+
+    st.markdown("**Yêu cầu bổ sung (dùng khi AI sinh lại caption)**")
+    extra_req = st.text_area(
+        " ",
+        value=str(p.get("extra_requirements", "") or ""),
+        height=120,
+        key=f"req_draft_{p['id']}",
+        label_visibility="collapsed",
+        placeholder="Nhập thêm yêu cầu (giọng văn, điểm nhấn, CTA, hạn chế dùng từ..., v.v). Khi bấm 'AI sinh nội dung', AI sẽ kết hợp yêu cầu cũ + mới."
+    )
+
+    if len(variants) > 1:
+        render_caption_variants(int(p["id"]), variants, widget_key, variants_key)
+
+    # If AI generated a new caption on the previous run, apply it BEFORE the widget is created.
+    if pending_key in st.session_state:
+        st.session_state[widget_key] = st.session_state.pop(pending_key)
+    edited_caption = st.text_area(
+        "Nội dung (caption)",
+        value=caption_val,
+        height=220,
+        key=widget_key,
+        placeholder="Nếu trống, bạn có thể bấm 'AI sinh nội dung' để tạo nhanh."
+    )
+    colA, colB, colC = st.columns([1, 1, 1])
+    with colA:
+        if st.button(f"Approve #{p['id']}", key=f"ap_{p['id']}", type="primary"):
+            if not str(edited_caption or "").strip():
+                st.error("Caption đang trống. Hãy nhập nội dung hoặc bấm 'AI sinh nội dung' trước khi Approve.")
+            else:
+                update_post(cfg.db_path, int(p["id"]), {
+                    "extra_requirements": str(extra_req or "").strip(),
+                    "caption": edited_caption.strip(),
+                    "status": "APPROVED",
+                    "last_error": "",
+                })
+                schedule_prefetch(cfg.db_path, int(p["id"]))
+            st.rerun()
+    with colB:
+        if st.button(f"AI sinh nội dung #{p['id']}", key=f"gen_cap_{p['id']}"):
+            with st.spinner("Đang sinh nội dung AI..."):
+                try:
+                    update_post(cfg.db_path, int(p["id"]), {"extra_requirements": str(extra_req or "").strip()})
+                    out = generate_preview(int(p["id"]), variants=CAPTION_VARIANTS)
+                    # Defer updating the textarea value until the next rerun.
+                    # Streamlit does not allow modifying a widget's session_state key
+                    # after the widget has been instantiated in the same run.
+                    st.session_state[pending_key] = str(out.get("caption", "") or "")
+                    st.session_state[variants_key] = out.get("variants", [])
+                    st.rerun(scope="fragment")
+                except Exception as e:
+                    st.error(str(e))
+    with colC:
+        if st.button(f"Mark Deleted #{p['id']}", key=f"del_{p['id']}"):
+            update_post(cfg.db_path, int(p["id"]), {"status": "FAILED", "last_error": "Deleted by user"})
+            st.rerun()
+
+
+JOB_POLL_SECONDS = 1.0
+
+
+def _fmt_bytes(n: Any) -> str:
+    n = float(n or 0)
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return f"{n:.0f} B" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GB"
+
+
+def render_publish_jobs() -> None:
+    """Recent background publish jobs with per-page / per-media progress (polled from DB)."""
+    jobs = list_jobs(cfg.db_path, limit=5)
+    active = any(j["status"] in ("QUEUED", "RUNNING") for j in jobs)
+    if jobs:
+        st.markdown("#### Tiến trình đăng")
+    for job in jobs:
+        with st.expander(f"Job #{job['id']} · Post #{job['post_id']} · {job['status']}", expanded=job["status"] in ("QUEUED", "RUNNING")):
+            if job.get("error"):
+                st.error(job["error"])
+            for fp, t in (job.get("progress") or {}).get("targets", {}).items():
+                label = t.get("page_name") or t.get("page_id") or f"token {fp[:8]}"
+                stage = f" · {t['stage']}" if t.get("stage") and t.get("status") == "running" else ""
+                st.markdown(f"**{label}** — {t.get('status', '')}{stage}")
+                for m in (t.get("media") or {}).values():
+                    total = int(m.get("bytes_total") or 0)
+                    sent = int(m.get("bytes_sent") or 0)
+                    frac = 1.0 if m.get("status") == "done" else (sent / total if total else 0.0)
+                    text = f"{m.get('name', '')}: {_fmt_bytes(sent)} / {_fmt_bytes(total)}"
+                    rate = float(m.get("bytes_per_sec") or 0)
+                    if m.get("status") != "done" and rate > 0:
+                        text += f" · {_fmt_bytes(rate)}/s · còn ~{(total - sent) / rate:.0f}s"
+                    st.progress(min(1.0, frac), text=text)
+                if t.get("post_url"):
+                    st.markdown(f"Link bài: {t['post_url']}")
+                if t.get("error"):
+                    st.code(str(t["error"])[:500])
+    # A job just finished: rerun the whole page so post lists/status refresh and polling stops.
+    if st.session_state.get("jobs_were_active") and not active:
+        st.session_state["jobs_were_active"] = False
+        st.rerun()
+    st.session_state["jobs_were_active"] = active
+
+
 st.markdown("## ADG | AI Facebook Poster (DB)")
 st.markdown('<div class="small-muted">Nhập input trên web → duyệt trên web → đăng lên Facebook → lưu lịch sử trong SQLite.</div>', unsafe_allow_html=True)
 
@@ -119,6 +305,9 @@ with st.sidebar:
     nav = st.radio("Điều hướng", ["Tạo bài", "Duyệt", "Preview & Đăng"], index=0)
     if st.button("Làm mới", use_container_width=True):
         st.rerun()
+    active_jobs = list_jobs(cfg.db_path, active_only=True)
+    if active_jobs:
+        st.caption(f"Đang đăng nền: {len(active_jobs)} job")
 
 
 if nav == "Tạo bài":
@@ -172,38 +361,31 @@ if nav == "Tạo bài":
                 image_urls = _parse_multi_urls(image_urls_raw)
                 video_file_names: list[str] = []
                 video_urls = _parse_multi_urls(video_urls_raw)
+                content_hashes: Dict[str, str] = {}
 
                 if uploads:
                     for f in uploads:
                         if f is not None:
-                            image_file_names.append(save_upload(f))
+                            image_file_names.append(save_upload(f, content_hashes))
                     # If user uploaded files, treat image URLs as empty for posting.
                     image_urls = []
 
                 if upload_videos:
                     for f in upload_videos:
                         if f is not None:
-                            video_file_names.append(save_upload(f))
+                            video_file_names.append(save_upload(f, content_hashes))
                     # If user uploaded files, treat video URLs as empty for posting.
                     video_urls = []
 
-                legacy_image_file_name = image_file_names[0] if image_file_names else ""
-                legacy_image_url = image_urls[0] if image_urls else ""
-                legacy_video_file_name = video_file_names[0] if video_file_names else ""
-                legacy_video_url = video_urls[0] if video_urls else ""
-
                 pid = create_post(cfg.db_path, {
                     "topic": topic,
                     "main": main,
                     "mandatory": mandatory,
-                    "image_url": legacy_image_url,
-                    "image_file_name": legacy_image_file_name,
-                    "image_urls_json": json.dumps(image_urls, ensure_ascii=False),
-                    "image_file_names_json": json.dumps(image_file_names, ensure_ascii=False),
-                    "video_url": legacy_video_url,
-                    "video_file_name": legacy_video_file_name,
-                    "video_urls_json": json.dumps(video_urls, ensure_ascii=False),
-                    "video_file_names_json": json.dumps(video_file_names, ensure_ascii=False),
+                    "image_urls": image_urls,
+                    "image_file_names": image_file_names,
+                    "video_urls": video_urls,
+                    "video_file_names": video_file_names,
+                    "content_hashes": content_hashes,
                     "page_id": page_id,
                     "status": "DRAFT",
                 })
@@ -211,7 +393,7 @@ if nav == "Tạo bài":
                 if want_ai_caption:
                     with st.spinner("Đang nhờ AI tạo nội dung bài viết..."):
                         try:
-                            generate_preview(int(pid))
+                            generate_preview(int(pid), variants=CAPTION_VARIANTS)
                         except Exception as e:
                             st.warning(f"AI tạo nội dung lỗi: {e}")
 
@@ -222,70 +404,31 @@ elif nav == "Duyệt":
     st.markdown("### Duyệt (Approval trên web)")
     st.markdown('<div class="small-muted">Duyệt nội dung (caption) của các bài DRAFT → chỉnh sửa nếu cần → Approve để chuyển sang APPROVED.</div>', unsafe_allow_html=True)
 
-    drafts = list_posts(cfg.db_path, status="DRAFT", limit=200)
-    st.markdown(f"**DRAFT:** {len(drafts)} bài")
-    if not drafts:
+    version = get_change_counter(cfg.db_path)
+    total = load_post_count(cfg.db_path, "DRAFT", version)
+    st.markdown(f"**DRAFT:** {total} bài")
+    if not total:
         st.info("Không có bài DRAFT.")
     else:
+        col_size, col_page = st.columns(2)
+        with col_size:
+            page_size = st.selectbox("Số bài mỗi trang", DRAFT_PAGE_SIZES, index=0, key="draft_page_size")
+        n_pages = max(1, -(-total // page_size))
+        if st.session_state.get("draft_page", 1) > n_pages:
+            st.session_state["draft_page"] = n_pages
+        with col_page:
+            page_no = st.number_input(f"Trang (1-{n_pages})", min_value=1, max_value=n_pages, step=1, key="draft_page")
+        drafts, drafts_media = load_posts_page(
+            cfg.db_path, "DRAFT", page_size, (int(page_no) - 1) * page_size, version
+        )
+        drafts_variants = load_caption_variants(cfg.db_path, tuple(int(p["id"]) for p in drafts), version)
         for p in drafts:
-            render_post_row(p)
-            caption_val = str(p.get("caption", "") or "")
-            widget_key = f"cap_draft_{p['id']}"
-            pending_key = f"cap_draft_pending_{p['id']}"
-
-            st.markdown("**Yêu cầu bổ sung (dùng khi AI sinh lại caption)**")
-            extra_req = st.text_area(
-                " ",
-                value=str(p.get("extra_requirements", "") or ""),
-                height=120,
-                key=f"req_draft_{p['id']}",
-                label_visibility="collapsed",
-                placeholder="Nhập thêm yêu cầu (giọng văn, điểm nhấn, CTA, hạn chế dùng từ..., v.v). Khi bấm 'AI sinh nội dung', AI sẽ kết hợp yêu cầu cũ + mới."
-            )
-
-            # If AI generated a new caption on the previous run, apply it BEFORE the widget is created.
-            if pending_key in st.session_state:
-                st.session_state[widget_key] = st.session_state.pop(pending_key)
-            edited_caption = st.text_area(
-                "Nội dung (caption)",
-                value=caption_val,
-                height=220,
-                key=widget_key,
-                placeholder="Nếu trống, bạn có thể bấm 'AI sinh nội dung' để tạo nhanh."
-            )
-            colA, colB, colC = st.columns([1, 1, 1])
-            with colA:
-                if st.button(f"Approve #{p['id']}", key=f"ap_{p['id']}", type="primary"):
-                    if not str(edited_caption or "").strip():
-                        st.error("Caption đang trống. Hãy nhập nội dung hoặc bấm 'AI sinh nội dung' trước khi Approve.")
-                    else:
-                        update_post(cfg.db_path, int(p["id"]), {
-                            "extra_requirements": str(extra_req or "").strip(),
-                            "caption": edited_caption.strip(),
-                            "status": "APPROVED",
-                            "last_error": "",
-                        })
-                    st.rerun()
-            with colB:
-                if st.button(f"AI sinh nội dung #{p['id']}", key=f"gen_cap_{p['id']}"):
-                    with st.spinner("Đang sinh nội dung AI..."):
-                        try:
-                            update_post(cfg.db_path, int(p["id"]), {"extra_requirements": str(extra_req or "").strip()})
-                            out = generate_preview(int(p["id"]))
-                            # Defer updating the textarea value until the next rerun.
-                            # Streamlit does not allow modifying a widget's session_state key
-                            # after the widget has been instantiated in the same run.
-                            st.session_state[pending_key] = str(out.get("caption", "") or "")
-                            st.rerun()
-                        except Exception as e:
-                            st.error(str(e))
-            with colC:
-                if st.button(f"Mark Deleted #{p['id']}", key=f"del_{p['id']}"):
-                    update_post(cfg.db_path, int(p["id"]), {"status": "FAILED", "last_error": "Deleted by user"})
-                    st.rerun()
+            render_draft_card(p, drafts_media.get(int(p["id"]), {}), drafts_variants.get(int(p["id"]), []))
 
 elif nav == "Preview & Đăng":
     st.markdown("### Preview & Đăng")
+    st.fragment(run_every=JOB_POLL_SECONDS if active_jobs else None)(render_publish_jobs)()
+
     approved = list_posts(cfg.db_path, status="APPROVED", limit=200)
     st.markdown(f"**APPROVED:** {len(approved)} bài")
 
@@ -308,13 +451,12 @@ elif nav == "Preview & Đăng":
 
             st.markdown("#### Media preview")
             up_dir = ensure_upload_dir()
-            image_file_names = _json_list(str(p.get("image_file_names_json", "") or ""))
-            image_urls = _json_list(str(p.get("image_urls_json", "") or ""))
-            # Backward compatibility if DB row doesn't have JSON fields populated.
-            if not image_file_names and p.get("image_file_name"):
-                image_file_names = [str(p.get("image_file_name"))]
-            if not image_urls and p.get("image_url"):
-                image_urls = [str(p.get("image_url"))]
+            media = get_post_media_sources(cfg.db_path, int(p["id"]))
+            for m in list_post_media(cfg.db_path, int(p["id"])):
+                if m.get("validation_status") == "INVALID":
+                    st.warning(f"Link media không hợp lệ ({m.get('validation_error')}): {m['source']}")
+            image_file_names = media["image_file"]
+            image_urls = media["image_url"]
 
             if image_file_names:
                 for idx, fn in enumerate(image_file_names, start=1):
@@ -322,43 +464,29 @@ elif nav == "Preview & Đăng":
                     cimg1, cimg2 = st.columns([6, 1])
                     with cimg1:
                         if os.path.isfile(img_path):
-                            st.image(img_path, caption=f"Ảnh upload #{idx}")
+                            st.image(thumbnail_for_file(cfg.db_path, img_path, PREVIEW_MAX_SIDE), caption=f"Ảnh upload #{idx}")
                         else:
                             st.warning(f"Ảnh upload không tìm thấy trên đĩa: {fn}")
                     with cimg2:
                         if st.button("Bỏ", key=f"rm_img_file_{p['id']}_{idx}"):
-                            new_files = [x for x in image_file_names if x != fn]
-                            update_post(cfg.db_path, int(p["id"]), {
-                                "image_file_names_json": json.dumps(new_files, ensure_ascii=False),
-                                "image_urls_json": json.dumps(image_urls, ensure_ascii=False),
-                                "image_file_name": new_files[0] if new_files else "",
-                                "image_url": image_urls[0] if (not new_files and image_urls) else "",
-                                "last_error": "",
-                            })
+                            remove_post_media(cfg.db_path, int(p["id"]), "image_file", fn)
                             st.rerun()
             elif image_urls:
                 for idx, u in enumerate(image_urls, start=1):
                     cimg1, cimg2 = st.columns([6, 1])
                     with cimg1:
-                        st.image(u, caption=f"Ảnh URL #{idx}")
+                        thumb = thumbnail_for_url(cfg.db_path, u, PREVIEW_MAX_SIDE)
+                        if thumb:
+                            st.image(thumb, caption=f"Ảnh URL #{idx}")
+                        else:
+                            st.warning(f"Không tải được ảnh URL #{idx}: {u}")
                     with cimg2:
                         if st.button("Bỏ", key=f"rm_img_url_{p['id']}_{idx}"):
-                            new_urls = [x for x in image_urls if x != u]
-                            update_post(cfg.db_path, int(p["id"]), {
-                                "image_file_names_json": json.dumps(image_file_names, ensure_ascii=False),
-                                "image_urls_json": json.dumps(new_urls, ensure_ascii=False),
-                                "image_file_name": image_file_names[0] if (not new_urls and image_file_names) else "",
-                                "image_url": new_urls[0] if new_urls else "",
-                                "last_error": "",
-                            })
+                            remove_post_media(cfg.db_path, int(p["id"]), "image_url", u)
                             st.rerun()
 
-            video_file_names = _json_list(str(p.get("video_file_names_json", "") or ""))
-            video_urls = _json_list(str(p.get("video_urls_json", "") or ""))
-            if not video_file_names and p.get("video_file_name"):
-                video_file_names = [str(p.get("video_file_name"))]
-            if not video_urls and p.get("video_url"):
-                video_urls = [str(p.get("video_url"))]
+            video_file_names = media["video_file"]
+            video_urls = media["video_url"]
 
             if video_file_names:
                 for idx, fn in enumerate(video_file_names, start=1):
@@ -372,14 +500,7 @@ elif nav == "Preview & Đăng":
                             st.warning(f"Video upload không tìm thấy trên đĩa: {fn}")
                     with cv2:
                         if st.button("Bỏ", key=f"rm_vid_file_{p['id']}_{idx}"):
-                            new_files = [x for x in video_file_names if x != fn]
-                            update_post(cfg.db_path, int(p["id"]), {
-                                "video_file_names_json": json.dumps(new_files, ensure_ascii=False),
-                                "video_urls_json": json.dumps(video_urls, ensure_ascii=False),
-                                "video_file_name": new_files[0] if new_files else "",
-                                "video_url": video_urls[0] if (not new_files and video_urls) else "",
-                                "last_error": "",
-                            })
+                            remove_post_media(cfg.db_path, int(p["id"]), "video_file", fn)
                             st.rerun()
             elif video_urls:
                 for idx, u in enumerate(video_urls, start=1):
@@ -389,14 +510,7 @@ elif nav == "Preview & Đăng":
                         st.caption(f"Video URL #{idx}")
                     with cv2:
                         if st.button("Bỏ", key=f"rm_vid_url_{p['id']}_{idx}"):
-                            new_urls = [x for x in video_urls if x != u]
-                            update_post(cfg.db_path, int(p["id"]), {
-                                "video_file_names_json": json.dumps(video_file_names, ensure_ascii=False),
-                                "video_urls_json": json.dumps(new_urls, ensure_ascii=False),
-                                "video_file_name": video_file_names[0] if (not new_urls and video_file_names) else "",
-                                "video_url": new_urls[0] if new_urls else "",
-                                "last_error": "",
-                            })
+                            remove_post_media(cfg.db_path, int(p["id"]), "video_url", u)
                             st.rerun()
             else:
                 st.info("Chưa có video cho bài này.")
@@ -433,38 +547,33 @@ elif nav == "Preview & Đăng":
                 if new_urls_preview:
                     st.markdown("**Xem trước ảnh URL mới**")
                     for u in new_urls_preview[:10]:
-                        st.image(u)
+                        thumb = thumbnail_for_url(cfg.db_path, u, THUMB_MAX_SIDE)
+                        if thumb:
+                            st.image(thumb)
+                        else:
+                            st.caption(f"(Không tải được: {u})")
                     if len(new_urls_preview) > 10:
                         st.caption(f"(Đang hiển thị 10/{len(new_urls_preview)} ảnh URL)")
 
                 disabled_apply = (not new_imgs) and (not str(new_urls_raw or "").strip())
                 if st.button("Áp dụng ảnh cho bài này", key=f"use_up_imgs_{p['id']}", disabled=disabled_apply):
                     fns: list[str] = []
+                    hashes: Dict[str, str] = {}
                     urls = _parse_multi_urls(new_urls_raw)
                     if new_imgs:
                         for f in new_imgs:
                             if f is not None:
-                                fns.append(save_upload(f))
+                                fns.append(save_upload(f, hashes))
                         urls = []
 
-                    update_post(cfg.db_path, int(p["id"]), {
-                        "image_file_names_json": json.dumps(fns, ensure_ascii=False),
-                        "image_urls_json": json.dumps(urls, ensure_ascii=False),
-                        # legacy single-image fields
-                        "image_file_name": fns[0] if fns else "",
-                        "image_url": urls[0] if urls else "",
-                        "last_error": "",
-                    })
+                    set_post_media(cfg.db_path, int(p["id"]), "image_file", fns, hashes)
+                    set_post_media(cfg.db_path, int(p["id"]), "image_url", urls)
+                    schedule_prefetch(cfg.db_path, int(p["id"]))
                     st.rerun()
 
                 if st.button("Bỏ toàn bộ ảnh", key=f"clear_imgs_{p['id']}", disabled=not has_images):
-                    update_post(cfg.db_path, int(p["id"]), {
-                        "image_file_names_json": "[]",
-                        "image_urls_json": "[]",
-                        "image_file_name": "",
-                        "image_url": "",
-                        "last_error": "",
-                    })
+                    set_post_media(cfg.db_path, int(p["id"]), "image_file", [])
+                    set_post_media(cfg.db_path, int(p["id"]), "image_url", [])
                     st.rerun()
             with col_upd2:
                 new_vids = st.file_uploader(
@@ -502,35 +611,89 @@ elif nav == "Preview & Đăng":
                 disabled_apply_vid = (not new_vids) and (not str(new_vid_urls_raw or "").strip())
                 if st.button("Áp dụng video cho bài này", key=f"use_up_vids_{p['id']}", disabled=disabled_apply_vid):
                     fns: list[str] = []
+                    hashes: Dict[str, str] = {}
                     urls = _parse_multi_urls(new_vid_urls_raw)
                     if new_vids:
                         for f in new_vids:
                             if f is not None:
-                                fns.append(save_upload(f))
+                                fns.append(save_upload(f, hashes))
                         urls = []
 
-                    update_post(cfg.db_path, int(p["id"]), {
-                        "video_file_names_json": json.dumps(fns, ensure_ascii=False),
-                        "video_urls_json": json.dumps(urls, ensure_ascii=False),
-                        # legacy single-video fields
-                        "video_file_name": fns[0] if fns else "",
-                        "video_url": urls[0] if urls else "",
-                        "last_error": "",
-                    })
+                    set_post_media(cfg.db_path, int(p["id"]), "video_file", fns, hashes)
+                    set_post_media(cfg.db_path, int(p["id"]), "video_url", urls)
+                    schedule_prefetch(cfg.db_path, int(p["id"]))
                     st.rerun()
 
                 if st.button("Bỏ toàn bộ video", key=f"clear_vids_{p['id']}", disabled=not has_videos):
-                    update_post(cfg.db_path, int(p["id"]), {
-                        "video_file_names_json": "[]",
-                        "video_urls_json": "[]",
-                        "video_file_name": "",
-                        "video_url": "",
-                        "last_error": "",
-                    })
+                    set_post_media(cfg.db_path, int(p["id"]), "video_file", [])
+                    set_post_media(cfg.db_path, int(p["id"]), "video_url", [])
                     st.rerun()
 
-
-
+            st.markdown("#### Lên lịch đăng")
+            tz = ZoneInfo(cfg.timezone)
+            scheduled_at = str(p.get("scheduled_at") or "")
+            if scheduled_at:
+                local = dt.datetime.strptime(scheduled_at, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=dt.timezone.utc).astimezone(tz)
+                st.info(f"Đã lên lịch: {local:%d/%m/%Y %H:%M} ({cfg.timezone}).")
+            default_at = dt.datetime.now(tz) + dt.timedelta(hours=1)
+            col_d, col_t, col_s1, col_s2 = st.columns([2, 2, 1, 1])
+            with col_d:
+                sched_date = st.date_input("Ngày", value=default_at.date(), key=f"sched_date_{p['id']}")
+            with col_t:
+                sched_time = st.time_input("Giờ", value=default_at.time().replace(second=0, microsecond=0), key=f"sched_time_{p['id']}")
+            with col_s1:
+                if st.button("Lên lịch", key=f"sched_{p['id']}"):
+                    schedule_post(cfg.db_path, int(p["id"]), dt.datetime.combine(sched_date, sched_time, tzinfo=tz))
+                    st.rerun()
+            with col_s2:
+                if st.button("Huỷ lịch", key=f"unsched_{p['id']}", disabled=not scheduled_at):
+                    schedule_post(cfg.db_path, int(p["id"]), None)
+                    st.rerun()
+            st.caption("Bài đã lên lịch được scheduler.py đăng tự động bằng FB_PAGE_ACCESS_TOKEN trong .env.")
+
+            targets = list_post_targets(cfg.db_path, int(p["id"]))
+            if targets:
+                st.markdown("#### Fanpage đích")
+                st.caption("Mỗi fanpage được đăng và thử lại riêng; fanpage đã POSTED sẽ không bị đăng lại.")
+                st.dataframe(
+                    [
+                        {
+                            "Page": t["page_name"] or t["page_id"],
+                            "Trạng thái": t["status"],
+                            "Lịch": t["scheduled_at"] or "theo bài",
+                            "Caption riêng": "có" if t["caption_override"] else "",
+                            "Lần thử": t["attempts"],
+                            "Link": t["fb_post_url"],
+                            "Lỗi": t["last_error"],
+                        }
+                        for t in targets
+                    ],
+                    use_container_width=True,
+                    hide_index=True,
+                )
+                editable = [t for t in targets if t["status"] != "POSTED"]
+                if editable:
+                    with st.expander("Caption riêng cho từng fanpage"):
+                        labels = {f"{t['page_name'] or t['page_id']} ({t['page_id']})": t for t in editable}
+                        choice = st.selectbox("Fanpage", list(labels.keys()), key=f"target_sel_{p['id']}")
+                        t = labels[choice]
+                        override = st.text_area(
+                            "Caption (để trống = dùng caption của bài)",
+                            value=t["caption_override"],
+                            height=160,
+                            key=f"target_cap_{p['id']}_{t['id']}",
+                        )
+                        col_c1, col_c2 = st.columns(2)
+                        with col_c1:
+                            if st.button("Lưu caption", key=f"target_save_{p['id']}_{t['id']}"):
+                                upsert_post_targets(cfg.db_path, int(p["id"]), [
+                                    {"page_id": t["page_id"], "caption_override": override.strip()}
+                                ])
+                                st.rerun()
+                        with col_c2:
+                            if st.button("Bỏ fanpage này", key=f"target_rm_{p['id']}_{t['id']}"):
+                                remove_post_target(cfg.db_path, int(p["id"]), t["page_id"])
+                                st.rerun()
 
             st.markdown("#### Đăng thật")
             st.markdown("**Fanpage tokens**")
@@ -557,7 +720,7 @@ elif nav == "Preview & Đăng":
                     st.session_state[tokens_key].pop()
                     st.rerun()
             with col_tok3:
-                st.caption("Dán nhiều token → hệ thống sẽ đăng lên tất cả fanpage tương ứng.")
+                st.caption("Dán nhiều token → hệ thống sẽ đăng lên tất cả fanpage tương ứng (đăng song song, chỉ thử lại fanpage lỗi).")
             confirm1 = st.checkbox("Tôi đã kiểm tra caption và muốn đăng thật")
             confirm2 = st.text_input("Gõ POST để xác nhận", value="", max_chars=8)
             can_post = confirm1 and confirm2.strip().upper() == "POST"
@@ -565,20 +728,9 @@ elif nav == "Preview & Đăng":
             if st.button("ĐĂNG NGAY", type="secondary", disabled=not can_post):
                 try:
                     tokens = [str(t or "").strip() for t in st.session_state.get(tokens_key, []) if str(t or "").strip()]
-                    if len(tokens) >= 2:
-                        out = post_to_facebook_multi(int(selected_id), tokens)
-                        st.success(f"Đã đăng xong: {len(tokens)-int(out.get('failed',0))}/{len(tokens)} fanpage")
-                        st.json(out)
-                    elif len(tokens) == 1:
-                        out = post_to_facebook(int(selected_id), page_access_token_override=tokens[0])
-                        st.success("Đăng thành công.")
-                        st.write("Link bài:", out.get("post_url"))
-                        st.json(out.get("fb", {}))
-                    else:
-                        out = post_to_facebook(int(selected_id))
-                        st.success("Đăng thành công.")
-                        st.write("Link bài:", out.get("post_url"))
-                        st.json(out.get("fb", {}))
+                    # Runs in a background worker: the page stays usable and a refresh does not abort it.
+                    job_id = submit_publish(cfg.db_path, int(selected_id), tokens)
+                    st.toast(f"Đã đưa Post #{selected_id} vào hàng đợi đăng (job #{job_id}).")
                     st.rerun()
                 except Exception as e:
                     st.error(str(e))
\ No newline at end of file
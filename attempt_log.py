@@ -0,0 +1,68 @@
+import queue
+import atexit
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from db import insert_post_attempts
+
+# Attempts are buffered and written in one transaction every FLUSH_INTERVAL
+# seconds (or as soon as BATCH_SIZE are pending), off the publishing thread.
+FLUSH_INTERVAL = 0.5
+BATCH_SIZE = 100
+
+
+class AttemptLogger:
+    """Non-blocking, batched writer for post_attempts rows."""
+
+    def __init__(self) -> None:
+        self._q: "queue.Queue[Tuple[str, Dict[str, Any]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._flushed = threading.Condition()
+        self._pending = 0
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="attempt-log", daemon=True)
+                self._thread.start()
+
+    def record(self, db_path: str, attempt: Dict[str, Any]) -> None:
+        with self._flushed:
+            self._pending += 1
+        self._q.put((db_path, attempt))
+        self._ensure_started()
+
+    def _run(self) -> None:
+        while True:
+            items: List[Tuple[str, Dict[str, Any]]] = [self._q.get()]
+            try:
+                while len(items) < BATCH_SIZE:
+                    items.append(self._q.get(timeout=FLUSH_INTERVAL))
+            except queue.Empty:
+                pass
+            by_db: Dict[str, List[Dict[str, Any]]] = {}
+            for db_path, a in items:
+                by_db.setdefault(db_path, []).append(a)
+            for db_path, rows in by_db.items():
+                try:
+                    insert_post_attempts(db_path, rows)
+                except Exception:
+                    logging.exception("Failed to write %d publish attempt(s)", len(rows))
+            with self._flushed:
+                self._pending -= len(items)
+                self._flushed.notify_all()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Block until everything recorded so far is written (e.g. at exit)."""
+        with self._flushed:
+            return self._flushed.wait_for(lambda: self._pending <= 0, timeout=timeout)
+
+
+attempt_logger = AttemptLogger()
+atexit.register(attempt_logger.flush)
+
+
+def record_attempt(db_path: str, attempt: Dict[str, Any]) -> None:
+    attempt_logger.record(db_path, attempt)
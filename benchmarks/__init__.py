@@ -0,0 +1 @@
+"""Benchmarks for the DB, generation and publish paths (see benchmarks/run.py)."""
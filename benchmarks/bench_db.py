@@ -0,0 +1,66 @@
+"""create_post / list_posts / update_post / get_post latency at growing table sizes."""
+import os
+import random
+import sqlite3
+from typing import Any, Dict, List
+
+from benchmarks.common import measure
+
+STATUSES = ("DRAFT", "APPROVED", "POSTED", "FAILED")
+
+
+def prefill(db_path: str, rows: int, batch: int = 50_000) -> None:
+    """Bulk-insert `rows` posts (each with one image) in large transactions."""
+    from db import init_db, now_iso
+
+    init_db(db_path)
+    rng = random.Random(rows)
+    ts = now_iso()
+    conn = sqlite3.connect(db_path)
+    try:
+        start = conn.execute("SELECT COALESCE(MAX(id), 0) FROM posts").fetchone()[0]
+        for lo in range(0, rows, batch):
+            ids = range(start + lo + 1, start + min(rows, lo + batch) + 1)
+            conn.executemany(
+                "INSERT INTO posts(id, topic, main, status, caption, created_at, updated_at) VALUES(?,?,?,?,?,?,?)",
+                [(i, f"Chủ đề {i}", "Nội dung chính " * 8, rng.choice(STATUSES), "caption " * 20, ts, ts) for i in ids],
+            )
+            conn.executemany(
+                "INSERT INTO post_media(post_id, kind, source, position, created_at) VALUES(?,?,?,?,?)",
+                [(i, "image_url", f"https://cdn.example.com/{i}.jpg", 0, ts) for i in ids],
+            )
+            conn.commit()
+    finally:
+        conn.close()
+
+
+def bench_size(db_path: str, rows: int, iterations: int) -> Dict[str, Any]:
+    from db import create_post, get_post, list_posts, update_post
+
+    prefill(db_path, rows)
+    rng = random.Random(0)
+    out: Dict[str, Any] = {"rows": rows, "db_bytes": os.path.getsize(db_path)}
+    out["create_post"] = measure(
+        lambda i: create_post(db_path, {
+            "topic": f"bench {i}",
+            "main": "main",
+            "image_urls": [f"https://cdn.example.com/new-{i}-{k}.jpg" for k in range(3)],
+        }),
+        iterations,
+    )
+    out["get_post"] = measure(lambda i: get_post(db_path, rng.randint(1, rows)), iterations)
+    out["list_posts"] = measure(lambda i: list_posts(db_path, limit=200), iterations)
+    out["list_posts_by_status"] = measure(lambda i: list_posts(db_path, status="APPROVED", limit=200), iterations)
+    out["update_post"] = measure(
+        lambda i: update_post(db_path, rng.randint(1, rows), {"caption": f"updated {i}", "last_error": ""}),
+        iterations,
+    )
+    return out
+
+
+def run(work_dir: str, sizes: List[int], iterations: int) -> List[Dict[str, Any]]:
+    results = []
+    for rows in sizes:
+        db_path = os.path.join(work_dir, f"db-{rows}.db")
+        results.append(bench_size(db_path, rows, iterations))
+    return results
@@ -0,0 +1,38 @@
+"""generate_preview latency against the fake LLM (and SerpAPI) server.
+
+The variants cases compare getting VARIANTS captions for review from one
+call (generate_preview(variants=...)) with clicking "AI sinh nội dung" that
+many times.
+"""
+import os
+from typing import Any, Dict
+
+from benchmarks.common import measure
+
+VARIANTS = 3
+
+
+def run(work_dir: str, iterations: int) -> Dict[str, Any]:
+    from db import create_post, init_db
+
+    db_path = os.path.join(work_dir, "generate.db")
+    os.environ["DB_PATH"] = db_path
+    init_db(db_path)
+
+    from worker import generate_preview
+
+    ids = [
+        create_post(db_path, {"topic": f"Chủ đề {i}", "main": "Giới thiệu sản phẩm mới", "mandatory": "#adg"})
+        for i in range(iterations)
+    ]
+    out: Dict[str, Any] = {}
+    serp_key = os.environ.pop("SERPAPI_KEY", "")
+    out["without_serpapi"] = measure(lambda i: generate_preview(ids[i]), iterations)
+    out[f"variants_{VARIANTS}_one_call"] = measure(lambda i: generate_preview(ids[i], variants=VARIANTS), iterations)
+    out[f"variants_{VARIANTS}_separate_calls"] = measure(
+        lambda i: [generate_preview(ids[i]) for _ in range(VARIANTS)], iterations
+    )
+    if serp_key:
+        os.environ["SERPAPI_KEY"] = serp_key
+        out["with_serpapi"] = measure(lambda i: generate_preview(ids[i]), iterations)
+    return out
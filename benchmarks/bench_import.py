@@ -0,0 +1,74 @@
+"""Cold import time of the entry points, from `python -X importtime`.
+
+Each sample is a fresh interpreter; the figure is the cumulative import time
+of the entry module itself (interpreter and site start-up excluded). The CLI
+must not pull in the LLM/HTTP SDKs just to start.
+"""
+import os
+import sys
+import subprocess
+from typing import Any, Dict, List, Tuple
+
+from benchmarks.common import percentiles
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# entry point -> (module, p50 budget in ms, modules it must not import eagerly)
+TARGETS: Dict[str, Tuple[str, float, Tuple[str, ...]]] = {
+    "cli": ("main", 150.0, ("openai", "requests", "dotenv")),
+    "api": ("api", 900.0, ("openai",)),
+}
+
+
+def _import_once(module: str) -> Tuple[float, Dict[str, float]]:
+    """(cumulative ms of `module`, {top-level module: cumulative ms}) for one cold import."""
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=120,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed: {proc.stderr[-2000:]}")
+    total = 0.0
+    loaded: Dict[str, float] = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        try:
+            ms = int(cumulative.strip()) / 1000
+        except ValueError:
+            continue  # header line
+        if name.strip() == "site":
+            loaded.clear()  # interpreter start-up (site, .pth hooks) is not ours
+            continue
+        top = name.strip().split(".")[0]
+        loaded[top] = max(loaded.get(top, 0.0), ms)
+        if name.strip() == module:
+            total = ms
+    return total, loaded
+
+
+def run(iterations: int, budgets: Dict[str, float]) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    for target, (module, default_budget, forbidden) in TARGETS.items():
+        budget = budgets.get(target) or default_budget
+        samples: List[float] = []
+        loaded: Dict[str, float] = {}
+        for _ in range(max(1, iterations)):
+            ms, loaded = _import_once(module)
+            samples.append(ms)
+        stats = percentiles(samples)
+        heaviest = sorted(
+            ((m, round(v, 1)) for m, v in loaded.items() if m != module), key=lambda kv: kv[1], reverse=True
+        )[:8]
+        eager = [m for m in forbidden if m in loaded]
+        out[target] = {
+            "module": module,
+            **stats,
+            "budget_p50_ms": budget,
+            "heaviest_ms": dict(heaviest),
+            "eager_imports": eager,
+            "ok": stats["p50_ms"] <= budget and not eager,
+        }
+    return out
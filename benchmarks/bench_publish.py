@@ -0,0 +1,96 @@
+"""post_to_facebook per media shape, and post_to_facebook_multi fan-out scaling."""
+import os
+from typing import Any, Callable, Dict, List
+
+from benchmarks.common import measure, percentiles
+
+IMAGE_SIDE = 1600
+VIDEO_BYTES = 4 * 1024 * 1024
+
+
+def _make_media(upload_dir: str) -> Dict[str, List[str]]:
+    from PIL import Image
+
+    os.makedirs(upload_dir, exist_ok=True)
+    images = []
+    for i in range(3):
+        name = f"bench-{i}.jpg"
+        Image.new("RGB", (IMAGE_SIDE, IMAGE_SIDE), (40 * i, 120, 200)).save(os.path.join(upload_dir, name), quality=90)
+        images.append(name)
+    with open(os.path.join(upload_dir, "bench.mp4"), "wb") as f:
+        f.write(os.urandom(VIDEO_BYTES))
+    return {"images": images, "videos": ["bench.mp4"]}
+
+
+SCENARIOS: Dict[str, Callable[[Dict[str, List[str]]], Dict[str, Any]]] = {
+    "single_photo_file": lambda m: {"image_file_names": m["images"][:1]},
+    "album_files": lambda m: {"image_file_names": m["images"]},
+    "single_photo_url": lambda m: {"image_urls": ["https://cdn.example.com/a.jpg"]},
+    "album_urls": lambda m: {"image_urls": [f"https://cdn.example.com/{i}.jpg" for i in range(3)]},
+    "video_file": lambda m: {"video_file_names": m["videos"]},
+}
+
+
+def _new_post(db_path: str, media: Dict[str, Any], with_caption: bool) -> int:
+    from db import create_post, update_post
+
+    pid = create_post(db_path, {"topic": "Benchmark", "main": "Nội dung", "status": "APPROVED", **media})
+    if with_caption:
+        update_post(db_path, pid, {"caption": "Caption benchmark"})
+    return pid
+
+
+def _stage_percentiles(timings: List[Dict[str, float]]) -> Dict[str, Any]:
+    stages = sorted({k for t in timings for k in t})
+    return {s: percentiles([t[s] for t in timings if s in t])["p50_ms"] for s in stages}
+
+
+def run(work_dir: str, iterations: int, generate_caption: bool = False) -> Dict[str, Any]:
+    from db import init_db
+
+    db_path = os.path.join(work_dir, "publish.db")
+    os.environ["DB_PATH"] = db_path
+    init_db(db_path)
+
+    from worker import post_to_facebook
+
+    media = _make_media(os.path.join(work_dir, "uploads"))
+    out: Dict[str, Any] = {}
+    for name, build in SCENARIOS.items():
+        ids = [_new_post(db_path, build(media), not generate_caption) for _ in range(iterations)]
+        timings: List[Dict[str, float]] = []
+
+        def one(i: int) -> None:
+            res = post_to_facebook(ids[i], page_access_token_override=f"bench-token-{i % 4}")
+            timings.append(res.get("timings_ms", {}))
+
+        out[name] = measure(one, iterations)
+        out[name]["stages_p50_ms"] = _stage_percentiles(timings)
+    return out
+
+
+def run_multi(work_dir: str, iterations: int, fanouts: List[int]) -> List[Dict[str, Any]]:
+    from db import init_db
+
+    db_path = os.path.join(work_dir, "multi.db")
+    os.environ["DB_PATH"] = db_path
+    init_db(db_path)
+
+    from worker import post_to_facebook_multi
+
+    media = _make_media(os.path.join(work_dir, "uploads"))
+    results = []
+    for n in fanouts:
+        tokens = [f"bench-multi-{k:04d}" for k in range(n)]
+        ids = [_new_post(db_path, SCENARIOS["single_photo_file"](media), True) for _ in range(iterations)]
+        failed_targets = 0
+
+        def one(i: int) -> None:
+            nonlocal failed_targets
+            failed_targets += int(post_to_facebook_multi(ids[i], tokens).get("failed") or 0)
+
+        row: Dict[str, Any] = {"pages": n, **measure(one, iterations)}
+        row["failed_targets"] = failed_targets
+        row["ms_per_page_p50"] = round(row.get("p50_ms", 0) / n, 3)
+        results.append(row)
+    return results
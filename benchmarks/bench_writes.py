@@ -0,0 +1,131 @@
+"""Write throughput with many concurrent producers: per-call commits vs the single writer."""
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+from benchmarks.bench_db import prefill
+from benchmarks.common import percentiles
+
+ROWS = 1000
+# Every CREATE_EVERY-th write of a producer is a create_post, the rest update_post.
+CREATE_EVERY = 8
+MODES = ("legacy", "direct_wal", "single_writer")
+
+
+def _legacy_update(db_path: str, post_id: int, updates: Dict[str, Any]) -> None:
+    """update_post as it was before db_writer: rollback journal, own connection and commit."""
+    from db import now_iso
+
+    updates = dict(updates, updated_at=now_iso())
+    cols = ", ".join(f"{k} = ?" for k in updates)
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    try:
+        conn.execute(f"UPDATE posts SET {cols} WHERE id = ?", list(updates.values()) + [post_id])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _legacy_create(db_path: str, data: Dict[str, Any]) -> None:
+    from db import now_iso
+
+    ts = now_iso()
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    try:
+        conn.execute(
+            "INSERT INTO posts(topic, main, status, created_at, updated_at) VALUES(?,?,?,?,?)",
+            (data["topic"], data["main"], "DRAFT", ts, ts),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _run_producers(producers: int, writes: int, op: Callable[[int, int], None]) -> Dict[str, Any]:
+    samples: List[List[float]] = [[] for _ in range(producers)]
+    errors: Dict[str, int] = {}
+    lock = threading.Lock()
+    start = threading.Barrier(producers + 1)
+
+    def producer(n: int) -> None:
+        start.wait()
+        for i in range(writes):
+            t0 = time.perf_counter()
+            try:
+                op(n, i)
+            except Exception as e:
+                with lock:
+                    errors[str(e)[:60]] = errors.get(str(e)[:60], 0) + 1
+            samples[n].append((time.perf_counter() - t0) * 1000)
+
+    threads = [threading.Thread(target=producer, args=(n,)) for n in range(producers)]
+    for t in threads:
+        t.start()
+    start.wait()
+    t0 = time.perf_counter()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+    out = percentiles([s for per in samples for s in per])
+    out["errors"] = sum(errors.values())
+    if errors:
+        out["error_messages"] = errors
+    out["writes_per_sec"] = round(producers * writes / wall, 1) if wall > 0 else 0.0
+    return out
+
+
+def bench_mode(db_path: str, mode: str, producers: int, writes: int) -> Dict[str, Any]:
+    import db_writer
+    from db import create_post, update_post
+
+    prefill(db_path, ROWS)
+    if mode == "legacy":
+        conn = sqlite3.connect(db_path)
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.close()
+        update, create = _legacy_update, _legacy_create
+    else:
+        update, create = update_post, create_post
+    db_writer.SINGLE_WRITER = mode == "single_writer"
+    rngs = [random.Random(n) for n in range(producers)]
+
+    def op(n: int, i: int) -> None:
+        if i % CREATE_EVERY == CREATE_EVERY - 1:
+            create(db_path, {"topic": f"bench {n}-{i}", "main": "main"})
+        else:
+            update(db_path, rngs[n].randint(1, ROWS), {"caption": f"p{n} w{i}", "last_error": ""})
+
+    batches_before = _batches()
+    out = _run_producers(producers, writes, op)
+    if mode == "single_writer":
+        batches = _batches() - batches_before
+        out["transactions"] = int(batches)
+        out["writes_per_transaction"] = round(producers * writes / batches, 2) if batches else 0.0
+    return out
+
+
+def _batches() -> float:
+    from metrics import _counters
+
+    return sum(_counters.get("adg_db_write_batches_total", {}).values())
+
+
+def run(work_dir: str, producer_counts: List[int], iterations: int) -> Dict[str, Any]:
+    """`iterations` writes per producer, for each producer count and mode."""
+    import db_writer
+
+    saved = db_writer.SINGLE_WRITER
+    results: Dict[str, Any] = {}
+    try:
+        for mode in MODES:
+            for producers in producer_counts:
+                db_path = os.path.join(work_dir, f"writes-{mode}-{producers}.db")
+                results[f"{mode}_{producers}"] = dict(
+                    bench_mode(db_path, mode, producers, iterations), mode=mode, producers=producers
+                )
+    finally:
+        db_writer.SINGLE_WRITER = saved
+    return results
@@ -0,0 +1,45 @@
+import os
+import time
+from typing import Any, Callable, Dict, List
+
+
+def percentiles(samples_ms: List[float]) -> Dict[str, float]:
+    vals = sorted(samples_ms)
+    if not vals:
+        return {"n": 0}
+
+    def pct(q: float) -> float:
+        return round(vals[min(len(vals) - 1, int(round(q * (len(vals) - 1))))], 3)
+
+    return {
+        "n": len(vals),
+        "mean_ms": round(sum(vals) / len(vals), 3),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "max_ms": round(vals[-1], 3),
+    }
+
+
+def measure(fn: Callable[[int], Any], iterations: int) -> Dict[str, Any]:
+    """Call fn(i) `iterations` times; latency percentiles plus throughput."""
+    samples: List[float] = []
+    errors = 0
+    t_start = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        try:
+            fn(i)
+        except Exception:
+            errors += 1
+        samples.append((time.perf_counter() - t0) * 1000)
+    wall = time.perf_counter() - t_start
+    out = percentiles(samples)
+    out["errors"] = errors
+    out["ops_per_sec"] = round(iterations / wall, 1) if wall > 0 else 0.0
+    return out
+
+
+def set_env(env: Dict[str, str]) -> None:
+    for k, v in env.items():
+        os.environ[k] = v
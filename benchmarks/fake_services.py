@@ -0,0 +1,368 @@
+"""Local stand-ins for graph.facebook.com, an OpenAI-compatible API and SerpAPI.
+
+One threaded HTTP server answers all three, routed by path:
+
+  /v1/chat/completions   OpenAI-compatible chat completion (JSON caption)
+  /search.json           SerpAPI google search
+  everything else        Graph API (/me, /{page}/photos|feed|videos, batch)
+
+Each service has its own Fault settings (latency, jitter, error rate, upload
+bandwidth) so benchmarks can model slow or flaky upstreams. Run standalone for
+manual testing:
+
+  python -m benchmarks.fake_services --port 8099 --graph-latency-ms 150
+"""
+import re
+import json
+import time
+import random
+import argparse
+import itertools
+import threading
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+_REF = re.compile(r"\{result=([\w\-]+):\$\.([\w.*]+)\}")
+_VARIANTS = re.compile(r"gồm đúng (\d+) phương án")
+
+
+@dataclass
+class Fault:
+    """Latency/error model for one fake service."""
+
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0  # share of requests answered with a 500
+    upload_bytes_per_sec: float = 0.0  # 0 = request bodies cost no extra time
+    bad_json_rate: float = 0.0  # LLM only: reply with prose instead of a JSON object
+    repairable_json_rate: float = 0.0  # LLM only: JSON in a code fence with prose and raw newlines
+    json_schema: bool = True  # LLM only: accept response_format json_schema (else 400)
+
+
+@dataclass
+class FakeServices:
+    graph: Fault = field(default_factory=Fault)
+    llm: Fault = field(default_factory=Fault)
+    serp: Fault = field(default_factory=Fault)
+    seed: int = 0
+    # Apply every batch request, then answer it with "5xx", "reset" (close
+    # the connection, no response) or "garbage" (200 with a non-JSON body).
+    batch_failure: str = ""
+
+    def __post_init__(self) -> None:
+        self._rng = random.Random(self.seed)
+        self._rng_lock = threading.Lock()
+        self._ids = itertools.count(10_000)
+        self._server: Optional[ThreadingHTTPServer] = None
+        self.requests: Dict[str, int] = {"graph": 0, "graph_batch": 0, "llm": 0, "serp": 0}
+        # Published objects per Page for GET /{page}/feed|videos: {"id", "message", "created_time"}
+        self.published: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        self.injected_errors = 0
+
+    # --- lifecycle ---
+
+    def start(self, port: int = 0) -> "FakeServices":
+        services = self
+
+        class Handler(_Handler):
+            svc = services
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="fake-services", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def base_url(self) -> str:
+        if not self._server:
+            raise RuntimeError("Fake services not started")
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def env(self) -> Dict[str, str]:
+        """Environment that points worker.py at this server."""
+        return {
+            "FB_GRAPH_BASE_URL": self.base_url,
+            "OPENAI_BASE_URL": f"{self.base_url}/v1",
+            "OPENAI_API_KEY": "sk-bench",
+            "SERPAPI_URL": f"{self.base_url}/search.json",
+            "SERPAPI_KEY": "bench",
+        }
+
+    # --- behaviour ---
+
+    def _count(self, name: str) -> None:
+        with self._rng_lock:
+            self.requests[name] += 1
+
+    def _roll(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self._rng_lock:
+            return self._rng.random() < rate
+
+    def delay(self, fault: Fault, body_bytes: int = 0) -> None:
+        with self._rng_lock:
+            jitter = self._rng.uniform(-fault.jitter_ms, fault.jitter_ms) if fault.jitter_ms else 0.0
+        secs = max(0.0, fault.latency_ms + jitter) / 1000
+        if fault.upload_bytes_per_sec > 0 and body_bytes:
+            secs += body_bytes / fault.upload_bytes_per_sec
+        if secs:
+            time.sleep(secs)
+
+    def inject_error(self, fault: Fault) -> bool:
+        if self._roll(fault.error_rate):
+            with self._rng_lock:
+                self.injected_errors += 1
+            return True
+        return False
+
+    def handle_graph(self, method: str, path: str, form: Dict[str, str]) -> Tuple[int, Dict[str, Any]]:
+        parts = [p for p in path.split("/") if p]
+        if parts and re.fullmatch(r"v\d+(\.\d+)?", parts[0]):
+            parts = parts[1:]
+        token = form.get("access_token", "")
+        if "invalid" in token:
+            return 400, {"error": {"message": "Invalid OAuth access token.", "type": "OAuthException", "code": 190}}
+        if parts == ["me"]:
+            return 200, {"id": f"page_{token[-8:] or 'x'}", "name": f"Bench Page {token[-8:]}"}
+        if parts == ["debug_token"]:
+            return 200, {"data": {"is_valid": True, "profile_id": f"page_{form.get('input_token', '')[-8:]}"}}
+        if method == "GET" and len(parts) == 2 and parts[1] in ("feed", "videos"):
+            since = float(form.get("since") or 0)
+            with self._rng_lock:
+                items = list(self.published.get((parts[0], parts[1]), []))
+            field_name = "description" if parts[1] == "videos" else "message"
+            data = [
+                {"id": p["id"], field_name: p["message"], "created_time": p["created_time"]}
+                for p in reversed(items) if p["ts"] >= since
+            ]
+            return 200, {"data": data[: int(form.get("limit") or 25)]}
+        if len(parts) == 2 and parts[1] == "photos":
+            i = next(self._ids)
+            if str(form.get("published", "")).lower() == "false":
+                return 200, {"id": str(i)}
+            self._publish(parts[0], "feed", f"{parts[0]}_{i}", form.get("message", ""))
+            return 200, {"id": str(i), "post_id": f"{parts[0]}_{i}"}
+        if len(parts) == 2 and parts[1] == "feed":
+            post_id = f"{parts[0]}_{next(self._ids)}"
+            self._publish(parts[0], "feed", post_id, form.get("message", ""))
+            return 200, {"id": post_id}
+        if len(parts) == 2 and parts[1] == "videos":
+            video_id = str(next(self._ids))
+            self._publish(parts[0], "videos", video_id, form.get("description", ""))
+            return 200, {"id": video_id}
+        return 404, {"error": {"message": f"Unknown path /{'/'.join(parts)}", "code": 803}}
+
+    def _publish(self, page_id: str, edge: str, object_id: str, message: str) -> None:
+        now = time.time()
+        item = {
+            "id": object_id,
+            "message": message,
+            "ts": now,
+            "created_time": time.strftime("%Y-%m-%dT%H:%M:%S+0000", time.gmtime(now)),
+        }
+        with self._rng_lock:
+            self.published.setdefault((page_id, edge), []).append(item)
+
+    def handle_batch(self, form: Dict[str, str]) -> List[Optional[Dict[str, Any]]]:
+        named: Dict[str, Any] = {}
+        out: List[Optional[Dict[str, Any]]] = []
+        for item in json.loads(form["batch"]):
+            rel = urlparse(item.get("relative_url", ""))
+            body = {k: v[0] for k, v in parse_qs(item.get("body", "")).items()}
+            body.update({k: v[0] for k, v in parse_qs(rel.query).items()})
+            body.setdefault("access_token", form.get("access_token", ""))
+            refs = [n for v in body.values() for n, _ in _REF.findall(v)]
+            if any(n not in named for n in refs):
+                out.append(None)
+                continue
+            body = {k: _REF.sub(lambda m: _ref_value(named[m.group(1)], m.group(2)), v) for k, v in body.items()}
+            if self.inject_error(self.graph):
+                out.append({"code": 500, "body": json.dumps(_transient())})
+                continue
+            code, obj = self.handle_graph(item.get("method", "GET"), rel.path, body)
+            if item.get("name") and code < 400:
+                named[item["name"]] = obj
+            out.append({"code": code, "body": json.dumps(obj)})
+        return out
+
+    def handle_llm(self, req: Dict[str, Any]) -> Dict[str, Any]:
+        prompt = " ".join(str(m.get("content", "")) for m in req.get("messages", []))
+        m = _VARIANTS.search(prompt)  # llm_client's "list" variants mode
+        listed = int(m.group(1)) if m else 0
+        contents = [self._llm_content(listed) for _ in range(max(1, int(req.get("n") or 1)))]
+        prompt_tokens = max(1, len(prompt) // 4)
+        completion_tokens = max(1, sum(len(c) for c in contents) // 4)
+        return {
+            "id": f"chatcmpl-{next(self._ids)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": req.get("model", "bench"),
+            "choices": [
+                {"index": i, "message": {"role": "assistant", "content": c}, "finish_reason": "stop"}
+                for i, c in enumerate(contents)
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def _llm_content(self, listed: int) -> str:
+        captions = [
+            {"title": f"Tiêu đề benchmark {i + 1}", "content": "Nội dung benchmark " + "lorem ipsum " * 40}
+            for i in range(max(1, listed))
+        ]
+        obj: Any = {"variants": captions} if listed else captions[0]
+        if self._roll(self.llm.bad_json_rate):
+            return "Đây là bài viết của bạn: tiêu đề hay và nội dung hấp dẫn."
+        if self._roll(self.llm.repairable_json_rate):
+            body = json.dumps(obj, ensure_ascii=False).replace("benchmark ", "benchmark\n")
+            return f"Đây là bài viết:\n```json\n{body}\n```\nChúc bạn một ngày tốt lành!"
+        return json.dumps(obj, ensure_ascii=False)
+
+    def handle_serp(self, q: str) -> Dict[str, Any]:
+        return {
+            "related_searches": [{"query": f"{q} {i}"} for i in range(6)],
+            "organic_results": [{"title": f"{q} - kết quả {i}"} for i in range(10)],
+        }
+
+
+def _ref_value(obj: Any, path: str) -> str:
+    cur: List[Any] = [obj]
+    for part in path.split("."):
+        nxt: List[Any] = []
+        for c in cur:
+            if part == "*" and isinstance(c, list):
+                nxt.extend(c)
+            elif isinstance(c, dict) and part in c:
+                nxt.append(c[part])
+        cur = nxt
+    return ",".join(str(c) for c in cur)
+
+
+def _transient() -> Dict[str, Any]:
+    return {"error": {"message": "An unexpected error has occurred (injected).", "code": 2, "is_transient": True}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    svc: FakeServices
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+    def _send(self, code: int, obj: Any) -> None:
+        self._send_raw(code, json.dumps(obj, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8")
+
+    def _send_raw(self, code: int, body: bytes, ctype: str) -> None:
+        self.send_response(code)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, method: str, form: Dict[str, str], body_bytes: int, raw: bytes = b"") -> None:
+        svc = self.svc
+        path = urlparse(self.path).path
+        if path.endswith("/chat/completions"):
+            svc._count("llm")
+            svc.delay(svc.llm)
+            if svc.inject_error(svc.llm):
+                return self._send(500, {"error": {"message": "injected", "type": "server_error"}})
+            req = json.loads(raw or b"{}")
+            if (req.get("response_format") or {}).get("type") == "json_schema" and not svc.llm.json_schema:
+                return self._send(400, {"error": {
+                    "message": "response_format json_schema is not supported by this model",
+                    "type": "invalid_request_error", "param": "response_format",
+                }})
+            return self._send(200, svc.handle_llm(req))
+        if path.endswith("/search.json"):
+            svc._count("serp")
+            svc.delay(svc.serp)
+            if svc.inject_error(svc.serp):
+                return self._send(500, {"error": "injected"})
+            return self._send(200, svc.handle_serp(form.get("q", "")))
+        if method == "POST" and "batch" in form:
+            svc._count("graph_batch")
+            svc.delay(svc.graph, body_bytes)
+            out = svc.handle_batch(form)
+            if svc.batch_failure == "5xx":
+                return self._send(502, _transient())
+            if svc.batch_failure == "reset":
+                self.close_connection = True
+                return
+            if svc.batch_failure == "garbage":
+                return self._send_raw(200, b"<html>Service Unavailable</html>", "text/html")
+            return self._send(200, out)
+        svc._count("graph")
+        svc.delay(svc.graph, body_bytes)
+        if svc.inject_error(svc.graph):
+            return self._send(500, _transient())
+        self._send(*svc.handle_graph(method, path, form))
+
+    def do_GET(self) -> None:
+        q = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        self._dispatch("GET", q, 0)
+
+    def do_POST(self) -> None:
+        n = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(n) if n else b""
+        ctype = self.headers.get("Content-Type", "")
+        form: Dict[str, str] = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        if "multipart/form-data" in ctype:
+            form.update(_multipart_fields(raw, ctype))
+        elif "application/x-www-form-urlencoded" in ctype:
+            form.update({k: v[0] for k, v in parse_qs(raw.decode("utf-8", "replace")).items()})
+        self._dispatch("POST", form, n, raw)
+
+
+def _multipart_fields(raw: bytes, ctype: str) -> Dict[str, str]:
+    """Text fields of a multipart body (file parts are skipped)."""
+    m = re.search(r"boundary=\"?([^\";]+)", ctype)
+    if not m:
+        return {}
+    out: Dict[str, str] = {}
+    for part in raw.split(b"--" + m.group(1).encode()):
+        head, _, value = part.partition(b"\r\n\r\n")
+        name = re.search(rb'name="([^"]+)"', head)
+        if name and b"filename=" not in head:
+            out[name.group(1).decode()] = value.rstrip(b"\r\n").decode("utf-8", "replace")
+    return out
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Fake Graph/OpenAI/SerpAPI server for benchmarks")
+    p.add_argument("--port", type=int, default=8099)
+    p.add_argument("--graph-latency-ms", type=float, default=0)
+    p.add_argument("--llm-latency-ms", type=float, default=0)
+    p.add_argument("--serp-latency-ms", type=float, default=0)
+    p.add_argument("--error-rate", type=float, default=0, help="Applied to every service")
+    p.add_argument("--upload-mbps", type=float, default=0, help="Simulated Graph upload bandwidth (0 = unlimited)")
+    args = p.parse_args()
+
+    svc = FakeServices(
+        graph=Fault(args.graph_latency_ms, error_rate=args.error_rate, upload_bytes_per_sec=args.upload_mbps * 125_000),
+        llm=Fault(args.llm_latency_ms, error_rate=args.error_rate),
+        serp=Fault(args.serp_latency_ms, error_rate=args.error_rate),
+    ).start(args.port)
+    for k, v in svc.env().items():
+        print(f"{k}={v}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        svc.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Run the benchmark suites against local fake services and print JSON.
+
+  python -m benchmarks.run                                   # all suites, defaults
+  python -m benchmarks.run --suite db --rows 1000,100000,1000000
+  python -m benchmarks.run --suite publish,multi --graph-latency-ms 120 --error-rate 0.02 --out bench.json
+  python -m benchmarks.run --suite imports --import-budget-cli-ms 150   # exits 1 if over budget
+  python -m benchmarks.run --suite writes --producers 1,4,16 --iterations 200
+
+Nothing talks to the real Facebook/OpenAI/SerpAPI: the Graph, LLM and SerpAPI
+endpoints are redirected to benchmarks.fake_services via environment variables
+before worker.py is imported.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+from typing import Any, Dict, List
+
+from benchmarks.common import set_env
+from benchmarks.fake_services import FakeServices, Fault
+
+SUITES = ("db", "generate", "publish", "multi", "imports", "writes")
+
+
+def _ints(s: str) -> List[int]:
+    return [int(x) for x in s.split(",") if x.strip()]
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="ADG benchmarks (DB, generation, publish, import time)")
+    p.add_argument("--suite", default=",".join(SUITES), help=f"Comma-separated subset of {','.join(SUITES)}")
+    p.add_argument("--rows", default="1000,10000,100000", help="Table sizes for the db suite (e.g. ...,1000000)")
+    p.add_argument("--iterations", type=int, default=20, help="Measured calls per case")
+    p.add_argument("--fanout", default="1,2,4,8", help="Page counts for the multi suite")
+    p.add_argument("--producers", default="1,2,4,8,16", help="Concurrent writer threads for the writes suite")
+    p.add_argument("--graph-latency-ms", type=float, default=50)
+    p.add_argument("--llm-latency-ms", type=float, default=300)
+    p.add_argument("--serp-latency-ms", type=float, default=150)
+    p.add_argument("--jitter-ms", type=float, default=0)
+    p.add_argument("--error-rate", type=float, default=0.0, help="Injected 500s, applied to every fake service")
+    p.add_argument("--bad-json-rate", type=float, default=0.0, help="Share of LLM replies that are not JSON")
+    p.add_argument(
+        "--repairable-json-rate", type=float, default=0.0,
+        help="Share of LLM replies with malformed but locally repairable JSON",
+    )
+    p.add_argument("--upload-mbps", type=float, default=0, help="Simulated upload bandwidth to Graph (0 = unlimited)")
+    p.add_argument("--generate-caption", action="store_true", help="Publish posts without a caption (LLM in the path)")
+    p.add_argument("--optimize-images", action="store_true", help="Set IMAGE_OPTIMIZE=1 for the publish suites")
+    p.add_argument("--import-budget-cli-ms", type=float, default=0, help="p50 import budget for main.py (0 = default)")
+    p.add_argument("--import-budget-api-ms", type=float, default=0, help="p50 import budget for api.py (0 = default)")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--keep", action="store_true", help="Keep the temporary work directory")
+    p.add_argument("--out", default="", help="Write JSON here instead of stdout")
+    args = p.parse_args()
+
+    suites = [s.strip() for s in args.suite.split(",") if s.strip()]
+    unknown = [s for s in suites if s not in SUITES]
+    if unknown:
+        raise SystemExit(f"Unknown suite(s): {', '.join(unknown)}")
+
+    svc = FakeServices(
+        graph=Fault(args.graph_latency_ms, args.jitter_ms, args.error_rate, args.upload_mbps * 125_000),
+        llm=Fault(
+            args.llm_latency_ms, args.jitter_ms, args.error_rate,
+            bad_json_rate=args.bad_json_rate, repairable_json_rate=args.repairable_json_rate,
+        ),
+        serp=Fault(args.serp_latency_ms, args.jitter_ms, args.error_rate),
+        seed=args.seed,
+    ).start()
+    work_dir = tempfile.mkdtemp(prefix="adg-bench-")
+    # Must happen before worker/graph_batch are imported (they read base URLs at import time).
+    set_env(svc.env())
+    set_env({
+        "FB_PAGE_ACCESS_TOKEN": "",
+        "DEFAULT_PAGE_ID": "",
+        "PREFETCH_MEDIA": "0",
+        "IMAGE_OPTIMIZE": "1" if args.optimize_images else "0",
+    })
+
+    from metrics import reset, summary
+
+    report: Dict[str, Any] = {
+        "meta": {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_rev": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": {},
+    }
+    try:
+        for suite in suites:
+            reset()
+            t0 = time.perf_counter()
+            if suite == "db":
+                from benchmarks import bench_db
+
+                res: Any = bench_db.run(work_dir, _ints(args.rows), args.iterations)
+            elif suite == "generate":
+                from benchmarks import bench_generate
+
+                res = bench_generate.run(work_dir, args.iterations)
+            elif suite == "publish":
+                from benchmarks import bench_publish
+
+                res = bench_publish.run(work_dir, args.iterations, generate_caption=args.generate_caption)
+            elif suite == "multi":
+                from benchmarks import bench_publish
+
+                res = bench_publish.run_multi(work_dir, args.iterations, _ints(args.fanout))
+            elif suite == "writes":
+                from benchmarks import bench_writes
+
+                res = bench_writes.run(work_dir, _ints(args.producers), args.iterations)
+            else:
+                from benchmarks import bench_import
+
+                res = bench_import.run(
+                    min(args.iterations, 10),
+                    {"cli": args.import_budget_cli_ms, "api": args.import_budget_api_ms},
+                )
+            from attempt_log import attempt_logger
+
+            attempt_logger.flush()
+            report["results"][suite] = {
+                "wall_s": round(time.perf_counter() - t0, 2),
+                "cases": res,
+                "metrics": summary(),
+            }
+            print(f"[bench] {suite} done in {report['results'][suite]['wall_s']}s", file=sys.stderr)
+    finally:
+        report["meta"]["fake_requests"] = dict(svc.requests)
+        report["meta"]["injected_errors"] = svc.injected_errors
+        svc.stop()
+        if args.keep:
+            print(f"[bench] work dir kept at {work_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    over = [t for t, r in report["results"].get("imports", {}).get("cases", {}).items() if not r["ok"]]
+    if over:
+        print(f"[bench] import budget exceeded: {', '.join(over)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,16 @@
 \
 import os
+import re
 import json
 import sqlite3
 import time
-from typing import Any, Dict, List, Optional
+import threading
+import datetime as dt
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, TypeVar
+
+from metrics import timed
+from db_writer import enable_wal
+from repository import repository
 
 SCHEMA = """
 CREATE TABLE IF NOT EXISTS posts (
@@ -30,7 +37,9 @@ CREATE TABLE IF NOT EXISTS posts (
   fb_post_url TEXT DEFAULT '',
     fb_post_ids_json TEXT DEFAULT '[]',
     fb_post_urls_json TEXT DEFAULT '[]',
+  publish_timings_json TEXT DEFAULT '{}',
   posted_at TEXT DEFAULT '',
+  scheduled_at TEXT DEFAULT '', -- UTC 'YYYY-MM-DDTHH:MM:SSZ'; '' = not scheduled
   created_at TEXT NOT NULL,
   updated_at TEXT NOT NULL,
   last_error TEXT DEFAULT ''
@@ -38,20 +47,312 @@ CREATE TABLE IF NOT EXISTS posts (
 
 CREATE INDEX IF NOT EXISTS idx_posts_status ON posts(status);
 CREATE INDEX IF NOT EXISTS idx_posts_created_at ON posts(created_at);
+
+CREATE TABLE IF NOT EXISTS post_media (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  post_id INTEGER NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+  kind TEXT NOT NULL, -- image_file | image_url | video_file | video_url
+  source TEXT NOT NULL, -- file name in uploads/ or remote URL
+  position INTEGER NOT NULL DEFAULT 0,
+  content_hash TEXT DEFAULT '',
+  fb_media_id TEXT DEFAULT '',
+  created_at TEXT NOT NULL,
+  validation_status TEXT DEFAULT '', -- '' | OK | INVALID (remote URLs only)
+  validation_error TEXT DEFAULT '',
+  validated_at TEXT DEFAULT '',
+  content_type TEXT DEFAULT '',
+  size_bytes INTEGER DEFAULT 0,
+  local_file TEXT DEFAULT '' -- prefetched copy, relative to uploads/
+);
+
+CREATE INDEX IF NOT EXISTS idx_post_media_post ON post_media(post_id, kind, position);
+CREATE INDEX IF NOT EXISTS idx_post_media_hash ON post_media(content_hash);
+
+-- Append-only publish history: one row per post_to_facebook attempt.
+CREATE TABLE IF NOT EXISTS post_attempts (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  post_id INTEGER NOT NULL,
+  page_id TEXT DEFAULT '',
+  token_fp TEXT DEFAULT '',
+  status TEXT NOT NULL, -- POSTED | FAILED
+  started_at TEXT NOT NULL,
+  finished_at TEXT NOT NULL,
+  duration_ms REAL NOT NULL DEFAULT 0,
+  stage_timings_json TEXT DEFAULT '{}',
+  http_status INTEGER DEFAULT 0,
+  graph_error_code INTEGER DEFAULT 0,
+  bytes_sent INTEGER DEFAULT 0,
+  fb_post_id TEXT DEFAULT '',
+  fb_post_url TEXT DEFAULT '',
+  error TEXT DEFAULT '',
+  idempotency_key TEXT DEFAULT '' -- publish_checkpoints.op_key
+);
+
+CREATE INDEX IF NOT EXISTS idx_post_attempts_post ON post_attempts(post_id, id);
+CREATE INDEX IF NOT EXISTS idx_post_attempts_page ON post_attempts(page_id, started_at);
+
+-- Background publish runs started from the UI/API. Tokens are never stored;
+-- progress_json is the live per-page / per-media state polled by the UI.
+CREATE TABLE IF NOT EXISTS publish_jobs (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  post_id INTEGER NOT NULL,
+  status TEXT NOT NULL DEFAULT 'QUEUED', -- QUEUED | RUNNING | DONE | FAILED
+  targets INTEGER NOT NULL DEFAULT 1,
+  owner TEXT DEFAULT '', -- host:pid of the process running the job
+  progress_json TEXT DEFAULT '{}',
+  result_json TEXT DEFAULT '{}',
+  error TEXT DEFAULT '',
+  created_at TEXT NOT NULL,
+  started_at TEXT DEFAULT '',
+  finished_at TEXT DEFAULT ''
+);
+
+CREATE INDEX IF NOT EXISTS idx_publish_jobs_post ON publish_jobs(post_id, id);
+CREATE INDEX IF NOT EXISTS idx_publish_jobs_status ON publish_jobs(status);
+
+-- Page id/name resolved from a Page access token. Keyed by a fingerprint,
+-- the raw token is never stored.
+CREATE TABLE IF NOT EXISTS page_token_cache (
+  token_fp TEXT PRIMARY KEY,
+  page_id TEXT DEFAULT '',
+  page_name TEXT DEFAULT '',
+  ok INTEGER NOT NULL DEFAULT 1, -- 0 = token known to be invalid (negative entry)
+  error TEXT DEFAULT '',
+  checked_at TEXT NOT NULL,
+  expires_at REAL NOT NULL -- unix time
+);
+
+-- One row per Page a post is published to. A post with targets fans out:
+-- each target is claimed, published and retried on its own, so a retry never
+-- reposts a Page that already succeeded. Tokens are not stored (see above).
+CREATE TABLE IF NOT EXISTS post_targets (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  post_id INTEGER NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+  page_id TEXT NOT NULL,
+  page_name TEXT DEFAULT '',
+  status TEXT NOT NULL DEFAULT 'PENDING', -- PENDING | RUNNING | POSTED | FAILED
+  scheduled_at TEXT DEFAULT '', -- UTC like posts.scheduled_at; '' = with the post
+  caption_override TEXT DEFAULT '', -- '' = the post's caption
+  fb_post_id TEXT DEFAULT '',
+  fb_post_url TEXT DEFAULT '',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  last_error TEXT DEFAULT '',
+  claimed_at REAL NOT NULL DEFAULT 0, -- unix time the current/last run started
+  posted_at TEXT DEFAULT '',
+  created_at TEXT NOT NULL,
+  updated_at TEXT NOT NULL,
+  UNIQUE(post_id, page_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_post_targets_due ON post_targets(status, scheduled_at);
+
+-- Idempotency ledger for Graph writes: one row per publish of a post's media
+-- to one Page (op_key), reused by every retry until it succeeds. Checkpoints
+-- are written before and after each Graph call; a create whose outcome is
+-- unknown (pending_index >= 0) is reconciled against the Page feed before
+-- anything is sent again. The lease keeps two workers off the same row.
+CREATE TABLE IF NOT EXISTS publish_checkpoints (
+  op_key TEXT PRIMARY KEY,
+  post_id INTEGER NOT NULL,
+  page_id TEXT NOT NULL,
+  stage TEXT NOT NULL DEFAULT '', -- '' | MEDIA_STAGED | CREATING | DONE
+  media_ids_json TEXT DEFAULT '[]', -- unpublished photo ids staged for this Page
+  staged_at REAL NOT NULL DEFAULT 0,
+  results_json TEXT DEFAULT '[]', -- Graph responses of the creates that went through, in order
+  pending_index INTEGER NOT NULL DEFAULT -1, -- create sent, outcome unknown
+  pending_message TEXT DEFAULT '',
+  pending_kind TEXT DEFAULT '', -- feed | video
+  pending_since REAL NOT NULL DEFAULT 0, -- unix time the pending create was sent
+  owner TEXT DEFAULT '',
+  lease_until REAL NOT NULL DEFAULT 0,
+  updated_at TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_publish_checkpoints_post ON publish_checkpoints(post_id);
+
+-- LLM usage per post: one row per caption generation (generate_ai_json run,
+-- including its JSON retries). Token counts are the provider's; the
+-- estimate is the local count of the prompt that was sent first.
+CREATE TABLE IF NOT EXISTS llm_usage (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  post_id INTEGER NOT NULL,
+  provider TEXT DEFAULT '', -- LLM_PROVIDERS entry that answered (see llm_router)
+  model TEXT DEFAULT '',
+  calls INTEGER NOT NULL DEFAULT 1,
+  prompt_tokens INTEGER NOT NULL DEFAULT 0,
+  completion_tokens INTEGER NOT NULL DEFAULT 0,
+  estimated_prompt_tokens INTEGER NOT NULL DEFAULT 0,
+  trimmed TEXT DEFAULT '', -- comma-separated prompt parts cut to fit the budget
+  json_repairs TEXT DEFAULT '', -- comma-separated local fixes applied to the reply (llm_json)
+  duration_ms REAL NOT NULL DEFAULT 0,
+  created_at TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_llm_usage_post ON llm_usage(post_id, id);
+
+-- Caption alternatives from one caption generation (a batch); the reviewer
+-- picks one in the Duyệt tab without another LLM call. The latest batch of
+-- a post is its current set.
+CREATE TABLE IF NOT EXISTS caption_variants (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  post_id INTEGER NOT NULL,
+  batch INTEGER NOT NULL,
+  position INTEGER NOT NULL DEFAULT 0,
+  title TEXT NOT NULL,
+  content TEXT NOT NULL,
+  caption TEXT NOT NULL, -- title + content + mandatory, as it would be posted
+  provider TEXT DEFAULT '',
+  model TEXT DEFAULT '',
+  selected INTEGER NOT NULL DEFAULT 0,
+  created_at TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_caption_variants_post ON caption_variants(post_id, batch);
+
+-- Moving estimates of transfer bandwidth (bytes/s), e.g. Graph uploads;
+-- used to size upload timeouts.
+CREATE TABLE IF NOT EXISTS bandwidth_estimates (
+  name TEXT PRIMARY KEY,
+  bytes_per_sec REAL NOT NULL,
+  samples INTEGER NOT NULL DEFAULT 1,
+  updated_at TEXT NOT NULL
+);
+
+-- Append-only change log maintained by triggers: every write to posts,
+-- post_media or post_targets gets a new, strictly increasing seq. Consumers
+-- (UI caches, workers, /posts/changes) remember the last seq they saw and
+-- fetch deltas.
+CREATE TABLE IF NOT EXISTS post_changes (
+  seq INTEGER PRIMARY KEY AUTOINCREMENT,
+  post_id INTEGER NOT NULL,
+  op TEXT NOT NULL, -- INSERT | UPDATE | DELETE (posts row) | MEDIA (post_media row) | TARGET (post_targets row)
+  status TEXT DEFAULT '',
+  changed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%SZ', 'now'))
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_posts_changes_i AFTER INSERT ON posts
+  BEGIN INSERT INTO post_changes(post_id, op, status) VALUES(NEW.id, 'INSERT', NEW.status); END;
+CREATE TRIGGER IF NOT EXISTS trg_posts_changes_u AFTER UPDATE ON posts
+  BEGIN INSERT INTO post_changes(post_id, op, status) VALUES(NEW.id, 'UPDATE', NEW.status); END;
+CREATE TRIGGER IF NOT EXISTS trg_posts_changes_d AFTER DELETE ON posts
+  BEGIN INSERT INTO post_changes(post_id, op, status) VALUES(OLD.id, 'DELETE', OLD.status); END;
+CREATE TRIGGER IF NOT EXISTS trg_post_media_changes_i AFTER INSERT ON post_media
+  BEGIN INSERT INTO post_changes(post_id, op) VALUES(NEW.post_id, 'MEDIA'); END;
+CREATE TRIGGER IF NOT EXISTS trg_post_media_changes_u AFTER UPDATE ON post_media
+  BEGIN INSERT INTO post_changes(post_id, op) VALUES(NEW.post_id, 'MEDIA'); END;
+CREATE TRIGGER IF NOT EXISTS trg_post_media_changes_d AFTER DELETE ON post_media
+  BEGIN INSERT INTO post_changes(post_id, op) VALUES(OLD.post_id, 'MEDIA'); END;
+CREATE TRIGGER IF NOT EXISTS trg_post_targets_changes_i AFTER INSERT ON post_targets
+  BEGIN INSERT INTO post_changes(post_id, op) VALUES(NEW.post_id, 'TARGET'); END;
+CREATE TRIGGER IF NOT EXISTS trg_post_targets_changes_u AFTER UPDATE ON post_targets
+  BEGIN INSERT INTO post_changes(post_id, op) VALUES(NEW.post_id, 'TARGET'); END;
+CREATE TRIGGER IF NOT EXISTS trg_post_targets_changes_d AFTER DELETE ON post_targets
+  BEGIN INSERT INTO post_changes(post_id, op) VALUES(OLD.post_id, 'TARGET'); END;
 """
 
+MEDIA_KINDS = ("image_file", "image_url", "video_file", "video_url")
+
+# Legacy (scalar column, JSON column) pairs on `posts` for each media kind.
+_LEGACY_MEDIA_COLUMNS = {
+    "image_file": ("image_file_name", "image_file_names_json"),
+    "image_url": ("image_url", "image_urls_json"),
+    "video_file": ("video_file_name", "video_file_names_json"),
+    "video_url": ("video_url", "video_urls_json"),
+}
+
+# Columns added to post_media after its first release: name -> column definition.
+_POST_MEDIA_ADDED_COLUMNS = {
+    "validation_status": "TEXT DEFAULT ''",
+    "validation_error": "TEXT DEFAULT ''",
+    "validated_at": "TEXT DEFAULT ''",
+    "content_type": "TEXT DEFAULT ''",
+    "size_bytes": "INTEGER DEFAULT 0",
+    "local_file": "TEXT DEFAULT ''",
+}
+
+# Columns added to post_attempts after its first release: name -> column definition.
+_POST_ATTEMPTS_ADDED_COLUMNS = {
+    "idempotency_key": "TEXT DEFAULT ''",
+}
+
+_LLM_USAGE_ADDED_COLUMNS = {
+    "json_repairs": "TEXT DEFAULT ''",
+    "provider": "TEXT DEFAULT ''",
+}
+
+# Indexes on columns added after the first release; created (on both engines)
+# once the columns exist.
+_ADDED_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_posts_due ON posts(status, scheduled_at)",
+]
+
+# Bump when adding a one-time migration to _run_migrations().
+SCHEMA_VERSION = 2
+# Bump when the PostgreSQL schema (tables, columns, triggers) changes; hosts
+# whose database is already at this version skip _init_postgres's DDL.
+POSTGRES_SCHEMA_VERSION = 3
+
+# post_changes rows kept by _prune_post_changes(); older consumers get reset=True.
+POST_CHANGES_KEEP = int(os.getenv("POST_CHANGES_KEEP", "100000"))
+# The log is pruned inside every N-th write() of a process.
+POST_CHANGES_PRUNE_EVERY = int(os.getenv("POST_CHANGES_PRUNE_EVERY", "1000"))
+
+T = TypeVar("T")
+
 def now_iso() -> str:
     return time.strftime("%Y-%m-%dT%H:%M:%S%z")
 
+def utc_now_iso() -> str:
+    """Current time in the posts.scheduled_at format (sorts as text)."""
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
 def connect(db_path: str) -> sqlite3.Connection:
-    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
-    conn = sqlite3.connect(db_path, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """A connection to DB_PATH: a sqlite3 one, or a pooled PostgreSQL one used the same way."""
+    return repository(db_path).connect()
+
+_writes: Dict[str, int] = {}
+_writes_lock = threading.Lock()
+
+# Databases init_db() has already brought up to date in this process.
+_initialized: Set[str] = set()
+_init_lock = threading.Lock()
+
+def write(db_path: str, fn: Callable[[sqlite3.Connection], T]) -> T:
+    """Run fn(conn) in a committed write transaction (single writer for SQLite, see db_writer)."""
+    with _writes_lock:
+        n = _writes[db_path] = _writes.get(db_path, 0) + 1
+    if POST_CHANGES_PRUNE_EVERY > 0 and n % POST_CHANGES_PRUNE_EVERY == 0:
+        def write_and_prune(conn: sqlite3.Connection) -> T:
+            out = fn(conn)
+            if repository(db_path).dialect == "postgres":
+                _sequence_post_changes(conn)  # bounds post_changes_pending when nobody reads changes
+            _prune_post_changes(conn, POST_CHANGES_KEEP)
+            return out
+
+        return repository(db_path).write(write_and_prune)
+    return repository(db_path).write(fn)
 
+def _insert_id(conn: sqlite3.Connection, sql: str, params: Sequence[Any]) -> int:
+    """Run an INSERT and return the new row's id (RETURNING works on SQLite >= 3.35 and PostgreSQL)."""
+    return int(conn.execute(f"{sql} RETURNING id", params).fetchall()[0][0])
+
+@timed()
 def init_db(db_path: str) -> None:
+    """Create or migrate the schema; once per process and database (load_config() calls it often)."""
+    postgres = repository(db_path).dialect == "postgres"
+    with _init_lock:
+        if db_path in _initialized and (postgres or os.path.exists(db_path)):
+            return
+        if postgres:
+            write(db_path, _init_postgres)
+        else:
+            _init_sqlite(db_path)
+        _initialized.add(db_path)
+
+def _init_sqlite(db_path: str) -> None:
     conn = connect(db_path)
     try:
+        enable_wal(conn)
         conn.executescript(SCHEMA)
         # Backfill columns for existing DBs without recreating the table
         cur = conn.execute("PRAGMA table_info(posts)")
@@ -68,6 +369,8 @@ def init_db(db_path: str) -> None:
                 "video_file_names_json",
                 "fb_post_ids_json",
                 "fb_post_urls_json",
+                "publish_timings_json",
+                "scheduled_at",
             ]
             if col not in existing
         ]
@@ -82,110 +385,411 @@ def init_db(db_path: str) -> None:
                 "fb_post_urls_json",
             ):
                 default = "'[]'"
+            elif col == "publish_timings_json":
+                default = "'{}'"
             conn.execute(f"ALTER TABLE posts ADD COLUMN {col} TEXT DEFAULT {default}")
 
-        # Backfill multi-image JSON arrays from legacy single-image fields when empty.
-        cur = conn.execute(
-            """
-            SELECT
-              id,
-              image_url, image_file_name, image_urls_json, image_file_names_json,
-              video_url, video_file_name, video_urls_json, video_file_names_json,
-              fb_post_id, fb_post_url, fb_post_ids_json, fb_post_urls_json
-            FROM posts
-            """
-        )
-        rows = cur.fetchall()
-        for r in rows:
-            pid = int(r[0])
-            image_url = (r[1] or "").strip()
-            image_file_name = (r[2] or "").strip()
-            img_urls_json = (r[3] or "[]").strip() or "[]"
-            img_fns_json = (r[4] or "[]").strip() or "[]"
-
-            video_url = (r[5] or "").strip()
-            video_file_name = (r[6] or "").strip()
-            vid_urls_json = (r[7] or "[]").strip() or "[]"
-            vid_fns_json = (r[8] or "[]").strip() or "[]"
-
-            fb_post_id = (r[9] or "").strip()
-            fb_post_url = (r[10] or "").strip()
-            fb_ids_json = (r[11] or "[]").strip() or "[]"
-            fb_urls_json = (r[12] or "[]").strip() or "[]"
-
-            if img_urls_json == "[]" and image_url:
-                conn.execute(
-                    "UPDATE posts SET image_urls_json = ? WHERE id = ?",
-                    (json.dumps([image_url], ensure_ascii=False), pid),
-                )
-            if img_fns_json == "[]" and image_file_name:
-                conn.execute(
-                    "UPDATE posts SET image_file_names_json = ? WHERE id = ?",
-                    (json.dumps([image_file_name], ensure_ascii=False), pid),
-                )
+        cur = conn.execute("PRAGMA table_info(post_media)")
+        existing = {row[1] for row in cur.fetchall()}
+        for col, decl in _POST_MEDIA_ADDED_COLUMNS.items():
+            if col not in existing:
+                conn.execute(f"ALTER TABLE post_media ADD COLUMN {col} {decl}")
 
-            if vid_urls_json == "[]" and video_url:
-                conn.execute(
-                    "UPDATE posts SET video_urls_json = ? WHERE id = ?",
-                    (json.dumps([video_url], ensure_ascii=False), pid),
-                )
-            if vid_fns_json == "[]" and video_file_name:
-                conn.execute(
-                    "UPDATE posts SET video_file_names_json = ? WHERE id = ?",
-                    (json.dumps([video_file_name], ensure_ascii=False), pid),
-                )
+        cur = conn.execute("PRAGMA table_info(post_attempts)")
+        existing = {row[1] for row in cur.fetchall()}
+        for col, decl in _POST_ATTEMPTS_ADDED_COLUMNS.items():
+            if col not in existing:
+                conn.execute(f"ALTER TABLE post_attempts ADD COLUMN {col} {decl}")
 
-            if fb_ids_json == "[]" and fb_post_id:
-                conn.execute(
-                    "UPDATE posts SET fb_post_ids_json = ? WHERE id = ?",
-                    (json.dumps([fb_post_id], ensure_ascii=False), pid),
-                )
-            if fb_urls_json == "[]" and fb_post_url:
-                conn.execute(
-                    "UPDATE posts SET fb_post_urls_json = ? WHERE id = ?",
-                    (json.dumps([fb_post_url], ensure_ascii=False), pid),
-                )
+        cur = conn.execute("PRAGMA table_info(llm_usage)")
+        existing = {row[1] for row in cur.fetchall()}
+        for col, decl in _LLM_USAGE_ADDED_COLUMNS.items():
+            if col not in existing:
+                conn.execute(f"ALTER TABLE llm_usage ADD COLUMN {col} {decl}")
+
+        for sql in _ADDED_INDEXES:
+            conn.execute(sql)
+
+        _run_migrations(conn)
         conn.commit()
     finally:
         conn.close()
 
-def create_post(db_path: str, data: Dict[str, Any]) -> int:
-    conn = connect(db_path)
+def _postgres_schema() -> str:
+    """SCHEMA's tables and indexes in PostgreSQL types, plus the post_changes triggers."""
+    ddl = SCHEMA.split("CREATE TRIGGER", 1)[0]
+    ddl = ddl.replace("INTEGER PRIMARY KEY AUTOINCREMENT", "BIGSERIAL PRIMARY KEY")
+    ddl = re.sub(r"\bINTEGER\b", "BIGINT", ddl)
+    ddl = re.sub(r"\bREAL\b", "DOUBLE PRECISION", ddl)
+    ddl = ddl.replace(
+        "(strftime('%Y-%m-%dT%H:%M:%SZ', 'now'))",
+        "(to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD\"T\"HH24:MI:SS\"Z\"'))",
+    )
+    return ddl + _POSTGRES_TRIGGERS
+
+# The SQLite triggers of SCHEMA as one PL/pgSQL function. Concurrent writers
+# would commit their changes out of seq order, and a consumer resuming after
+# the last seq it saw would miss a lower seq that committed later. So the
+# triggers only append to post_changes_pending (writers never wait on each
+# other), and _sequence_post_changes() moves committed rows into post_changes
+# one batch at a time: seqs are handed out after commit, in commit order.
+_POSTGRES_TRIGGERS = """
+CREATE TABLE IF NOT EXISTS post_changes_pending (
+  id BIGSERIAL PRIMARY KEY,
+  post_id BIGINT NOT NULL,
+  op TEXT NOT NULL,
+  status TEXT DEFAULT '',
+  changed_at TEXT NOT NULL DEFAULT (to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"'))
+);
+
+CREATE OR REPLACE FUNCTION log_post_change() RETURNS trigger AS $$
+BEGIN
+  IF TG_TABLE_NAME = 'posts' THEN
+    IF TG_OP = 'DELETE' THEN
+      INSERT INTO post_changes_pending(post_id, op, status) VALUES(OLD.id, 'DELETE', OLD.status);
+    ELSE
+      INSERT INTO post_changes_pending(post_id, op, status) VALUES(NEW.id, TG_OP, NEW.status);
+    END IF;
+  ELSIF TG_OP = 'DELETE' THEN
+    INSERT INTO post_changes_pending(post_id, op) VALUES(OLD.post_id, TG_ARGV[0]);
+  ELSE
+    INSERT INTO post_changes_pending(post_id, op) VALUES(NEW.post_id, TG_ARGV[0]);
+  END IF;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_posts_changes ON posts;
+CREATE TRIGGER trg_posts_changes AFTER INSERT OR UPDATE OR DELETE ON posts
+  FOR EACH ROW EXECUTE FUNCTION log_post_change('');
+DROP TRIGGER IF EXISTS trg_post_media_changes ON post_media;
+CREATE TRIGGER trg_post_media_changes AFTER INSERT OR UPDATE OR DELETE ON post_media
+  FOR EACH ROW EXECUTE FUNCTION log_post_change('MEDIA');
+DROP TRIGGER IF EXISTS trg_post_targets_changes ON post_targets;
+CREATE TRIGGER trg_post_targets_changes AFTER INSERT OR UPDATE OR DELETE ON post_targets
+  FOR EACH ROW EXECUTE FUNCTION log_post_change('TARGET');
+"""
+
+# pg_advisory_xact_lock key: hosts starting at once create the schema one at a time.
+_POSTGRES_INIT_LOCK = 0x616467
+# pg_try_advisory_xact_lock key: one _sequence_post_changes() at a time.
+_POSTGRES_SEQUENCE_LOCK = 0x616468
+
+def _sequence_post_changes(conn: sqlite3.Connection) -> None:
+    """PostgreSQL: give committed post_changes_pending rows their seq (see _POSTGRES_TRIGGERS).
+
+    Holds its lock until commit, so a later batch never commits lower seqs.
+    If another connection is sequencing, its batch shows up on the next read.
+    """
+    if not conn.execute("SELECT EXISTS(SELECT 1 FROM post_changes_pending)").fetchone()[0]:
+        return
+    if not conn.execute("SELECT pg_try_advisory_xact_lock(?)", (_POSTGRES_SEQUENCE_LOCK,)).fetchone()[0]:
+        return
+    conn.execute(
+        """
+        WITH moved AS (DELETE FROM post_changes_pending RETURNING id, post_id, op, status, changed_at)
+        INSERT INTO post_changes(post_id, op, status, changed_at)
+        SELECT post_id, op, status, changed_at FROM moved ORDER BY id
+        """
+    )
+
+def _sync_post_changes(db_path: str) -> None:
+    if repository(db_path).dialect == "postgres":
+        write(db_path, _sequence_post_changes)
+
+def _postgres_schema_version(conn: sqlite3.Connection) -> int:
+    if conn.execute("SELECT to_regclass('schema_version')").fetchone()[0] is None:
+        return 0
+    return int(conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0])
+
+def _init_postgres(conn: sqlite3.Connection) -> None:
+    # The DDL below replaces the trigger function and recreates the triggers,
+    # which locks the tables; only run it when the schema is out of date.
+    if _postgres_schema_version(conn) >= POSTGRES_SCHEMA_VERSION:
+        return
+    conn.execute("SELECT pg_advisory_xact_lock(?)", (_POSTGRES_INIT_LOCK,))
+    if _postgres_schema_version(conn) >= POSTGRES_SCHEMA_VERSION:
+        return
+    conn.execute(_postgres_schema())
+    for table, added in (
+        ("post_media", _POST_MEDIA_ADDED_COLUMNS),
+        ("post_attempts", _POST_ATTEMPTS_ADDED_COLUMNS),
+        ("llm_usage", _LLM_USAGE_ADDED_COLUMNS),
+    ):
+        for col, decl in added.items():
+            decl = re.sub(r"\bINTEGER\b", "BIGINT", decl)
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {col} {decl}")
+    for sql in _ADDED_INDEXES:
+        conn.execute(sql)
+    conn.execute("CREATE TABLE IF NOT EXISTS schema_version(version BIGINT NOT NULL)")
+    conn.execute("DELETE FROM schema_version")
+    conn.execute("INSERT INTO schema_version(version) VALUES(?)", (POSTGRES_SCHEMA_VERSION,))
+
+def _json_str_list(raw: Any) -> List[str]:
     try:
+        arr = json.loads(raw or "[]")
+    except Exception:
+        return []
+    if not isinstance(arr, list):
+        return []
+    return [str(x).strip() for x in arr if str(x).strip()]
+
+def _legacy_media_sources(row: Any) -> Dict[str, List[str]]:
+    """Reconcile legacy scalar + JSON media columns of a `posts` row."""
+    out: Dict[str, List[str]] = {}
+    for kind, (scalar_col, json_col) in _LEGACY_MEDIA_COLUMNS.items():
+        sources = _json_str_list(row[json_col])
+        scalar = (row[scalar_col] or "").strip()
+        if not sources and scalar:
+            sources = [scalar]
+        out[kind] = sources
+    return out
+
+def _migrate_v1_post_media(conn: sqlite3.Connection) -> None:
+    """Move media lists out of `posts` JSON columns into `post_media` rows."""
+    ts = now_iso()
+    cur = conn.execute(
+        """
+        SELECT
+          id,
+          image_url, image_file_name, image_urls_json, image_file_names_json,
+          video_url, video_file_name, video_urls_json, video_file_names_json,
+          fb_post_id, fb_post_url, fb_post_ids_json, fb_post_urls_json
+        FROM posts
+        WHERE id NOT IN (SELECT DISTINCT post_id FROM post_media)
+        """
+    )
+    for r in cur.fetchall():
+        pid = int(r["id"])
+        rows = []
+        for kind, sources in _legacy_media_sources(r).items():
+            for pos, src in enumerate(sources):
+                rows.append((pid, kind, src, pos, ts))
+        if rows:
+            conn.executemany(
+                "INSERT INTO post_media(post_id, kind, source, position, created_at) VALUES(?,?,?,?,?)",
+                rows,
+            )
+
+        fb_post_id = (r["fb_post_id"] or "").strip()
+        fb_post_url = (r["fb_post_url"] or "").strip()
+        if not _json_str_list(r["fb_post_ids_json"]) and fb_post_id:
+            conn.execute(
+                "UPDATE posts SET fb_post_ids_json = ? WHERE id = ?",
+                (json.dumps([fb_post_id], ensure_ascii=False), pid),
+            )
+        if not _json_str_list(r["fb_post_urls_json"]) and fb_post_url:
+            conn.execute(
+                "UPDATE posts SET fb_post_urls_json = ? WHERE id = ?",
+                (json.dumps([fb_post_url], ensure_ascii=False), pid),
+            )
+
+def _migrate_v2_drop_change_counter(conn: sqlite3.Connection) -> None:
+    """The single-row change_counter is superseded by post_changes."""
+    for table in ("posts", "post_media"):
+        for op in ("i", "u", "d"):
+            conn.execute(f"DROP TRIGGER IF EXISTS trg_{table}_{op}_counter")
+    conn.execute("DROP TABLE IF EXISTS change_counter")
+
+def _run_migrations(conn: sqlite3.Connection) -> None:
+    version = int(conn.execute("PRAGMA user_version").fetchone()[0])
+    if version >= SCHEMA_VERSION:
+        return
+    if version < 1:
+        _migrate_v1_post_media(conn)
+    if version < 2:
+        _migrate_v2_drop_change_counter(conn)
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+def _media_rows_from_data(data: Dict[str, Any]) -> Dict[str, List[str]]:
+    """Accept media either as lists (`image_urls`, ...) or legacy keys (`image_urls_json`, `image_url`, ...)."""
+    out: Dict[str, List[str]] = {}
+    for kind, (scalar_col, json_col) in _LEGACY_MEDIA_COLUMNS.items():
+        list_key = json_col[: -len("_json")]
+        raw = data.get(list_key)
+        if raw is None:
+            sources = _json_str_list(data.get(json_col))
+        else:
+            sources = [str(x).strip() for x in raw if str(x).strip()]
+        scalar = (data.get(scalar_col) or "").strip()
+        if not sources and scalar:
+            sources = [scalar]
+        out[kind] = sources
+    return out
+
+@timed()
+def create_post(db_path: str, data: Dict[str, Any]) -> int:
+    media = _media_rows_from_data(data)
+
+    def insert(conn: sqlite3.Connection) -> int:
         ts = now_iso()
-        cur = conn.execute(
+        post_id = _insert_id(
+            conn,
             """
             INSERT INTO posts(
-                            topic, main, extra_requirements, mandatory,
-                            image_url, image_file_name, image_urls_json, image_file_names_json,
-                            video_url, video_file_name, video_urls_json, video_file_names_json,
-                            page_id, status,
+              topic, main, extra_requirements, mandatory,
+              page_id, status,
               created_at, updated_at
-                                                ) VALUES(?,?,?,?, ?,?,?,?, ?,?,?,?, ?,?, ?,?)
+            ) VALUES(?,?,?,?, ?,?, ?,?)
             """,
             (
                 data.get("topic", "").strip(),
                 data.get("main", "").strip(),
-                                (data.get("extra_requirements") or "").strip(),
+                (data.get("extra_requirements") or "").strip(),
                 (data.get("mandatory") or "").strip(),
-                (data.get("image_url") or "").strip(),
-                (data.get("image_file_name") or "").strip(),
-                                (data.get("image_urls_json") or "[]").strip(),
-                                (data.get("image_file_names_json") or "[]").strip(),
-                (data.get("video_url") or "").strip(),
-                (data.get("video_file_name") or "").strip(),
-                                (data.get("video_urls_json") or "[]").strip(),
-                                (data.get("video_file_names_json") or "[]").strip(),
                 (data.get("page_id") or "").strip(),
                 (data.get("status") or "DRAFT").strip(),
                 ts, ts,
             ),
         )
-        conn.commit()
-        return int(cur.lastrowid)
+        hashes = data.get("content_hashes") or {}
+        for kind, sources in media.items():
+            _insert_media(conn, post_id, kind, sources, hashes, ts)
+        return post_id
+
+    return write(db_path, insert)
+
+def _insert_media(
+    conn: sqlite3.Connection,
+    post_id: int,
+    kind: str,
+    sources: List[str],
+    content_hashes: Dict[str, str],
+    ts: str,
+) -> None:
+    if kind not in MEDIA_KINDS:
+        raise ValueError(f"Unknown media kind: {kind}")
+    conn.executemany(
+        """
+        INSERT INTO post_media(post_id, kind, source, position, content_hash, created_at)
+        VALUES(?,?,?,?,?,?)
+        """,
+        [(post_id, kind, src, pos, content_hashes.get(src, ""), ts) for pos, src in enumerate(sources)],
+    )
+
+@timed()
+def list_post_media(db_path: str, post_id: int, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+    conn = connect(db_path)
+    try:
+        if kind:
+            cur = conn.execute(
+                "SELECT * FROM post_media WHERE post_id = ? AND kind = ? ORDER BY position, id",
+                (post_id, kind),
+            )
+        else:
+            cur = conn.execute(
+                "SELECT * FROM post_media WHERE post_id = ? ORDER BY kind, position, id",
+                (post_id,),
+            )
+        return [dict(r) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+@timed()
+def get_media(db_path: str, media_id: int) -> Optional[Dict[str, Any]]:
+    conn = connect(db_path)
+    try:
+        cur = conn.execute("SELECT * FROM post_media WHERE id = ?", (media_id,))
+        row = cur.fetchone()
+        return dict(row) if row else None
     finally:
         conn.close()
 
+@timed()
+def get_media_sources(db_path: str, post_ids: List[int]) -> Dict[int, Dict[str, List[str]]]:
+    """Ordered media sources per kind for many posts in one query."""
+    out: Dict[int, Dict[str, List[str]]] = {int(pid): {k: [] for k in MEDIA_KINDS} for pid in post_ids}
+    if not out:
+        return out
+    conn = connect(db_path)
+    try:
+        marks = ",".join("?" for _ in out)
+        cur = conn.execute(
+            f"SELECT post_id, kind, source FROM post_media WHERE post_id IN ({marks}) ORDER BY post_id, position, id",
+            list(out.keys()),
+        )
+        for r in cur.fetchall():
+            out[int(r["post_id"])].setdefault(r["kind"], []).append(r["source"])
+        return out
+    finally:
+        conn.close()
+
+def get_post_media_sources(db_path: str, post_id: int) -> Dict[str, List[str]]:
+    return get_media_sources(db_path, [post_id])[int(post_id)]
+
+@timed()
+def set_post_media(
+    db_path: str,
+    post_id: int,
+    kind: str,
+    sources: List[str],
+    content_hashes: Optional[Dict[str, str]] = None,
+) -> None:
+    """Replace the media of one kind for a post; other kinds are left untouched.
+
+    Rows whose source is kept stay as they are (validation, prefetched copy,
+    fb_media_id) apart from their position; only added and removed sources
+    are inserted and deleted.
+    """
+    if kind not in MEDIA_KINDS:
+        raise ValueError(f"Unknown media kind: {kind}")
+    sources = [str(s).strip() for s in sources if str(s).strip()]
+    hashes = content_hashes or {}
+
+    def diff(conn: sqlite3.Connection) -> None:
+        rows = conn.execute(
+            "SELECT id, source, position, content_hash FROM post_media WHERE post_id = ? AND kind = ? ORDER BY position, id",
+            (post_id, kind),
+        ).fetchall()
+        by_source: Dict[str, List[Any]] = {}
+        for r in rows:
+            by_source.setdefault(r["source"], []).append(r)
+        added: List[Any] = []
+        for pos, src in enumerate(sources):
+            kept = by_source.get(src)
+            if not kept:
+                added.append((post_id, kind, src, pos, hashes.get(src, ""), now_iso()))
+                continue
+            r = kept.pop(0)
+            h = hashes.get(src) or r["content_hash"]
+            if r["position"] != pos or r["content_hash"] != h:
+                conn.execute("UPDATE post_media SET position = ?, content_hash = ? WHERE id = ?", (pos, h, r["id"]))
+        removed = [(r["id"],) for left in by_source.values() for r in left]
+        if removed:
+            conn.executemany("DELETE FROM post_media WHERE id = ?", removed)
+        if added:
+            conn.executemany(
+                """
+                INSERT INTO post_media(post_id, kind, source, position, content_hash, created_at)
+                VALUES(?,?,?,?,?,?)
+                """,
+                added,
+            )
+        if removed or added or [r["source"] for r in rows] != sources:
+            conn.execute("UPDATE posts SET updated_at = ? WHERE id = ?", (now_iso(), post_id))
+
+    write(db_path, diff)
+
+@timed()
+def remove_post_media(db_path: str, post_id: int, kind: str, source: str) -> None:
+    def remove(conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "DELETE FROM post_media WHERE post_id = ? AND kind = ? AND source = ?",
+            (post_id, kind, source),
+        )
+        conn.execute("UPDATE posts SET updated_at = ? WHERE id = ?", (now_iso(), post_id))
+
+    write(db_path, remove)
+
+@timed()
+def update_post_media(db_path: str, media_id: int, updates: Dict[str, Any]) -> None:
+    if not updates:
+        return
+    cols = ", ".join([f"{k} = ?" for k in updates.keys()])
+    vals = list(updates.values()) + [media_id]
+    write(db_path, lambda conn: conn.execute(f"UPDATE post_media SET {cols} WHERE id = ?", vals))
+
+@timed()
 def get_post(db_path: str, post_id: int) -> Optional[Dict[str, Any]]:
     conn = connect(db_path)
     try:
@@ -195,20 +799,151 @@ def get_post(db_path: str, post_id: int) -> Optional[Dict[str, Any]]:
     finally:
         conn.close()
 
-def list_posts(db_path: str, status: Optional[str] = None, limit: int = 200) -> List[Dict[str, Any]]:
+@timed()
+def list_posts(db_path: str, status: Optional[str] = None, limit: int = 200, offset: int = 0) -> List[Dict[str, Any]]:
     conn = connect(db_path)
     try:
         if status:
             cur = conn.execute(
-                "SELECT * FROM posts WHERE status = ? ORDER BY id DESC LIMIT ?",
-                (status, limit),
+                "SELECT * FROM posts WHERE status = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+                (status, limit, offset),
             )
         else:
-            cur = conn.execute("SELECT * FROM posts ORDER BY id DESC LIMIT ?", (limit,))
+            cur = conn.execute("SELECT * FROM posts ORDER BY id DESC LIMIT ? OFFSET ?", (limit, offset))
+        return [dict(r) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+@timed()
+def list_due_posts(db_path: str, limit: int = 20, include_unscheduled: bool = False) -> List[Dict[str, Any]]:
+    """APPROVED posts whose scheduled_at has passed, oldest schedule first.
+
+    With include_unscheduled, posts without a schedule follow (newest first).
+    """
+    conn = connect(db_path)
+    try:
+        cur = conn.execute(
+            """
+            SELECT * FROM posts
+            WHERE status = 'APPROVED'
+              AND ((scheduled_at != '' AND scheduled_at <= ?) OR (? = 1 AND COALESCE(scheduled_at, '') = ''))
+            ORDER BY COALESCE(scheduled_at, '') = '', scheduled_at, id DESC
+            LIMIT ?
+            """,
+            (utc_now_iso(), 1 if include_unscheduled else 0, limit),
+        )
+        return [dict(r) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+def list_uncaptioned_drafts(db_path: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """DRAFT posts with no caption yet, oldest first."""
+    conn = connect(db_path)
+    try:
+        cur = conn.execute(
+            "SELECT * FROM posts WHERE status = 'DRAFT' AND COALESCE(caption, '') = '' ORDER BY id LIMIT ?",
+            (limit,),
+        )
+        return [dict(r) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+def list_posts_pending_prefetch(db_path: str, limit: int = 20) -> List[int]:
+    """DRAFT/APPROVED posts with remote media that has not been validated yet."""
+    conn = connect(db_path)
+    try:
+        cur = conn.execute(
+            """
+            SELECT DISTINCT m.post_id FROM post_media m JOIN posts p ON p.id = m.post_id
+            WHERE p.status IN ('DRAFT', 'APPROVED')
+              AND m.kind IN ('image_url', 'video_url')
+              AND COALESCE(m.validation_status, '') = ''
+            ORDER BY m.post_id LIMIT ?
+            """,
+            (limit,),
+        )
+        return [int(r[0]) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+@timed()
+def count_posts(db_path: str, status: Optional[str] = None) -> int:
+    conn = connect(db_path)
+    try:
+        if status:
+            cur = conn.execute("SELECT COUNT(*) FROM posts WHERE status = ?", (status,))
+        else:
+            cur = conn.execute("SELECT COUNT(*) FROM posts")
+        return int(cur.fetchone()[0])
+    finally:
+        conn.close()
+
+def get_change_counter(db_path: str) -> int:
+    """Latest post_changes seq; bumped on every write to posts/post_media."""
+    _sync_post_changes(db_path)
+    conn = connect(db_path)
+    try:
+        return repository(db_path).last_seq(conn, "post_changes", "seq")
+    finally:
+        conn.close()
+
+@timed()
+def changes_since(db_path: str, since: int = 0, limit: int = 500) -> Dict[str, Any]:
+    """Changes with seq > `since`, oldest first.
+
+    `post_ids` lists the distinct posts touched. `more` means another call is
+    needed to catch up. `reset` means the consumer fell behind the pruned log
+    (or the DB was recreated) and should reload everything from `last_seq`.
+    """
+    _sync_post_changes(db_path)
+    conn = connect(db_path)
+    try:
+        current = repository(db_path).last_seq(conn, "post_changes", "seq")
+        oldest = conn.execute("SELECT MIN(seq) FROM post_changes").fetchone()[0]
+        reset = since > current or (since < current and (oldest is None or since + 1 < int(oldest)))
+        if reset:
+            return {"since": since, "last_seq": current, "changes": [], "post_ids": [], "more": False, "reset": True}
+        cur = conn.execute(
+            "SELECT seq, post_id, op, status, changed_at FROM post_changes WHERE seq > ? ORDER BY seq LIMIT ?",
+            (since, limit),
+        )
+        changes = [dict(r) for r in cur.fetchall()]
+    finally:
+        conn.close()
+    last_seq = int(changes[-1]["seq"]) if changes else since
+    post_ids: List[int] = []
+    for c in changes:
+        if c["post_id"] not in post_ids:
+            post_ids.append(int(c["post_id"]))
+    return {
+        "since": since,
+        "last_seq": last_seq,
+        "changes": changes,
+        "post_ids": post_ids,
+        "more": last_seq < current,
+        "reset": False,
+    }
+
+def _prune_post_changes(conn: sqlite3.Connection, keep: int) -> None:
+    conn.execute(
+        "DELETE FROM post_changes WHERE seq <= (SELECT MAX(seq) FROM post_changes) - ?",
+        (keep,),
+    )
+
+@timed()
+def get_posts(db_path: str, post_ids: List[int]) -> List[Dict[str, Any]]:
+    """Current rows for the given ids (missing/deleted ids are skipped)."""
+    if not post_ids:
+        return []
+    conn = connect(db_path)
+    try:
+        marks = ",".join("?" for _ in post_ids)
+        cur = conn.execute(f"SELECT * FROM posts WHERE id IN ({marks}) ORDER BY id", [int(i) for i in post_ids])
         return [dict(r) for r in cur.fetchall()]
     finally:
         conn.close()
 
+@timed()
 def update_post(db_path: str, post_id: int, updates: Dict[str, Any]) -> None:
     if not updates:
         return
@@ -217,13 +952,487 @@ def update_post(db_path: str, post_id: int, updates: Dict[str, Any]) -> None:
 
     cols = ", ".join([f"{k} = ?" for k in updates.keys()])
     vals = list(updates.values()) + [post_id]
+    write(db_path, lambda conn: conn.execute(f"UPDATE posts SET {cols} WHERE id = ?", vals))
+
+def schedule_value(when: Optional[dt.datetime]) -> str:
+    """`when` in the scheduled_at format ('' for None); naive times are UTC."""
+    if when is None:
+        return ""
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=dt.timezone.utc)
+    return when.astimezone(dt.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def schedule_post(db_path: str, post_id: int, when: Optional[dt.datetime]) -> str:
+    """Set (None = clear) when the scheduler daemon publishes this post; naive times are UTC.
+
+    Returns the stored scheduled_at value.
+    """
+    value = schedule_value(when)
+    update_post(db_path, post_id, {"scheduled_at": value})
+    return value
 
+def set_status(db_path: str, post_id: int, status: str, error: str = "") -> None:
+    update_post(db_path, post_id, {"status": status, "last_error": error})
+
+@timed()
+def get_page_token_cache(db_path: str, token_fp: str) -> Optional[Dict[str, Any]]:
     conn = connect(db_path)
     try:
-        conn.execute(f"UPDATE posts SET {cols} WHERE id = ?", vals)
-        conn.commit()
+        cur = conn.execute("SELECT * FROM page_token_cache WHERE token_fp = ?", (token_fp,))
+        row = cur.fetchone()
+        return dict(row) if row else None
     finally:
         conn.close()
 
-def set_status(db_path: str, post_id: int, status: str, error: str = "") -> None:
-    update_post(db_path, post_id, {"status": status, "last_error": error})
+@timed()
+def put_page_token_cache(db_path: str, token_fp: str, entry: Dict[str, Any]) -> None:
+    params = (
+        token_fp,
+        entry.get("page_id", ""),
+        entry.get("page_name", ""),
+        1 if entry.get("ok", True) else 0,
+        entry.get("error", ""),
+        now_iso(),
+        float(entry.get("expires_at", 0)),
+    )
+    write(db_path, lambda conn: conn.execute(
+        """
+        INSERT INTO page_token_cache(token_fp, page_id, page_name, ok, error, checked_at, expires_at)
+        VALUES(?,?,?,?,?,?,?)
+        ON CONFLICT(token_fp) DO UPDATE SET
+          page_id = excluded.page_id,
+          page_name = excluded.page_name,
+          ok = excluded.ok,
+          error = excluded.error,
+          checked_at = excluded.checked_at,
+          expires_at = excluded.expires_at
+        """,
+        params,
+    ))
+
+def get_bandwidth_estimate(db_path: str, name: str) -> Optional[Dict[str, Any]]:
+    conn = connect(db_path)
+    try:
+        row = conn.execute("SELECT * FROM bandwidth_estimates WHERE name = ?", (name,)).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+def put_bandwidth_estimate(db_path: str, name: str, bytes_per_sec: float) -> None:
+    params = (name, float(bytes_per_sec), now_iso())
+    write(db_path, lambda conn: conn.execute(
+        """
+        INSERT INTO bandwidth_estimates(name, bytes_per_sec, samples, updated_at)
+        VALUES(?,?,1,?)
+        ON CONFLICT(name) DO UPDATE SET
+          bytes_per_sec = excluded.bytes_per_sec,
+          samples = bandwidth_estimates.samples + 1,
+          updated_at = excluded.updated_at
+        """,
+        params,
+    ))
+
+ATTEMPT_COLUMNS = (
+    "post_id", "page_id", "token_fp", "status", "started_at", "finished_at", "duration_ms",
+    "stage_timings_json", "http_status", "graph_error_code", "bytes_sent", "fb_post_id", "fb_post_url", "error",
+    "idempotency_key",
+)
+_ATTEMPT_NUMERIC_COLUMNS = ("duration_ms", "http_status", "graph_error_code", "bytes_sent")
+
+def _attempt_row(a: Dict[str, Any]) -> tuple:
+    return tuple(
+        (a.get(c) or 0) if c in _ATTEMPT_NUMERIC_COLUMNS else str(a.get(c) or "")
+        for c in ATTEMPT_COLUMNS
+    )
+
+@timed()
+def insert_post_attempts(db_path: str, attempts: List[Dict[str, Any]]) -> None:
+    if not attempts:
+        return
+    cols = ", ".join(ATTEMPT_COLUMNS)
+    marks = ",".join("?" for _ in ATTEMPT_COLUMNS)
+    rows = [_attempt_row(a) for a in attempts]
+    write(db_path, lambda conn: conn.executemany(f"INSERT INTO post_attempts({cols}) VALUES({marks})", rows))
+
+@timed()
+def list_post_attempts(db_path: str, post_id: int) -> List[Dict[str, Any]]:
+    conn = connect(db_path)
+    try:
+        cur = conn.execute("SELECT * FROM post_attempts WHERE post_id = ? ORDER BY id", (post_id,))
+        return [dict(r) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+@timed()
+def attempt_stats(db_path: str, since: str = "") -> List[Dict[str, Any]]:
+    """Failure rate and p95 publish time (successful attempts) per page."""
+    conn = connect(db_path)
+    try:
+        cur = conn.execute(
+            """
+            WITH a AS (
+              SELECT * FROM post_attempts WHERE started_at >= ?
+            ),
+            ranked AS (
+              SELECT page_id, duration_ms,
+                     ROW_NUMBER() OVER (PARTITION BY page_id ORDER BY duration_ms) AS rn,
+                     COUNT(*) OVER (PARTITION BY page_id) AS n
+              FROM a WHERE status = 'POSTED'
+            ),
+            p95 AS (
+              SELECT page_id, MIN(duration_ms) AS p95_ms
+              FROM ranked WHERE rn >= 0.95 * n
+              GROUP BY page_id
+            )
+            SELECT a.page_id,
+                   COUNT(*) AS attempts,
+                   SUM(CASE WHEN a.status = 'FAILED' THEN 1 ELSE 0 END) AS failures,
+                   ROUND(1.0 * SUM(CASE WHEN a.status = 'FAILED' THEN 1 ELSE 0 END) / COUNT(*), 4) AS failure_rate,
+                   ROUND(CAST(AVG(CASE WHEN a.status = 'POSTED' THEN a.duration_ms END) AS NUMERIC), 1) AS avg_ms,
+                   MAX(p95.p95_ms) AS p95_ms,
+                   SUM(a.bytes_sent) AS bytes_sent,
+                   MAX(a.started_at) AS last_attempt_at
+            FROM a LEFT JOIN p95 ON p95.page_id = a.page_id
+            GROUP BY a.page_id
+            ORDER BY attempts DESC
+            """,
+            (since or "",),
+        )
+        return [dict(r) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+@timed()
+def create_publish_job(db_path: str, post_id: int, targets: int, owner: str) -> int:
+    """Queue a job; owner '' leaves it to whichever publisher claims it (claim_publish_job)."""
+    return write(db_path, lambda conn: _insert_id(
+        conn,
+        "INSERT INTO publish_jobs(post_id, targets, owner, created_at) VALUES(?,?,?,?)",
+        (post_id, targets, owner, now_iso()),
+    ))
+
+@timed()
+def claim_publish_job(db_path: str, owner: str, job_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Take the oldest unassigned QUEUED publish job (or job `job_id`) for `owner`, marking it RUNNING.
+
+    Returns the job, or None when there is nothing to claim. Publishers in
+    several processes/hosts can call this at once: each job goes to one of
+    them, and on PostgreSQL a row another publisher is claiming is skipped
+    (FOR UPDATE SKIP LOCKED) instead of waited for.
+    """
+    repo = repository(db_path)
+    only = "AND id = ?" if job_id is not None else ""
+    sql = f"""
+        UPDATE publish_jobs SET status = 'RUNNING', owner = ?, started_at = ?
+        WHERE status = 'QUEUED' AND id = (
+          SELECT id FROM publish_jobs
+          WHERE status = 'QUEUED' AND COALESCE(owner, '') = '' {only}
+          ORDER BY id LIMIT 1{repo.skip_locked}
+        )
+        RETURNING *
+    """
+    params: List[Any] = [owner, now_iso()] + ([job_id] if job_id is not None else [])
+    rows = write(db_path, lambda conn: conn.execute(sql, params).fetchall())
+    return dict(rows[0]) if rows else None
+
+@timed()
+def expire_publish_job(db_path: str, job_id: int, error: str) -> bool:
+    """Mark job `job_id` FAILED if it is still QUEUED and unassigned; False if a publisher claimed it first."""
+    sql = """
+        UPDATE publish_jobs SET status = 'FAILED', error = ?, finished_at = ?
+        WHERE id = ? AND status = 'QUEUED' AND COALESCE(owner, '') = ''
+    """
+    return write(db_path, lambda conn: conn.execute(sql, (error, now_iso(), job_id)).rowcount) > 0
+
+@timed()
+def update_publish_job(db_path: str, job_id: int, updates: Dict[str, Any]) -> None:
+    if not updates:
+        return
+    cols = ", ".join([f"{k} = ?" for k in updates.keys()])
+    vals = list(updates.values()) + [job_id]
+    write(db_path, lambda conn: conn.execute(f"UPDATE publish_jobs SET {cols} WHERE id = ?", vals))
+
+@timed()
+def get_publish_job(db_path: str, job_id: int) -> Optional[Dict[str, Any]]:
+    conn = connect(db_path)
+    try:
+        row = conn.execute("SELECT * FROM publish_jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+@timed()
+def list_publish_jobs(
+    db_path: str, post_id: Optional[int] = None, active_only: bool = False, limit: int = 20
+) -> List[Dict[str, Any]]:
+    where: List[str] = []
+    args: List[Any] = []
+    if post_id is not None:
+        where.append("post_id = ?")
+        args.append(post_id)
+    if active_only:
+        where.append("status IN ('QUEUED', 'RUNNING')")
+    sql = "SELECT * FROM publish_jobs"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    conn = connect(db_path)
+    try:
+        cur = conn.execute(sql + " ORDER BY id DESC LIMIT ?", args + [limit])
+        return [dict(r) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+TARGET_COLUMNS = ("page_name", "scheduled_at", "caption_override")
+# A RUNNING target whose worker died is claimable again after this long.
+TARGET_STALE_SECONDS = 3600
+
+@timed()
+def upsert_post_targets(db_path: str, post_id: int, targets: List[Dict[str, Any]]) -> None:
+    """Add targets (dicts with page_id and optionally TARGET_COLUMNS) to a post.
+
+    Existing targets get the given fields updated, except POSTED ones, which
+    are left alone.
+    """
+    now = now_iso()
+
+    def upsert(conn: sqlite3.Connection) -> None:
+        for t in targets:
+            page_id = str(t.get("page_id") or "").strip()
+            if not page_id:
+                continue
+            given = [c for c in TARGET_COLUMNS if c in t]
+            sets = ", ".join([f"{c} = excluded.{c}" for c in given] + ["updated_at = excluded.updated_at"])
+            conn.execute(
+                f"""
+                INSERT INTO post_targets(post_id, page_id, page_name, scheduled_at, caption_override, created_at, updated_at)
+                VALUES(?,?,?,?,?,?,?)
+                ON CONFLICT(post_id, page_id) DO UPDATE SET {sets}
+                WHERE post_targets.status != 'POSTED'
+                """,
+                (
+                    post_id,
+                    page_id,
+                    str(t.get("page_name") or ""),
+                    str(t.get("scheduled_at") or ""),
+                    str(t.get("caption_override") or ""),
+                    now,
+                    now,
+                ),
+            )
+
+    write(db_path, upsert)
+
+@timed()
+def list_post_targets(db_path: str, post_id: int) -> List[Dict[str, Any]]:
+    conn = connect(db_path)
+    try:
+        cur = conn.execute("SELECT * FROM post_targets WHERE post_id = ? ORDER BY id", (post_id,))
+        return [dict(r) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+def remove_post_target(db_path: str, post_id: int, page_id: str) -> bool:
+    """Drop a target that has not been posted yet. False if missing or already POSTED."""
+    return write(db_path, lambda conn: conn.execute(
+        "DELETE FROM post_targets WHERE post_id = ? AND page_id = ? AND status != 'POSTED'", (post_id, page_id)
+    ).rowcount) > 0
+
+@timed()
+def claim_post_target(db_path: str, target_id: int) -> bool:
+    """Mark a PENDING/FAILED (or stale RUNNING) target RUNNING. False if another run has it or it is POSTED."""
+    now = time.time()
+    cur = write(db_path, lambda conn: conn.execute(
+        """
+        UPDATE post_targets SET status = 'RUNNING', attempts = attempts + 1, claimed_at = ?, updated_at = ?
+        WHERE id = ? AND (status IN ('PENDING', 'FAILED') OR (status = 'RUNNING' AND claimed_at < ?))
+        """,
+        (now, now_iso(), target_id, now - TARGET_STALE_SECONDS),
+    ))
+    return cur.rowcount == 1
+
+@timed()
+def update_post_target(db_path: str, target_id: int, updates: Dict[str, Any]) -> None:
+    if not updates:
+        return
+    updates = dict(updates)
+    updates["updated_at"] = now_iso()
+    cols = ", ".join([f"{k} = ?" for k in updates.keys()])
+    vals = list(updates.values()) + [target_id]
+    write(db_path, lambda conn: conn.execute(f"UPDATE post_targets SET {cols} WHERE id = ?", vals))
+
+def list_posts_with_due_targets(db_path: str, limit: int = 20) -> List[int]:
+    """APPROVED posts with an unposted target whose own schedule has passed.
+
+    Targets without a schedule go out with their post (see list_due_posts).
+    """
+    conn = connect(db_path)
+    try:
+        cur = conn.execute(
+            """
+            SELECT t.post_id FROM post_targets t JOIN posts p ON p.id = t.post_id
+            WHERE p.status = 'APPROVED' AND t.status IN ('PENDING', 'FAILED')
+              AND t.scheduled_at != '' AND t.scheduled_at <= ?
+            GROUP BY t.post_id ORDER BY MIN(t.scheduled_at) LIMIT ?
+            """,
+            (utc_now_iso(), limit),
+        )
+        return [int(r[0]) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+@timed()
+def acquire_publish_checkpoint(
+    db_path: str, op_key: str, post_id: int, page_id: str, owner: str, lease_seconds: float
+) -> Optional[Dict[str, Any]]:
+    """Take (or create) the checkpoint row for `op_key` under a lease.
+
+    Returns the row, or None while another owner holds an unexpired lease.
+    """
+    now = time.time()
+
+    def acquire(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+        conn.execute(
+            """
+            INSERT INTO publish_checkpoints(op_key, post_id, page_id, owner, lease_until, updated_at)
+            VALUES(?,?,?,?,?,?)
+            ON CONFLICT(op_key) DO UPDATE SET
+              owner = excluded.owner, lease_until = excluded.lease_until, updated_at = excluded.updated_at
+            WHERE publish_checkpoints.lease_until < ? OR publish_checkpoints.owner = excluded.owner
+            """,
+            (op_key, post_id, page_id, owner, now + lease_seconds, now_iso(), now),
+        )
+        row = conn.execute("SELECT * FROM publish_checkpoints WHERE op_key = ?", (op_key,)).fetchone()
+        return dict(row) if row and row["owner"] == owner else None
+
+    return write(db_path, acquire)
+
+@timed()
+def update_publish_checkpoint(db_path: str, op_key: str, owner: str, updates: Dict[str, Any]) -> bool:
+    """Write a checkpoint. False if `owner` no longer holds the row."""
+    updates = dict(updates)
+    updates["updated_at"] = now_iso()
+    cols = ", ".join([f"{k} = ?" for k in updates.keys()])
+    vals = list(updates.values()) + [op_key, owner]
+    cur = write(db_path, lambda conn: conn.execute(
+        f"UPDATE publish_checkpoints SET {cols} WHERE op_key = ? AND owner = ?", vals
+    ))
+    return cur.rowcount == 1
+
+def list_publish_checkpoints(db_path: str, post_id: int) -> List[Dict[str, Any]]:
+    conn = connect(db_path)
+    try:
+        cur = conn.execute("SELECT * FROM publish_checkpoints WHERE post_id = ? ORDER BY updated_at", (post_id,))
+        return [dict(r) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+def insert_llm_usage(db_path: str, post_id: int, usage: Dict[str, Any]) -> None:
+    row = (
+        post_id,
+        str(usage.get("provider") or ""),
+        str(usage.get("model") or ""),
+        int(usage.get("calls") or 0),
+        int(usage.get("prompt_tokens") or 0),
+        int(usage.get("completion_tokens") or 0),
+        int(usage.get("estimated_prompt_tokens") or 0),
+        ",".join(usage.get("trimmed") or []),
+        ",".join(usage.get("json_repairs") or []),
+        float(usage.get("duration_ms") or 0),
+        now_iso(),
+    )
+    write(db_path, lambda conn: conn.execute(
+        """
+        INSERT INTO llm_usage(post_id, provider, model, calls, prompt_tokens, completion_tokens,
+                              estimated_prompt_tokens, trimmed, json_repairs, duration_ms, created_at)
+        VALUES(?,?,?,?,?,?,?,?,?,?,?)
+        """,
+        row,
+    ))
+
+def list_llm_usage(db_path: str, post_id: int) -> List[Dict[str, Any]]:
+    conn = connect(db_path)
+    try:
+        cur = conn.execute("SELECT * FROM llm_usage WHERE post_id = ? ORDER BY id", (post_id,))
+        return [dict(r) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+def save_caption_variants(
+    db_path: str, post_id: int, variants: List[Dict[str, Any]], post_updates: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    """Store a new batch of caption variants (the first one selected) and update the post, in one transaction."""
+    ts = now_iso()
+
+    def save(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+        batch = conn.execute(
+            "SELECT COALESCE(MAX(batch), 0) + 1 FROM caption_variants WHERE post_id = ?", (post_id,)
+        ).fetchone()[0]
+        conn.executemany(
+            """
+            INSERT INTO caption_variants(post_id, batch, position, title, content, caption,
+                                         provider, model, selected, created_at)
+            VALUES(?,?,?,?,?,?,?,?,?,?)
+            """,
+            [
+                (
+                    post_id, batch, i, v["title"], v["content"], v["caption"],
+                    str(v.get("provider") or ""), str(v.get("model") or ""), int(i == 0), ts,
+                )
+                for i, v in enumerate(variants)
+            ],
+        )
+        if post_updates:
+            updates = dict(post_updates, updated_at=ts)
+            conn.execute(
+                f"UPDATE posts SET {', '.join(f'{k} = ?' for k in updates)} WHERE id = ?",
+                list(updates.values()) + [post_id],
+            )
+        rows = conn.execute(
+            "SELECT * FROM caption_variants WHERE post_id = ? AND batch = ? ORDER BY position", (post_id, batch)
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    return write(db_path, save)
+
+def list_caption_variants(db_path: str, post_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    """The latest batch of caption variants for each of `post_ids`, in one query."""
+    out: Dict[int, List[Dict[str, Any]]] = {int(pid): [] for pid in post_ids}
+    if not out:
+        return out
+    conn = connect(db_path)
+    try:
+        marks = ",".join("?" for _ in out)
+        cur = conn.execute(
+            f"""
+            SELECT v.* FROM caption_variants v
+            JOIN (SELECT post_id, MAX(batch) AS batch FROM caption_variants
+                  WHERE post_id IN ({marks}) GROUP BY post_id) latest
+              ON latest.post_id = v.post_id AND latest.batch = v.batch
+            ORDER BY v.post_id, v.position
+            """,
+            list(out.keys()),
+        )
+        for r in cur.fetchall():
+            out[int(r["post_id"])].append(dict(r))
+        return out
+    finally:
+        conn.close()
+
+def select_caption_variant(db_path: str, variant_id: int) -> Optional[Dict[str, Any]]:
+    """Make a stored variant the post's caption (ai_title/ai_content/caption). None if it does not exist."""
+    def select(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+        row = conn.execute("SELECT * FROM caption_variants WHERE id = ?", (variant_id,)).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE caption_variants SET selected = CASE WHEN id = ? THEN 1 ELSE 0 END WHERE post_id = ? AND batch = ?",
+            (variant_id, row["post_id"], row["batch"]),
+        )
+        conn.execute(
+            "UPDATE posts SET ai_title = ?, ai_content = ?, caption = ?, updated_at = ? WHERE id = ?",
+            (row["title"], row["content"], row["caption"], now_iso(), row["post_id"]),
+        )
+        return dict(row, selected=1)
+
+    return write(db_path, select)
+
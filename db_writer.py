@@ -0,0 +1,194 @@
+import os
+import time
+import queue
+import logging
+import sqlite3
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+
+from metrics import inc, observe
+
+# The database runs in WAL mode, so readers never block the writer or each
+# other. Writes from API requests, scheduler jobs, publish workers and
+# Streamlit sessions go through one writer thread per database file, which
+# commits them in groups: everything queued while the previous transaction
+# was committing goes into the next one, so N concurrent writers cost one
+# lock acquisition and one fsync instead of N. Callers still block until
+# their write is committed, so db.py functions keep their behaviour.
+SINGLE_WRITER = os.getenv("DB_SINGLE_WRITER", "1") != "0"
+# Upper bound on writes per transaction, which bounds how long a write can
+# wait behind the writes queued before it.
+WRITE_BATCH_MAX = int(os.getenv("DB_WRITE_BATCH_MAX", "256"))
+# Once a group has started, wait at most this long for more writes to join
+# it (0 = commit whatever is already queued).
+WRITE_MAX_DELAY_MS = float(os.getenv("DB_WRITE_MAX_DELAY_MS", "0"))
+# How long a connection waits for a lock held by another process (or, with
+# DB_SINGLE_WRITER=0, another thread) before "database is locked".
+BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+
+T = TypeVar("T")
+
+
+def open_connection(db_path: str, autocommit: bool = False) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(
+        db_path,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+        isolation_level=None if autocommit else "",
+    )
+    conn.row_factory = sqlite3.Row
+    # Durable at each checkpoint rather than each commit; safe with WAL.
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+
+def enable_wal(conn: sqlite3.Connection) -> None:
+    """Switch the database file to WAL (persistent; a no-op once set)."""
+    mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    if str(mode).lower() != "wal":
+        conn.execute("PRAGMA journal_mode = WAL")
+
+
+class DBWriter:
+    """Single writer thread for one database file; see write()."""
+
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        self._q: "queue.Queue[Tuple[Callable[[sqlite3.Connection], object], Future]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def in_writer(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def submit(self, fn: Callable[[sqlite3.Connection], T]) -> "Future[T]":
+        f: "Future[T]" = Future()
+        self._q.put((fn, f))
+        self._ensure_started()
+        return f
+
+    def _next_batch(self) -> List[Tuple[Callable[[sqlite3.Connection], object], Future]]:
+        batch = [self._q.get()]
+        deadline = time.monotonic() + WRITE_MAX_DELAY_MS / 1000
+        while len(batch) < WRITE_BATCH_MAX:
+            try:
+                batch.append(self._q.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            try:
+                batch.append(self._q.get(timeout=left))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        conn: Optional[sqlite3.Connection] = None
+        while True:
+            batch = self._next_batch()
+            try:
+                if conn is None:
+                    conn = open_connection(self.db_path, autocommit=True)
+                    enable_wal(conn)
+            except Exception as e:
+                for _, f in batch:
+                    f.set_exception(e)
+                continue
+            self._commit(conn, batch)
+
+    def _commit(self, conn: sqlite3.Connection, batch: List[Tuple[Callable[[sqlite3.Connection], object], Future]]) -> None:
+        """Run the batch in one transaction; a failing write is rolled back alone (savepoint)."""
+        t0 = time.perf_counter()
+        single = len(batch) == 1
+        results: List[Tuple[Future, object, Optional[BaseException]]] = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, f in batch:
+                if single:
+                    results.append((f, fn(conn), None))
+                    continue
+                conn.execute("SAVEPOINT w")
+                try:
+                    results.append((f, fn(conn), None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO w")
+                    results.append((f, None, e))
+                conn.execute("RELEASE w")
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                try:
+                    conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    logging.exception("Rollback of a write batch failed")
+            inc("adg_db_writes_total", len(batch), result="error")
+            for _, f in batch:
+                f.set_exception(e)
+            return
+        observe("adg_db_write_commit_seconds", time.perf_counter() - t0)
+        inc("adg_db_write_batches_total")
+        failed = sum(1 for _, _, e in results if e is not None)
+        inc("adg_db_writes_total", len(batch) - failed, result="ok")
+        if failed:
+            inc("adg_db_writes_total", failed, result="error")
+        for f, value, err in results:
+            if err is not None:
+                f.set_exception(err)
+            else:
+                f.set_result(value)
+
+
+_writers: Dict[str, DBWriter] = {}
+_lock = threading.Lock()
+
+
+def db_writer(db_path: str) -> DBWriter:
+    """The process-wide writer for this database file."""
+    key = os.path.abspath(db_path)
+    with _lock:
+        w = _writers.get(key)
+        if w is None:
+            w = _writers[key] = DBWriter(db_path)
+    return w
+
+
+def write(db_path: str, fn: Callable[[sqlite3.Connection], T]) -> T:
+    """Run fn(conn) inside a committed write transaction and return its result.
+
+    `fn` only executes statements (no commit/rollback). Blocks until the
+    transaction holding it has committed; exceptions raised by `fn` (or by
+    the commit) are re-raised here. With DB_SINGLE_WRITER=0 the write runs
+    on a connection of its own, as before.
+    """
+    if not SINGLE_WRITER:
+        conn = open_connection(db_path)
+        try:
+            out = fn(conn)
+            conn.commit()
+            return out
+        finally:
+            conn.close()
+    w = db_writer(db_path)
+    if w.in_writer():
+        raise RuntimeError("write() called from inside a write")
+    return w.submit(fn).result()
+
+
+def _reset_after_fork() -> None:
+    global _lock
+    _writers.clear()
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,234 @@
+import os
+import re
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlencode
+
+from http_client import session
+from metrics import inc, span, timed
+from timeouts import api_timeout
+
+GRAPH_BASE_URL = (os.getenv("FB_GRAPH_BASE_URL") or "https://graph.facebook.com").rstrip("/")
+
+# Graph accepts at most 50 operations per batch request.
+MAX_BATCH_SIZE = 50
+
+_RESULT_REF = re.compile(r"\{result=([A-Za-z0-9_\-]+):\$\.([^}]*)\}")
+
+
+@dataclass
+class BatchOp:
+    """One sub-request of a Graph batch.
+
+    `body` holds form fields. Values may reference an *earlier* op of the same
+    batch with `{result=<name>:$.<path>}`; such ops always travel in the same
+    HTTP request as the op they reference. `access_token` overrides the batch
+    token for this op (e.g. posting to several Pages at once).
+    """
+
+    method: str
+    relative_url: str
+    body: Dict[str, Any] = field(default_factory=dict)
+    name: str = ""
+    access_token: Optional[str] = None
+
+    def depends_on(self) -> List[str]:
+        refs: List[str] = []
+        for v in self.body.values():
+            refs.extend(m.group(1) for m in _RESULT_REF.finditer(str(v)))
+        return refs
+
+
+def _json_path(data: Any, path: str) -> str:
+    """Resolve the `$.a.b` / `$.data.*.id` subset of JSONPath used by batch refs."""
+    cur: List[Any] = [data]
+    for part in [p for p in path.split(".") if p]:
+        nxt: List[Any] = []
+        for c in cur:
+            if part == "*" and isinstance(c, list):
+                nxt.extend(c)
+            elif isinstance(c, dict) and part in c:
+                nxt.append(c[part])
+        cur = nxt
+    return ",".join(str(c) for c in cur)
+
+
+def _group(ops: List[BatchOp]) -> List[List[int]]:
+    """Split op indexes into dependency-closed groups (union-find on names)."""
+    parent = list(range(len(ops)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    by_name = {op.name: i for i, op in enumerate(ops) if op.name}
+    for i, op in enumerate(ops):
+        for ref in op.depends_on():
+            if by_name.get(ref, len(ops)) >= i:
+                raise ValueError(f"Batch op references unknown or later name {ref!r}")
+            parent[find(i)] = find(by_name[ref])
+
+    groups: Dict[int, List[int]] = {}
+    for i in range(len(ops)):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+
+def _chunks(ops: List[BatchOp]) -> List[List[int]]:
+    chunks: List[List[int]] = []
+    cur: List[int] = []
+    for g in _group(ops):
+        if len(g) > MAX_BATCH_SIZE:
+            raise ValueError(f"Dependent batch group of {len(g)} ops exceeds {MAX_BATCH_SIZE}")
+        if len(cur) + len(g) > MAX_BATCH_SIZE:
+            chunks.append(cur)
+            cur = []
+        cur.extend(g)
+    if cur:
+        chunks.append(cur)
+    return [sorted(c) for c in chunks]
+
+
+def _parse_item(item: Any) -> Dict[str, Any]:
+    if not item:
+        return {"ok": False, "status": 0, "body": None, "error": "No response (dependency failed or omitted)"}
+    status = int(item.get("code") or 0)
+    raw = item.get("body")
+    try:
+        body = json.loads(raw) if isinstance(raw, str) else raw
+    except Exception:
+        body = {"raw": raw}
+    ok = 200 <= status < 300
+    return {"ok": ok, "status": status, "body": body, "error": "" if ok else f"Facebook API error {status}: {body}"}
+
+
+@timed("graph_batch.single")
+def _single(op: BatchOp, access_token: str, graph_api_version: str, results: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+    """Run one op as a normal request, substituting `{result=...}` from earlier results."""
+    import requests
+
+    def subst(v: Any) -> Any:
+        def repl(m: "re.Match[str]") -> str:
+            ref = results.get(m.group(1))
+            if not ref or not ref.get("ok"):
+                raise RuntimeError(f"Dependency {m.group(1)!r} failed")
+            return _json_path(ref["body"], m.group(2))
+
+        return _RESULT_REF.sub(repl, v) if isinstance(v, str) else v
+
+    try:
+        data = {k: subst(v) for k, v in op.body.items()}
+    except RuntimeError as e:
+        return {"ok": False, "status": 0, "body": None, "error": str(e)}
+    data["access_token"] = op.access_token or access_token
+    url = f"{GRAPH_BASE_URL}/{graph_api_version}/{op.relative_url.lstrip('/')}"
+    try:
+        if op.method.upper() == "GET":
+            resp = session().get(url, params=data, timeout=api_timeout(timeout))
+        else:
+            resp = session().request(op.method.upper(), url, data=data, timeout=api_timeout(timeout))
+    except requests.RequestException as e:
+        return {"ok": False, "status": 0, "body": None, "error": str(e)}
+    try:
+        body = resp.json()
+    except Exception:
+        body = {"raw": resp.text}
+    ok = resp.status_code < 400
+    return {
+        "ok": ok,
+        "status": resp.status_code,
+        "body": body,
+        "error": "" if ok else f"Facebook API error {resp.status_code}: {body}",
+        "fallback": True,
+    }
+
+
+def _publishes(op: BatchOp) -> bool:
+    """Whether running `op` twice would publish twice (feed post, published photo, video)."""
+    if op.method.upper() != "POST":
+        return False
+    edge = op.relative_url.split("?")[0].rstrip("/").rsplit("/", 1)[-1]
+    if edge == "photos":
+        return str(op.body.get("published", "true")).lower() != "false"
+    return edge in ("feed", "videos")
+
+
+def execute_batch(
+    ops: List[BatchOp],
+    access_token: str,
+    graph_api_version: str = "v20.0",
+    timeout: float = 120,
+    fallback: bool = True,
+) -> List[Dict[str, Any]]:
+    """Send ops through POST /?batch=... in chunks of up to 50.
+
+    Returns one result per op, in order: {"ok", "status", "body", "error"}.
+    With `fallback`, sub-requests that failed inside a parsed batch response
+    (an error or null item) are retried as individual calls, as are all ops
+    of a batch request Graph rejected (4xx). Any other failure of the batch
+    request itself (timeout, connection error, 5xx, unreadable body) may
+    have been applied: it is raised when the chunk publishes anything (see
+    _publishes), and only falls back for unpublished uploads and reads.
+    """
+    import requests
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(ops)
+    for chunk in _chunks(ops):
+        payload = []
+        for i in chunk:
+            op = ops[i]
+            body = dict(op.body)
+            if op.access_token:
+                body["access_token"] = op.access_token
+            item: Dict[str, Any] = {"method": op.method.upper(), "relative_url": op.relative_url.lstrip("/")}
+            if body:
+                if item["method"] == "GET":
+                    sep = "&" if "?" in item["relative_url"] else "?"
+                    item["relative_url"] += sep + urlencode(body)
+                else:
+                    item["body"] = urlencode(body)
+            if op.name:
+                item["name"] = op.name
+                # Keep parent responses so we can fall back on dependents individually.
+                item["omit_response_on_success"] = False
+            payload.append(item)
+
+        rejected = False
+        try:
+            with span("graph_batch.request"):
+                resp = session().post(
+                    f"{GRAPH_BASE_URL}/{graph_api_version}/",
+                    data={"access_token": access_token, "batch": json.dumps(payload), "include_headers": "false"},
+                    timeout=api_timeout(timeout),
+                )
+            rejected = 400 <= resp.status_code < 500
+            try:
+                items = resp.json() if resp.status_code < 400 else None
+            except ValueError:
+                items = None
+            if not isinstance(items, list) or len(items) != len(chunk):
+                raise RuntimeError(f"Batch request failed ({resp.status_code}): {resp.text[:500]}")
+            for i, item in zip(chunk, items):
+                results[i] = _parse_item(item)
+        except (requests.RequestException, RuntimeError) as e:
+            if not fallback:
+                raise
+            if not rejected and any(_publishes(ops[i]) for i in chunk):
+                # The batch may have been applied; retrying individually could double-post.
+                inc("adg_graph_batch_ambiguous_total")
+                raise
+            for i in chunk:
+                results[i] = {"ok": False, "status": 0, "body": None, "error": str(e)}
+
+        if fallback:
+            named: Dict[str, Any] = {}
+            for i in chunk:
+                if not results[i]["ok"]:
+                    inc("adg_retries_total", op="graph_batch.fallback")
+                    results[i] = _single(ops[i], access_token, graph_api_version, named, timeout)
+                if ops[i].name:
+                    named[ops[i].name] = results[i]
+    return [r for r in results if r is not None]
@@ -0,0 +1,444 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from db import get_page_token_cache, put_page_token_cache
+from graph_batch import GRAPH_BASE_URL, BatchOp, execute_batch
+from http_client import session
+from metrics import inc, timed
+from timeouts import UPLOAD_STALL_SECONDS, api_timeout, record_upload, upload_timeout
+from upload_progress import MultipartFileBody, UploadCallback
+
+# Facebook Graph API calls over the shared keep-alive session (http_client);
+# `requests` is imported on first use so importing this module stays cheap.
+
+
+class FacebookAPIError(RuntimeError):
+    """Graph API returned an HTTP error; keeps the status and Graph error code."""
+
+    def __init__(self, status_code: int, data: Any):
+        super().__init__(f"Facebook API error {status_code}: {data}")
+        self.status_code = status_code
+        self.data = data
+        err = data.get("error") if isinstance(data, dict) else None
+        self.error_code = int(err.get("code") or 0) if isinstance(err, dict) else 0
+
+
+@timed()
+def post_photo_by_url(page_id: str, page_access_token: str, image_url: str, message: str, graph_api_version: str = "v20.0") -> Dict[str, Any]:
+    endpoint = f"{GRAPH_BASE_URL}/{graph_api_version}/{page_id}/photos"
+    payload = {"url": image_url, "message": message, "access_token": page_access_token}
+    resp = session().post(endpoint, data=payload, timeout=api_timeout(60))
+    try:
+        data = resp.json()
+    except Exception:
+        data = {"raw": resp.text}
+    if resp.status_code >= 400:
+        raise FacebookAPIError(resp.status_code, data)
+    return data
+
+
+@timed()
+def upload_photo_unpublished_by_url(
+    page_id: str,
+    page_access_token: str,
+    image_url: str,
+    graph_api_version: str = "v20.0",
+) -> Dict[str, Any]:
+    endpoint = f"{GRAPH_BASE_URL}/{graph_api_version}/{page_id}/photos"
+    payload = {
+        "url": image_url,
+        "published": "false",
+        "access_token": page_access_token,
+    }
+    resp = session().post(endpoint, data=payload, timeout=api_timeout(120))
+    try:
+        data = resp.json()
+    except Exception:
+        data = {"raw": resp.text}
+    if resp.status_code >= 400:
+        raise FacebookAPIError(resp.status_code, data)
+    return data
+
+
+def _post_file(
+    endpoint: str,
+    fields: Dict[str, Any],
+    file_path: str,
+    kind: str,
+    on_progress: Optional[UploadCallback] = None,
+    db_path: Optional[str] = None,
+) -> Dict[str, Any]:
+    """POST a multipart form with `source`=file, streamed from disk with progress callbacks.
+
+    The timeout is sized from the file and the upload bandwidth estimate (see
+    timeouts.py); a stalled upload fails after UPLOAD_STALL_SECONDS without
+    progress instead of after a fixed wall-clock limit.
+    """
+    import requests
+
+    body = MultipartFileBody(fields, "source", file_path, on_progress)
+    t0 = time.perf_counter()
+    try:
+        resp = session().post(
+            endpoint,
+            data=body,
+            headers={"Content-Type": body.content_type},
+            timeout=upload_timeout(body.total, db_path),
+        )
+    except requests.RequestException as e:
+        if body.started_at and body.sent < body.total:
+            inc("adg_upload_stalls_total", kind=kind)
+            raise RuntimeError(
+                f"Upload stalled: no progress for {UPLOAD_STALL_SECONDS:.0f}s after {body.sent}/{body.total} bytes ({e})"
+            ) from e
+        raise
+    finally:
+        body.close()
+        inc("adg_upload_bytes_total", body.sent, kind=kind)
+        inc("adg_upload_seconds_total", time.perf_counter() - t0, kind=kind)
+    # Until the response arrives: socket buffers swallow the tail of the body,
+    # so this errs towards a lower bandwidth (= longer timeouts).
+    record_upload(db_path, body.sent, time.monotonic() - body.started_at)
+    try:
+        out = resp.json()
+    except Exception:
+        out = {"raw": resp.text}
+    if resp.status_code >= 400:
+        raise FacebookAPIError(resp.status_code, out)
+    return out
+
+
+@timed()
+def upload_photo_unpublished_by_file(
+    page_id: str,
+    page_access_token: str,
+    file_path: str,
+    graph_api_version: str = "v20.0",
+    on_progress: Optional[UploadCallback] = None,
+    db_path: Optional[str] = None,
+) -> Dict[str, Any]:
+    endpoint = f"{GRAPH_BASE_URL}/{graph_api_version}/{page_id}/photos"
+    data = {
+        "published": "false",
+        "access_token": page_access_token,
+    }
+    return _post_file(endpoint, data, file_path, "photo", on_progress, db_path)
+
+
+@timed()
+def create_feed_post_with_attached_media(
+    page_id: str,
+    page_access_token: str,
+    message: str,
+    media_fbids: List[str],
+    graph_api_version: str = "v20.0",
+) -> Dict[str, Any]:
+    if not media_fbids:
+        raise RuntimeError("No media ids for attached_media")
+    endpoint = f"{GRAPH_BASE_URL}/{graph_api_version}/{page_id}/feed"
+    payload: Dict[str, Any] = {
+        "message": message,
+        "access_token": page_access_token,
+    }
+    for idx, mid in enumerate(media_fbids):
+        payload[f"attached_media[{idx}]"] = json.dumps({"media_fbid": mid})
+
+    resp = session().post(endpoint, data=payload, timeout=api_timeout(120))
+    try:
+        out = resp.json()
+    except Exception:
+        out = {"raw": resp.text}
+    if resp.status_code >= 400:
+        raise FacebookAPIError(resp.status_code, out)
+    return out
+
+
+@timed()
+def publish_photos_by_url_batch(
+    page_id: str,
+    page_access_token: str,
+    image_urls: List[str],
+    message: Optional[str] = None,
+    graph_api_version: str = "v20.0",
+) -> Tuple[List[str], Optional[Dict[str, Any]]]:
+    """Upload photos by URL as unpublished media in a single Graph batch request.
+
+    If `message` is given, the feed post attaching them is created in the same
+    batch (referencing the uploads with `{result=...}`). Returns (media ids,
+    feed response or None). Failed sub-requests are retried individually.
+    """
+    ops = [
+        BatchOp("POST", f"{page_id}/photos", {"url": u, "published": "false"}, name=f"photo{i}")
+        for i, u in enumerate(image_urls)
+    ]
+    if message is not None:
+        body: Dict[str, Any] = {"message": message}
+        for i in range(len(image_urls)):
+            body[f"attached_media[{i}]"] = json.dumps({"media_fbid": f"{{result=photo{i}:$.id}}"})
+        ops.append(BatchOp("POST", f"{page_id}/feed", body, name="feed"))
+
+    results = execute_batch(ops, page_access_token, graph_api_version)
+    for r in results:
+        if not r["ok"]:
+            raise RuntimeError(r["error"])
+    media_ids: List[str] = []
+    for r in results[: len(image_urls)]:
+        mid = str((r["body"] or {}).get("id") or "").strip()
+        if not mid:
+            raise RuntimeError(f"Upload photo returned no id: {r['body']}")
+        media_ids.append(mid)
+    return media_ids, (results[-1]["body"] if message is not None else None)
+
+
+@timed()
+def post_photo_by_file(
+    page_id: str,
+    page_access_token: str,
+    file_path: str,
+    message: str,
+    graph_api_version: str = "v20.0",
+    on_progress: Optional[UploadCallback] = None,
+    db_path: Optional[str] = None,
+) -> Dict[str, Any]:
+    endpoint = f"{GRAPH_BASE_URL}/{graph_api_version}/{page_id}/photos"
+    data = {"message": message, "access_token": page_access_token}
+    return _post_file(endpoint, data, file_path, "photo", on_progress, db_path)
+
+
+@timed()
+def post_video_by_url(page_id: str, page_access_token: str, video_url: str, message: str, graph_api_version: str = "v20.0") -> Dict[str, Any]:
+    endpoint = f"{GRAPH_BASE_URL}/{graph_api_version}/{page_id}/videos"
+    payload = {"file_url": video_url, "description": message, "access_token": page_access_token}
+    resp = session().post(endpoint, data=payload, timeout=api_timeout(300))
+    try:
+        data = resp.json()
+    except Exception:
+        data = {"raw": resp.text}
+    if resp.status_code >= 400:
+        raise FacebookAPIError(resp.status_code, data)
+    return data
+
+
+@timed()
+def post_video_by_file(
+    page_id: str,
+    page_access_token: str,
+    file_path: str,
+    message: str,
+    graph_api_version: str = "v20.0",
+    on_progress: Optional[UploadCallback] = None,
+    db_path: Optional[str] = None,
+) -> Dict[str, Any]:
+    endpoint = f"{GRAPH_BASE_URL}/{graph_api_version}/{page_id}/videos"
+    data = {"description": message, "access_token": page_access_token}
+    return _post_file(endpoint, data, file_path, "video", on_progress, db_path)
+
+
+@timed()
+def get_page_info_from_token(page_access_token: str, graph_api_version: str = "v20.0") -> Dict[str, str]:
+    """Best-effort resolve Page id/name from a Page access token.
+
+    For a Page access token, /me returns the Page object.
+    """
+    token = (page_access_token or "").strip()
+    if not token:
+        raise RuntimeError("Empty page access token")
+
+    endpoint = f"{GRAPH_BASE_URL}/{graph_api_version}/me"
+    params = {"fields": "id,name", "access_token": token}
+    resp = session().get(endpoint, params=params, timeout=api_timeout(30))
+    try:
+        data = resp.json()
+    except Exception:
+        data = {"raw": resp.text}
+    if resp.status_code >= 400:
+        raise FacebookAPIError(resp.status_code, data)
+
+    pid = str(data.get("id", "")).strip()
+    name = str(data.get("name", "")).strip()
+    if not pid:
+        raise RuntimeError(f"Could not resolve Page id from token: {data}")
+    return {"id": pid, "name": name}
+
+
+@timed()
+def list_recent_page_posts(
+    page_id: str,
+    page_access_token: str,
+    since: float,
+    videos: bool = False,
+    limit: int = 25,
+    graph_api_version: str = "v20.0",
+) -> List[Dict[str, str]]:
+    """Posts (or videos) the Page published since unix time `since`, newest first.
+
+    Each item is {"id", "message", "created_time"}; a video's description is its message.
+    """
+    edge, text_field = ("videos", "description") if videos else ("feed", "message")
+    endpoint = f"{GRAPH_BASE_URL}/{graph_api_version}/{page_id}/{edge}"
+    params = {
+        "fields": f"id,{text_field},created_time",
+        "since": int(since),
+        "limit": limit,
+        "access_token": page_access_token,
+    }
+    resp = session().get(endpoint, params=params, timeout=api_timeout(30))
+    try:
+        data = resp.json()
+    except Exception:
+        data = {"raw": resp.text}
+    if resp.status_code >= 400:
+        raise FacebookAPIError(resp.status_code, data)
+    return [
+        {
+            "id": str(d.get("id") or ""),
+            "message": str(d.get(text_field) or ""),
+            "created_time": str(d.get("created_time") or ""),
+        }
+        for d in (data.get("data") or [])
+        if isinstance(d, dict)
+    ]
+
+
+PAGE_CACHE_TTL_SECONDS = int(os.getenv("PAGE_CACHE_TTL_SECONDS", str(6 * 3600)))
+PAGE_CACHE_NEGATIVE_TTL_SECONDS = int(os.getenv("PAGE_CACHE_NEGATIVE_TTL_SECONDS", "300"))
+# Graph error codes meaning the token itself is bad (expired, revoked, malformed).
+_INVALID_TOKEN_CODES = (102, 190, 463, 467)
+
+_page_cache: Dict[str, Dict[str, Any]] = {}
+_page_cache_lock = threading.Lock()
+
+
+def token_fingerprint(page_access_token: str) -> str:
+    """Stable, non-reversible id for a token (safe to log and store)."""
+    return hashlib.sha256((page_access_token or "").strip().encode("utf-8")).hexdigest()[:32]
+
+
+def _cache_page_entry(db_path: str, fp: str, entry: Dict[str, Any]) -> None:
+    with _page_cache_lock:
+        _page_cache[fp] = entry
+    put_page_token_cache(db_path, fp, entry)
+
+
+def get_page_info_cached(db_path: str, page_access_token: str) -> Dict[str, str]:
+    """get_page_info_from_token with an in-process + SQLite cache.
+
+    Successful lookups are cached for PAGE_CACHE_TTL_SECONDS. Tokens rejected by
+    Graph as invalid are cached negatively for PAGE_CACHE_NEGATIVE_TTL_SECONDS;
+    network errors are not cached.
+    """
+    token = (page_access_token or "").strip()
+    if not token:
+        raise RuntimeError("Empty page access token")
+    fp = token_fingerprint(token)
+    now = time.time()
+
+    with _page_cache_lock:
+        entry = _page_cache.get(fp)
+    if entry is not None and entry["expires_at"] > now:
+        inc("adg_cache_total", cache="page_token", result="memory_hit")
+    else:
+        entry = get_page_token_cache(db_path, fp)
+        if entry is not None and entry["expires_at"] > now:
+            inc("adg_cache_total", cache="page_token", result="db_hit")
+            with _page_cache_lock:
+                _page_cache[fp] = entry
+        else:
+            inc("adg_cache_total", cache="page_token", result="miss")
+            entry = None
+
+    if entry is None:
+        try:
+            info = get_page_info_from_token(token)
+        except FacebookAPIError as e:
+            if e.error_code in _INVALID_TOKEN_CODES or e.status_code in (401, 403):
+                _cache_page_entry(db_path, fp, {
+                    "ok": False,
+                    "error": str(e)[:500],
+                    "expires_at": now + PAGE_CACHE_NEGATIVE_TTL_SECONDS,
+                })
+            raise
+        entry = {
+            "ok": True,
+            "page_id": info["id"],
+            "page_name": info.get("name", ""),
+            "expires_at": now + PAGE_CACHE_TTL_SECONDS,
+        }
+        _cache_page_entry(db_path, fp, entry)
+
+    if not entry["ok"]:
+        raise RuntimeError(f"Invalid page access token (cached): {entry.get('error', '')}")
+    return {"id": entry["page_id"], "name": entry.get("page_name", "")}
+
+
+@timed()
+def debug_page_token(page_access_token: str, app_token: str, graph_api_version: str = "v20.0") -> Dict[str, Any]:
+    """Inspect a token via /debug_token (needs an app token `app_id|app_secret`)."""
+    endpoint = f"{GRAPH_BASE_URL}/{graph_api_version}/debug_token"
+    params = {"input_token": page_access_token, "access_token": app_token}
+    resp = session().get(endpoint, params=params, timeout=api_timeout(30))
+    try:
+        data = resp.json()
+    except Exception:
+        data = {"raw": resp.text}
+    if resp.status_code >= 400:
+        raise FacebookAPIError(resp.status_code, data)
+    return data.get("data") or {}
+
+
+def warm_page_token_cache(
+    db_path: str,
+    page_access_tokens: List[str],
+    app_token: Optional[str] = None,
+    max_workers: int = 8,
+) -> List[Dict[str, Any]]:
+    """Validate many tokens concurrently at startup and fill the page cache.
+
+    Not for the publish path: with an app token every call asks Graph. Publish
+    code resolves pages with get_page_info_cached().
+
+    With an app token, /debug_token is used (validity + expiry); otherwise each
+    token resolves itself via /me. Returns one summary per token, keyed by
+    fingerprint.
+    """
+    tokens = [t.strip() for t in page_access_tokens if (t or "").strip()]
+
+    def check(token: str) -> Dict[str, Any]:
+        fp = token_fingerprint(token)
+        try:
+            if app_token:
+                d = debug_page_token(token, app_token)
+                if not d.get("is_valid"):
+                    err = str((d.get("error") or {}).get("message") or "Token is not valid")
+                    _cache_page_entry(db_path, fp, {
+                        "ok": False,
+                        "error": err,
+                        "expires_at": time.time() + PAGE_CACHE_NEGATIVE_TTL_SECONDS,
+                    })
+                    return {"token_fp": fp, "ok": False, "error": err}
+                ttl_end = time.time() + PAGE_CACHE_TTL_SECONDS
+                if d.get("expires_at"):
+                    ttl_end = min(ttl_end, float(d["expires_at"]))
+                page_id = str(d.get("profile_id") or "").strip()
+                if page_id:
+                    # /debug_token has no page name; keep the one a /me lookup cached.
+                    with _page_cache_lock:
+                        cached = _page_cache.get(fp)
+                    cached = cached or get_page_token_cache(db_path, fp) or {}
+                    name = cached.get("page_name", "") if cached.get("page_id") == page_id else ""
+                    _cache_page_entry(db_path, fp, {"ok": True, "page_id": page_id, "page_name": name, "expires_at": ttl_end})
+                    return {"token_fp": fp, "ok": True, "page_id": page_id, "page_name": name}
+            info = get_page_info_cached(db_path, token)
+            return {"token_fp": fp, "ok": True, "page_id": info["id"], "page_name": info["name"]}
+        except Exception as e:
+            return {"token_fp": fp, "ok": False, "error": str(e)}
+
+    if not tokens:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tokens)))) as ex:
+        return list(ex.map(check, tokens))
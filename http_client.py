@@ -0,0 +1,40 @@
+import os
+import threading
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import requests
+
+# requests.get()/post() build a new Session (and a new TCP+TLS handshake) per
+# call. Graph and SerpAPI calls share one keep-alive pool per process instead.
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+
+_session: Optional["requests.Session"] = None
+_lock = threading.Lock()
+
+
+def session() -> "requests.Session":
+    """The process-wide Session, created (and requests imported) on first use."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                _session = s
+    return _session
+
+
+def _reset_after_fork() -> None:
+    # Pooled sockets belong to the parent (e.g. process pool workers).
+    global _session, _lock
+    _session = None
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
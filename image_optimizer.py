@@ -0,0 +1,141 @@
+import os
+import hashlib
+import tempfile
+import threading
+from io import BytesIO
+from typing import Any, Dict, List, Optional
+
+from media_cache import cache_dir
+
+# Facebook recommends photos no larger than 2048px on the long side; anything
+# bigger is downscaled server-side anyway, so we only pay for the extra bytes.
+FB_MAX_SIDE = 2048
+JPEG_QUALITY = 85
+
+_PASSTHROUGH_FORMATS = ("GIF",)  # may be animated; let Facebook handle them
+
+# Albums are optimized in one process pool that lives as long as the process.
+# Its workers are started with "forkserver" (or "spawn") rather than forked
+# from this multithreaded process, which could copy locks held by other threads.
+OPTIMIZE_WORKERS = int(os.getenv("IMAGE_OPTIMIZE_WORKERS", "0")) or (os.cpu_count() or 1)
+
+_pool: Any = None
+_pool_lock = threading.Lock()
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def optimize_image(src_path: str, out_dir: str, content_hash: str = "", max_side: int = FB_MAX_SIDE) -> str:
+    """Resize/re-encode an image for upload and return the path to send.
+
+    Output is a metadata-free progressive JPEG cached as <sha256>-<max_side>.jpg,
+    so each asset is processed once. The original path is returned when it is
+    already within limits and smaller than the re-encoded result, or cannot be
+    decoded.
+    """
+    content_hash = content_hash or file_sha256(src_path)
+    out = os.path.join(out_dir, f"{content_hash}-{max_side}.jpg")
+    if os.path.isfile(out):
+        return out
+    marker = out + ".orig"
+    if os.path.isfile(marker):
+        return src_path
+
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(src_path) as im:
+            fmt = im.format or ""
+            if fmt in _PASSTHROUGH_FORMATS:
+                return src_path
+            resized = max(im.size) > max_side
+            im.draft("RGB", (max_side, max_side))
+            im = ImageOps.exif_transpose(im)
+            im.thumbnail((max_side, max_side))
+            if im.mode in ("RGBA", "LA") or (im.mode == "P" and "transparency" in im.info):
+                rgba = im.convert("RGBA")
+                bg = Image.new("RGB", rgba.size, (255, 255, 255))
+                bg.paste(rgba, mask=rgba.getchannel("A"))
+                im = bg
+            elif im.mode != "RGB":
+                im = im.convert("RGB")
+            buf = BytesIO()
+            # No exif/icc_profile passed -> metadata is stripped.
+            im.save(buf, format="JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    except Exception:
+        return src_path
+
+    data = buf.getvalue()
+    if not resized and len(data) >= os.path.getsize(src_path):
+        # Remember that re-encoding does not help so we skip decoding next time.
+        open(marker, "wb").close()
+        return src_path
+    fd, tmp = tempfile.mkstemp(dir=out_dir, prefix=os.path.basename(out) + ".", suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, out)
+    return out
+
+
+def _get_pool() -> Any:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor  # pulls in multiprocessing
+
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(max_workers=OPTIMIZE_WORKERS, mp_context=multiprocessing.get_context(method))
+        return _pool
+
+
+def _drop_pool(pool: Any) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def optimize_images(
+    db_path: str,
+    paths: List[str],
+    content_hashes: Optional[Dict[str, str]] = None,
+) -> List[str]:
+    """Optimize many images, in the shared process pool when there is more than one.
+
+    Returns upload paths in the same order as `paths`.
+    """
+    if not paths:
+        return []
+    out_dir = cache_dir(db_path, "optimized")
+    hashes = content_hashes or {}
+    if len(paths) == 1:
+        return [optimize_image(paths[0], out_dir, hashes.get(paths[0], ""))]
+    from concurrent.futures.process import BrokenProcessPool
+
+    pool = _get_pool()
+    try:
+        futs = [pool.submit(optimize_image, p, out_dir, hashes.get(p, "")) for p in paths]
+        return [f.result() for f in futs]
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM on a huge image): start a fresh pool next
+        # time and finish this album here.
+        _drop_pool(pool)
+        return [optimize_image(p, out_dir, hashes.get(p, "")) for p in paths]
+
+
+def _reset_after_fork() -> None:
+    # The parent's pool (and its lock) belong to the parent.
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
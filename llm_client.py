@@ -0,0 +1,285 @@
+import os
+import logging
+import threading
+from functools import partial
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
+
+from llm_json import CAPTION_SCHEMA, CAPTION_VARIANTS_SCHEMA, parse_caption, parse_caption_variants
+from llm_router import LLMProvider, llm_router
+from metrics import inc, timed
+from prompt_builder import MAX_COMPLETION_TOKENS, build_caption_prompt
+
+if TYPE_CHECKING:
+    from worker import AppConfig
+
+# Caption generation through an OpenAI-compatible API. The openai SDK takes
+# most of a second to import, so it is only loaded when a caption is needed.
+# Clients (and their connection pools) are reused per (api key, base URL).
+# Several endpoints can be configured (LLM_PROVIDERS, see llm_router).
+_clients: Dict[Tuple[str, Optional[str]], Any] = {}
+_clients_lock = threading.Lock()
+
+
+def llm_client(api_key: str, base_url: Optional[str] = None) -> Any:
+    """Shared OpenAI client for this key/endpoint (stub://... = local stub, see llm_stub)."""
+    key = (api_key, base_url)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            if (base_url or "").startswith("stub://"):
+                from llm_stub import StubLLM
+
+                client = _clients[key] = StubLLM(base_url or "")
+            else:
+                from openai import OpenAI
+
+                client = _clients[key] = OpenAI(api_key=api_key, base_url=base_url)
+    return client
+
+
+def llm_providers(cfg: "AppConfig") -> List[LLMProvider]:
+    """Configured endpoints that can be called (have a key, or are stubs), in order of preference."""
+    providers = cfg.llm_providers or [
+        LLMProvider("default", cfg.openai_base_url, cfg.openai_api_key, cfg.openai_model)
+    ]
+    return [p for p in providers if p.usable]
+
+
+# "json_schema" asks for strict schema-conforming output, "json_object" for
+# any JSON object, "none" sends no response_format. "auto" uses json_schema
+# on api.openai.com and json_object elsewhere; an endpoint/model that rejects
+# json_schema is remembered and gets json_object from then on.
+LLM_RESPONSE_FORMAT = os.getenv("LLM_RESPONSE_FORMAT", "auto").strip().lower()
+_no_json_schema: Set[Tuple[Optional[str], str]] = set()
+
+# Several caption variants come from one request: "n" asks for n choices
+# (one caption each), "list" for one {"variants": [...]} object. "auto" uses
+# n on api.openai.com, which bills the prompt once, and list elsewhere since
+# many compatible providers reject n > 1.
+LLM_VARIANTS_MODE = os.getenv("LLM_VARIANTS_MODE", "auto").strip().lower()
+MAX_VARIANTS = 5
+VARIANTS_INSTRUCTION = (
+    ' Lần này viết đúng {n} phương án khác nhau (góc tiếp cận, giọng văn, mở bài) và trả về JSON dạng'
+    ' {{"variants": [{{"title": "...", "content": "..."}}]}} gồm đúng {n} phương án.'
+)
+
+
+def _reset_after_fork() -> None:
+    global _clients_lock
+    _clients.clear()
+    _clients_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+DEFAULT_PROMPT_TEMPLATE = """\
+Bạn là 1 Content Creator của công ty ADG, chuyên về các sản phẩm thiết bị trong nhà (cửa cuốn, bếp, cửa sổ, solar...).
+Bạn viết nội dung để đăng tải lên 1 trang Facebook Fanpage.
+
+Hãy viết cho tôi 1 Status Facebook chia sẻ về chủ đề: {topic}
+Bao gồm các nội dung chính sau:
+{main}
+
+Yêu cầu bắt buộc:
+- Trả kết quả bằng tiếng Việt.
+- Xuống dòng ở tiêu đề.
+- Status là văn bản thuần, không dùng in đậm/in nghiêng/ký hiệu * hoặc **.
+- Nếu có danh sách ý chính, hãy dùng emoji ở ĐẦU dòng để làm nổi bật (ví dụ: ♥️, 🍀, 🏵️, ⭐), không chèn emoji ở cuối câu.
+- Giữ nội dung ngắn gọn, thu hút, dễ đọc, câu không quá dài.
+- Đảm bảo đúng chính tả, ngữ pháp tiếng Việt.
+- Luôn kèm 5 hashtag phù hợp và phổ biến.
+- Tham khảo gợi ý từ khóa SEO (nếu có): {seo_keywords}
+
+Đoạn “Nội dung bắt buộc” (nếu có) sẽ được nối ở cuối bài, không chỉnh sửa nội dung đó.
+"""
+
+
+def _is_openai(base_url: Optional[str]) -> bool:
+    return "api.openai.com" in (base_url or "api.openai.com")
+
+
+def _response_format(base_url: Optional[str], model: str, schema: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    mode = LLM_RESPONSE_FORMAT
+    if mode == "auto":
+        mode = "json_schema" if _is_openai(base_url) else "json_object"
+    if mode == "json_schema" and (base_url, model) in _no_json_schema:
+        mode = "json_object"
+    if mode == "json_schema":
+        name = "caption_variants" if schema is CAPTION_VARIANTS_SCHEMA else "caption"
+        return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+    if mode == "json_object":
+        return {"type": "json_object"}
+    return None
+
+
+def _rejects_json_schema(err: Exception) -> bool:
+    # 400/422 naming the parameter, e.g. "response_format json_schema is not supported".
+    msg = str(err).lower()
+    return getattr(err, "status_code", None) in (400, 422) and ("json_schema" in msg or "response_format" in msg)
+
+
+def _variants_mode(provider: LLMProvider) -> str:
+    if LLM_VARIANTS_MODE in ("n", "list"):
+        return LLM_VARIANTS_MODE
+    return "n" if _is_openai(provider.base_url) else "list"
+
+
+def _chat(
+    provider: LLMProvider, messages: List[Dict[str, str]], temperature: float, variants: int = 1
+) -> Tuple[Any, str, str]:
+    """One chat completion on `provider`: (response, response_format type used, variants mode)."""
+    client = llm_client(provider.api_key, provider.base_url)
+    mode = _variants_mode(provider) if variants > 1 else "single"
+    schema = CAPTION_SCHEMA
+    max_tokens = MAX_COMPLETION_TOKENS
+    if mode == "list":
+        schema = CAPTION_VARIANTS_SCHEMA
+        max_tokens *= variants
+        system = dict(messages[0], content=messages[0]["content"] + VARIANTS_INSTRUCTION.format(n=variants))
+        messages = [system] + messages[1:]
+    args: Dict[str, Any] = {"model": provider.model, "temperature": temperature, "messages": messages}
+    if mode == "n":
+        args["n"] = variants
+    if max_tokens > 0:
+        args["max_tokens"] = max_tokens
+    fmt = _response_format(provider.base_url, provider.model, schema)
+    if fmt is not None:
+        args["response_format"] = fmt
+    try:
+        resp = client.chat.completions.create(**args)
+    except Exception as e:
+        if fmt is None or fmt["type"] != "json_schema" or not _rejects_json_schema(e):
+            raise
+        logging.warning("%s (%s) rejects json_schema output; using json_object", provider.model, provider.name)
+        _no_json_schema.add((provider.base_url, provider.model))
+        args["response_format"] = {"type": "json_object"}
+        resp = client.chat.completions.create(**args)
+    usage = getattr(resp, "usage", None)
+    if usage is not None:
+        # Counted here so hedged calls that lost the race are included too.
+        for kind in ("prompt", "completion"):
+            inc("adg_llm_tokens_total", getattr(usage, f"{kind}_tokens", 0) or 0, type=kind, model=provider.model)
+    return resp, args.get("response_format", {}).get("type", "none"), mode
+
+
+def _parse_reply(resp: Any, mode: str, variants: int) -> Tuple[List[Dict[str, str]], List[str]]:
+    """Valid captions in a completion and the local fixes they needed; ValueError if there is none."""
+    if mode == "list":
+        return parse_caption_variants(resp.choices[0].message.content or "", variants)
+    captions: List[Dict[str, str]] = []
+    fixes: List[str] = []
+    last_err: Optional[Exception] = None
+    for choice in resp.choices[:variants]:
+        try:
+            caption, choice_fixes = parse_caption(choice.message.content or "")
+        except ValueError as e:
+            last_err = e
+            continue
+        if caption not in captions:
+            captions.append(caption)
+        fixes += [f for f in choice_fixes if f not in fixes]
+    if not captions:
+        raise last_err or ValueError("empty reply")
+    return captions, fixes
+
+
+@timed()
+def generate_ai_json(
+    cfg: "AppConfig",
+    topic: str,
+    main: str,
+    mandatory: str,
+    seo_keywords: List[str],
+    extra_requirements: str = "",
+    variants: int = 1,
+) -> Dict[str, Any]:
+    """Generate {"title", "content"} for a post; "usage" holds token counts and what was trimmed.
+
+    The prompt is trimmed to LLM_PROMPT_TOKEN_BUDGET (see prompt_builder) and
+    the reply is capped at LLM_MAX_COMPLETION_TOKENS. A malformed reply is
+    repaired locally (llm_json); the model is asked again only if that fails.
+    With variants > 1 the same request asks for that many alternatives
+    (LLM_VARIANTS_MODE); "variants" lists those that came back valid, the
+    first of which is also "title"/"content".
+    """
+    variants = max(1, min(int(variants), MAX_VARIANTS))
+    providers = llm_providers(cfg)
+    if not providers:
+        raise RuntimeError("Missing OPENAI_API_KEY (required for text generation)")
+    for p in providers:
+        if p.api_key.startswith("gsk_") and "openai.com" in (p.base_url or ""):
+            raise RuntimeError(
+                f"LLM provider '{p.name}': you are using a Groq key ('gsk_...') with OpenAI base URL. "
+                "Fix: set OPENAI_BASE_URL to https://api.groq.com/openai/v1 (or your OpenAI-compatible provider), "
+                "or use an OpenAI API key (sk-...) with https://api.openai.com/v1."
+            )
+    router = llm_router(providers)
+
+    system = (
+        "Bạn là trợ lý viết nội dung mạng xã hội. "
+        "BẮT BUỘC trả về đúng 1 JSON object hợp lệ, không thêm văn bản nào khác. "
+        "JSON phải có đúng 2 key: title, content (đều là string)."
+    )
+    built = build_caption_prompt(
+        cfg.prompt_template or DEFAULT_PROMPT_TEMPLATE,
+        system,
+        topic=topic,
+        main=main,
+        extra_requirements=extra_requirements,
+        mandatory=mandatory,
+        seo_keywords=seo_keywords,
+        model=providers[0].model,
+    )
+    for part in built.trimmed:
+        inc("adg_llm_prompt_trimmed_total", part=part)
+
+    usage_out: Dict[str, Any] = {
+        "provider": "",
+        "model": "",
+        "calls": 0,
+        "hedged": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "estimated_prompt_tokens": built.tokens,
+        "keywords_used": built.keywords_used,
+        "trimmed": built.trimmed,
+        "response_format": "",
+        "json_repairs": [],
+        "variants": 0,
+    }
+    messages = built.messages
+    last_err = None
+    for _ in range(2):
+        (resp, fmt, mode), provider, hedged = router.call(
+            partial(_chat, messages=messages, temperature=cfg.openai_temperature, variants=variants)
+        )
+        usage_out.update(provider=provider.name, model=provider.model, response_format=fmt)
+        usage_out["calls"] += 1
+        usage_out["hedged"] += int(hedged)
+        usage = getattr(resp, "usage", None)
+        if usage is not None:
+            usage_out["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+            usage_out["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+        try:
+            captions, fixes = _parse_reply(resp, mode, variants)
+        except ValueError as e:
+            last_err = e
+            inc("adg_llm_json_total", result="invalid")
+            inc("adg_retries_total", op="llm.json_parse")
+            shape = '{"title":"...","content":"..."}'
+            if mode == "list":
+                shape = '{"variants":[' + shape + "]}"
+            messages = built.retry_messages(
+                resp.choices[0].message.content or "",
+                f"Chỉ trả về JSON hợp lệ, không markdown, không giải thích. Schema: {shape}",
+            )
+            continue
+        inc("adg_llm_json_total", result="repaired" if fixes else "valid")
+        for f in fixes:
+            inc("adg_llm_json_repairs_total", fix=f)
+        usage_out["json_repairs"] = fixes
+        usage_out["variants"] = len(captions)
+        return {**captions[0], "variants": captions, "usage": usage_out}
+
+    raise RuntimeError(f"Failed to parse JSON from model. Last error: {last_err}")
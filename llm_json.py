@@ -0,0 +1,181 @@
+import re
+import json
+from typing import Any, Dict, List, Tuple
+
+# Structured output from the LLM. The caption schema is sent to providers
+# that support strict JSON-schema output and is also checked locally, after a
+# tolerant parse that fixes the usual near-misses (code fences, prose around
+# the object, raw newlines or stray quotes inside strings, single quotes,
+# trailing commas) so they do not cost another completion.
+
+CAPTION_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string", "minLength": 1},
+        "content": {"type": "string", "minLength": 1},
+    },
+    "required": ["title", "content"],
+    "additionalProperties": False,
+}
+
+# Several alternatives in one completion (see generate_ai_json(variants=...)).
+CAPTION_VARIANTS_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {"variants": {"type": "array", "items": CAPTION_SCHEMA}},
+    "required": ["variants"],
+    "additionalProperties": False,
+}
+
+_FENCE = re.compile(r"```[ \t]*(?:json|JSON)?[ \t]*\n?(.*?)```", re.S)
+_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+_TYPES = {"object": dict, "array": list, "string": str, "boolean": bool, "number": (int, float), "integer": int}
+
+
+def _normalize_object(s: str, start: int, fixes: List[str]) -> str:
+    """Rewrite the object starting at s[start] as strict JSON, dropping what follows it."""
+    out: List[str] = []
+    depth = 0
+    quote = ""  # delimiter of the string being read, "" outside strings
+    i, n = start, len(s)
+
+    def fix(name: str) -> None:
+        if name not in fixes:
+            fixes.append(name)
+
+    while i < n:
+        c = s[i]
+        if quote:
+            if c == "\\" and i + 1 < n:
+                if quote == "'" and s[i + 1] == "'":
+                    out.append("'")  # \' is not a JSON escape
+                else:
+                    out.append(s[i:i + 2])
+                i += 2
+                continue
+            if c == quote:
+                # A quote that is not followed by , } ] : is part of the text.
+                rest = s[i + 1:].lstrip()
+                if rest and rest[0] not in ",}]:":
+                    out.append('\\"' if quote == '"' else "'")
+                    fix("inner_quotes")
+                else:
+                    out.append('"')
+                    quote = ""
+            elif c == '"':
+                out.append('\\"')  # inside a single-quoted string
+            elif c in _ESCAPES:
+                out.append(_ESCAPES[c])
+                fix("unescaped_newlines")
+            elif c < " ":
+                out.append(f"\\u{ord(c):04x}")
+                fix("unescaped_newlines")
+            else:
+                out.append(c)
+            i += 1
+            continue
+        if c in "\"'":
+            if c == "'":
+                fix("single_quotes")
+            quote = c
+            out.append('"')
+        elif c in "{[":
+            depth += 1
+            out.append(c)
+        elif c in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+                fix("trailing_comma")
+            depth -= 1
+            out.append(c)
+            if depth == 0:
+                if s[i + 1:].strip():
+                    fix("surrounding_text")
+                break
+        else:
+            out.append(c)
+        i += 1
+    return "".join(out)
+
+
+def repair_json(text: str) -> Tuple[Any, List[str]]:
+    """Parse a JSON object out of an LLM reply: (value, fixes applied).
+
+    Raises ValueError when no object can be recovered.
+    """
+    s = text.strip()
+    try:
+        return json.loads(s), []
+    except ValueError:
+        pass
+    fixes: List[str] = []
+    m = _FENCE.search(s)
+    if m:
+        fixes.append("code_fence")
+        s = m.group(1).strip()
+    start = s.find("{")
+    if start == -1:
+        raise ValueError("no JSON object in reply")
+    if start > 0:
+        fixes.append("surrounding_text")
+    try:
+        value, end = json.JSONDecoder().raw_decode(s, start)
+        if s[end:].strip() and "surrounding_text" not in fixes:
+            fixes.append("surrounding_text")
+        return value, fixes
+    except ValueError:
+        pass
+    try:
+        return json.loads(_normalize_object(s, start, fixes)), fixes
+    except ValueError as e:
+        raise ValueError(f"unrepairable JSON: {e}") from e
+
+
+def schema_errors(value: Any, schema: Dict[str, Any], path: str = "$") -> List[str]:
+    """Violations of the subset of JSON Schema used here (type, properties, required, minLength)."""
+    expected = schema.get("type")
+    if expected and not isinstance(value, _TYPES[expected]):
+        return [f"{path}: expected {expected}"]
+    errors: List[str] = []
+    if isinstance(value, dict):
+        for key in schema.get("required", []):
+            if key not in value:
+                errors.append(f"{path}.{key}: missing")
+        for key, sub in schema.get("properties", {}).items():
+            if key in value:
+                errors.extend(schema_errors(value[key], sub, f"{path}.{key}"))
+    elif isinstance(value, str) and len(value.strip()) < schema.get("minLength", 0):
+        errors.append(f"{path}: empty")
+    return errors
+
+
+def parse_caption(text: str) -> Tuple[Dict[str, str], List[str]]:
+    """{"title", "content"} from an LLM reply, and the fixes it needed; ValueError if invalid."""
+    value, fixes = repair_json(text)
+    errors = schema_errors(value, CAPTION_SCHEMA)
+    if errors:
+        raise ValueError("; ".join(errors))
+    return {"title": value["title"].strip(), "content": value["content"].strip()}, fixes
+
+
+def parse_caption_variants(text: str, limit: int) -> Tuple[List[Dict[str, str]], List[str]]:
+    """Up to `limit` distinct valid captions from a {"variants": [...]} reply, and the fixes it needed.
+
+    A lone caption object is accepted as one variant; invalid items are
+    skipped. ValueError if none is valid.
+    """
+    value, fixes = repair_json(text)
+    items = value.get("variants") if isinstance(value, dict) and "variants" in value else [value]
+    if not isinstance(items, list):
+        raise ValueError("$.variants: expected array")
+    out: List[Dict[str, str]] = []
+    for item in items:
+        if schema_errors(item, CAPTION_SCHEMA):
+            continue
+        caption = {"title": item["title"].strip(), "content": item["content"].strip()}
+        if caption not in out:
+            out.append(caption)
+    if not out:
+        raise ValueError("no valid caption in reply")
+    return out[:limit], fixes
@@ -0,0 +1,277 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+from metrics import inc, observe
+
+# Caption generation can use several OpenAI-compatible endpoints (LLM_PROVIDERS,
+# in order of preference). Each process keeps a rolling window of latencies
+# and outcomes per endpoint; requests go to the fastest healthy one, fail over
+# to the next on error, and are hedged (sent to the next one as well) when
+# the first has not answered within its usual LLM_HEDGE_PERCENTILE latency.
+ROUTER_WINDOW = int(os.getenv("LLM_ROUTER_WINDOW", "50"))
+# Fewer samples than this: latency percentiles are not trusted (no hedging,
+# error rate not judged).
+MIN_SAMPLES = 5
+# An endpoint is skipped (tried last) for LLM_ROUTER_COOLDOWN_SECONDS after a
+# failure once its recent error rate reaches this, or after this many errors in a row.
+MAX_ERROR_RATE = float(os.getenv("LLM_ROUTER_MAX_ERROR_RATE", "0.5"))
+MAX_CONSECUTIVE_ERRORS = 3
+COOLDOWN_SECONDS = float(os.getenv("LLM_ROUTER_COOLDOWN_SECONDS", "60"))
+# 0 disables hedging; never hedge sooner than LLM_HEDGE_MIN_SECONDS.
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_SECONDS = float(os.getenv("LLM_HEDGE_MIN_SECONDS", "2"))
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class LLMProvider:
+    name: str
+    base_url: Optional[str]  # None = api.openai.com
+    api_key: str
+    model: str
+
+    @property
+    def is_stub(self) -> bool:
+        return (self.base_url or "").startswith("stub://")
+
+    @property
+    def usable(self) -> bool:
+        return bool(self.api_key) or self.is_stub
+
+
+def providers_from_env(default: LLMProvider) -> List[LLMProvider]:
+    """LLM_PROVIDERS=name1,name2,... with LLM_<NAME>_BASE_URL/_API_KEY/_MODEL each.
+
+    Unset: just `default` (the OPENAI_* settings). A name without its own
+    settings falls back to them too; "stub" defaults to the local stub.
+    """
+    names = [n.strip() for n in (os.getenv("LLM_PROVIDERS") or "").split(",") if n.strip()]
+    if not names:
+        return [default]
+    out: List[LLMProvider] = []
+    for name in names:
+        prefix = f"LLM_{name.upper().replace('-', '_')}_"
+        base_url = (os.getenv(prefix + "BASE_URL") or "").strip() or None
+        if base_url is None:
+            base_url = f"stub://{name}" if name == "stub" else default.base_url
+        out.append(LLMProvider(
+            name=name,
+            base_url=base_url,
+            api_key=(os.getenv(prefix + "API_KEY") or "").strip() or default.api_key,
+            model=(os.getenv(prefix + "MODEL") or "").strip() or default.model,
+        ))
+    return out
+
+
+class _ProviderStats:
+    def __init__(self) -> None:
+        self.latencies: Deque[float] = deque(maxlen=ROUTER_WINDOW)  # seconds, successful calls
+        self.outcomes: Deque[bool] = deque(maxlen=ROUTER_WINDOW)
+        self.consecutive_errors = 0
+        self.last_error_at = 0.0
+        self.last_error = ""
+
+    def percentile(self, q: float) -> float:
+        vals = sorted(self.latencies)
+        if not vals:
+            return 0.0
+        return vals[min(len(vals) - 1, int(round(q * (len(vals) - 1))))]
+
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def healthy(self, now: float) -> bool:
+        failing = self.consecutive_errors >= MAX_CONSECUTIVE_ERRORS or (
+            len(self.outcomes) >= MIN_SAMPLES and self.error_rate() >= MAX_ERROR_RATE
+        )
+        return not failing or now - self.last_error_at >= COOLDOWN_SECONDS
+
+
+class LLMRouter:
+    """Routes calls over `providers` by rolling latency and health."""
+
+    def __init__(self, providers: List[LLMProvider]) -> None:
+        if not providers:
+            raise RuntimeError("No LLM provider configured")
+        self.providers = list(providers)
+        self._stats = {p: _ProviderStats() for p in self.providers}
+        self._lock = threading.Lock()
+
+    def ranked(self) -> List[LLMProvider]:
+        """Healthy providers before unhealthy ones; within each, by error state, then fastest first.
+
+        A provider whose last call failed comes after those whose last call
+        succeeded, then providers are compared by error rate (in steps of
+        10%) and only then by median latency, so one that has only failed
+        (and so has no latency yet) does not look fastest. Untried providers
+        come first.
+        """
+        now = time.monotonic()
+        with self._lock:
+            keys = {
+                p: (not s.healthy(now), s.consecutive_errors > 0, int(s.error_rate() * 10), s.percentile(0.5), i)
+                for i, (p, s) in enumerate(self._stats.items())
+            }
+        return sorted(self.providers, key=keys.__getitem__)
+
+    def hedge_delay(self, provider: LLMProvider) -> Optional[float]:
+        """Seconds to wait for `provider` before also asking the next one (None = do not hedge)."""
+        if HEDGE_PERCENTILE <= 0:
+            return None
+        with self._lock:
+            s = self._stats[provider]
+            if len(s.latencies) < MIN_SAMPLES:
+                return None
+            return max(HEDGE_MIN_SECONDS, s.percentile(HEDGE_PERCENTILE))
+
+    def _record(self, provider: LLMProvider, seconds: Optional[float], error: str = "") -> None:
+        with self._lock:
+            s = self._stats[provider]
+            s.outcomes.append(seconds is not None)
+            if seconds is None:
+                s.consecutive_errors += 1
+                s.last_error_at = time.monotonic()
+                s.last_error = error[:300]
+            else:
+                s.consecutive_errors = 0
+                s.latencies.append(seconds)
+
+    def _timed(self, provider: LLMProvider, fn: Callable[[LLMProvider], T]) -> T:
+        # Timed from here, on the thread making the call, not from when it was requested.
+        t0 = time.perf_counter()
+        try:
+            out = fn(provider)
+        except Exception as e:
+            self._record(provider, None, str(e))
+            inc("adg_llm_requests_total", provider=provider.name, result="error")
+            raise
+        seconds = time.perf_counter() - t0
+        self._record(provider, seconds)
+        observe("adg_llm_provider_seconds", seconds, provider=provider.name)
+        inc("adg_llm_requests_total", provider=provider.name, result="ok")
+        return out
+
+    def call(self, fn: Callable[[LLMProvider], T]) -> Tuple[T, LLMProvider, bool]:
+        """(fn(provider), provider that answered, whether the call was hedged).
+
+        Providers are tried in ranked() order: the next one is started when
+        the current one fails, or (once per call) when it is slower than its
+        hedge_delay(). The first success wins; a hedged loser keeps running in
+        the background and only updates the latency statistics. Each attempt
+        gets a thread of its own (see _spawn), so a loser never delays other
+        calls.
+        """
+        order = self.ranked()
+        if len(order) == 1:
+            return self._timed(order[0], fn), order[0], False
+
+        pending: Dict[Future, LLMProvider] = {}
+        errors: List[Tuple[LLMProvider, Exception]] = []
+        hedged = False
+        started = 0
+        hedge_at: Optional[float] = None
+
+        def start() -> None:
+            nonlocal started, hedge_at
+            p = order[started]
+            started += 1
+            pending[_spawn(p.name, self._timed, p, fn)] = p
+            delay = None if hedged else self.hedge_delay(p)
+            hedge_at = time.monotonic() + delay if delay is not None else None
+
+        start()
+        while pending:
+            timeout = None
+            if hedge_at is not None and started < len(order):
+                timeout = max(0.0, hedge_at - time.monotonic())
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                inc("adg_llm_hedges_total", provider=order[started].name)
+                logging.info("LLM %s is slow; hedging on %s", pending[next(iter(pending))].name, order[started].name)
+                start()
+                continue
+            for f in done:
+                p = pending.pop(f)
+                try:
+                    return f.result(), p, hedged
+                except Exception as e:
+                    errors.append((p, e))
+                    logging.warning("LLM provider %s failed: %s", p.name, e)
+            if not pending and started < len(order):
+                start()  # fail over
+
+        if len(errors) == 1:
+            raise errors[0][1]
+        summary = "; ".join(f"{p.name}: {e}" for p, e in errors)
+        raise RuntimeError(f"All LLM providers failed: {summary}") from errors[-1][1]
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Per-provider rolling stats, in current routing order."""
+        now = time.monotonic()
+        order = self.ranked()
+        with self._lock:
+            return [
+                {
+                    "name": p.name,
+                    "model": p.model,
+                    "base_url": p.base_url or "https://api.openai.com/v1",
+                    "healthy": self._stats[p].healthy(now),
+                    "samples": len(self._stats[p].outcomes),
+                    "p50_ms": round(self._stats[p].percentile(0.50) * 1000, 1),
+                    "p95_ms": round(self._stats[p].percentile(0.95) * 1000, 1),
+                    "error_rate": round(self._stats[p].error_rate(), 3),
+                    "last_error": self._stats[p].last_error,
+                }
+                for p in order
+            ]
+
+
+_routers: Dict[Tuple[LLMProvider, ...], LLMRouter] = {}
+_lock = threading.Lock()
+
+
+def llm_router(providers: List[LLMProvider]) -> LLMRouter:
+    """The process-wide router (and its statistics) for this provider list."""
+    key = tuple(providers)
+    with _lock:
+        r = _routers.get(key)
+        if r is None:
+            r = _routers[key] = LLMRouter(list(providers))
+    return r
+
+
+def _spawn(name: str, fn: Callable[..., T], *args: Any) -> "Future[T]":
+    """Run fn(*args) on a new daemon thread, right away.
+
+    Not a shared pool: hedged losers still waiting on their provider would
+    hold its threads, and new calls would queue behind them (and hedge on
+    that queueing). At most len(providers) threads per call.
+    """
+    f: "Future[T]" = Future()
+    f.set_running_or_notify_cancel()
+
+    def run() -> None:
+        try:
+            f.set_result(fn(*args))
+        except BaseException as e:
+            f.set_exception(e)
+
+    threading.Thread(target=run, name=f"llm-{name}", daemon=True).start()
+    return f
+
+
+def _reset_after_fork() -> None:
+    global _lock
+    _routers.clear()
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
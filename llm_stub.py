@@ -0,0 +1,67 @@
+import re
+import json
+import time
+import random
+import threading
+from types import SimpleNamespace
+from typing import Any, Dict, List
+from urllib.parse import parse_qs, urlparse
+
+# In-process stand-in for an OpenAI client, for trying the app and the LLM
+# router without network access or an API key. Used for any base URL of the
+# form stub://[name]?latency_ms=300&jitter_ms=50&error_rate=0.1&seed=1.
+# Honours n= and the "đúng N phương án" variants instruction of llm_client.
+
+_VARIANTS = re.compile(r"gồm đúng (\d+) phương án")
+
+
+class StubLLMError(RuntimeError):
+    """Injected failure (behaves like a 503 from a real provider)."""
+
+    status_code = 503
+
+
+class StubLLM:
+    """Answers chat.completions.create() with fixed caption JSON objects."""
+
+    def __init__(self, base_url: str) -> None:
+        u = urlparse(base_url)
+        q = {k: v[0] for k, v in parse_qs(u.query).items()}
+        self.name = u.netloc or "stub"
+        self.latency_ms = float(q.get("latency_ms", 0))
+        self.jitter_ms = float(q.get("jitter_ms", 0))
+        self.error_rate = float(q.get("error_rate", 0))
+        self._rng = random.Random(int(q["seed"]) if "seed" in q else None)
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model: str, messages: List[Dict[str, str]], **kwargs: Any) -> Any:
+        with self._lock:
+            delay = max(0.0, self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+            fail = self._rng.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise StubLLMError(f"{self.name}: injected failure")
+        prompt = " ".join(m["content"] for m in messages)
+        topic = next((line.split(":", 1)[1].strip() for line in prompt.splitlines() if "chủ đề:" in line), "")
+        m = _VARIANTS.search(prompt)
+        listed = int(m.group(1)) if m else 0
+        n = max(1, int(kwargs.get("n") or 1))
+        contents = []
+        for c in range(n):
+            captions = [self._caption(topic, c * max(1, listed) + i) for i in range(max(1, listed))]
+            body = {"variants": captions} if listed else captions[0]
+            contents.append(json.dumps(body, ensure_ascii=False))
+        return SimpleNamespace(
+            model=model,
+            choices=[
+                SimpleNamespace(index=i, message=SimpleNamespace(role="assistant", content=c))
+                for i, c in enumerate(contents)
+            ],
+            usage=SimpleNamespace(prompt_tokens=len(prompt) // 4, completion_tokens=sum(len(c) for c in contents) // 4),
+        )
+
+    def _caption(self, topic: str, i: int) -> Dict[str, str]:
+        title = f"{topic or 'Bài viết'} ({self.name}" + (f" #{i + 1})" if i else ")")
+        return {"title": title, "content": f"Nội dung mẫu {i + 1} từ {self.name} về {topic}."}
@@ -1,13 +1,53 @@
+import sys
 import json
+import atexit
 import argparse
-from worker import post_next_approved, generate_preview, post_to_facebook
+from typing import Any, Dict
+from metrics import summary
+from worker import post_next_approved, generate_preview, publish_approved_post
+
+class ProgressBar:
+    """One-line stderr progress bar fed by publish progress events."""
+
+    WIDTH = 30
+
+    def __init__(self) -> None:
+        self.media: Dict[str, Dict[str, Any]] = {}
+        self.stage = ""
+
+    def __call__(self, event: str, **fields: Any) -> None:
+        if event == "stage":
+            self.stage = fields.get("stage", "")
+        elif event == "media":
+            self.media[str(fields.get("media_id"))] = fields
+        elif event == "done":
+            print(file=sys.stderr)
+            return
+        else:
+            return
+        sent = sum(int(m.get("bytes_sent") or 0) for m in self.media.values())
+        total = sum(int(m.get("bytes_total") or 0) for m in self.media.values())
+        rate = sum(float(m.get("bytes_per_sec") or 0) for m in self.media.values() if m.get("status") != "done")
+        frac = sent / total if total else 0.0
+        bar = "#" * int(frac * self.WIDTH)
+        line = f"\r[{bar:<{self.WIDTH}}] {frac * 100:5.1f}% {sent / 1e6:.1f}/{total / 1e6:.1f} MB"
+        if rate > 0:
+            line += f" {rate / 1e6:.2f} MB/s ETA {(total - sent) / rate:.0f}s"
+        print(f"{line} {self.stage}".ljust(100), end="", file=sys.stderr, flush=True)
+
 
 def main():
     p = argparse.ArgumentParser(description="ADG | AI Facebook Poster (DB-backed)")
     p.add_argument("cmd", choices=["post-next-approved", "generate-preview", "post"])
     p.add_argument("--id", type=int, default=0, help="Post ID for generate-preview/post")
+    p.add_argument("--variants", type=int, default=1, help="Caption alternatives for generate-preview (one LLM call)")
+    p.add_argument("--metrics", action="store_true", help="Print timing/usage summary to stderr on exit")
+    p.add_argument("--no-progress", action="store_true", help="Do not draw the upload progress bar for post")
     args = p.parse_args()
 
+    if args.metrics:
+        atexit.register(lambda: print(json.dumps(summary(), ensure_ascii=False, indent=2), file=sys.stderr))
+
     if args.cmd == "post-next-approved":
         result = post_next_approved()
         print(json.dumps(result, ensure_ascii=False, indent=2))
@@ -17,10 +57,11 @@ def main():
         raise SystemExit("--id is required for this command")
 
     if args.cmd == "generate-preview":
-        result = generate_preview(args.id)
+        result = generate_preview(args.id, variants=args.variants)
         print(json.dumps(result, ensure_ascii=False, indent=2))
     elif args.cmd == "post":
-        result = post_to_facebook(args.id)
+        show_progress = sys.stderr.isatty() and not args.no_progress
+        result = publish_approved_post(args.id, progress=ProgressBar() if show_progress else None)
         print(json.dumps(result, ensure_ascii=False, indent=2))
 
 if __name__ == "__main__":
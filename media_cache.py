@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+from io import BytesIO
+from typing import Any, Dict, Optional
+
+from repository import data_dir
+
+THUMB_MAX_SIDE = 320
+PREVIEW_MAX_SIDE = 1024
+WEBP_QUALITY = 80
+
+# Remote originals are re-used without a network round-trip for this long,
+# then revalidated with If-None-Match / If-Modified-Since.
+REMOTE_REVALIDATE_SECONDS = int(os.getenv("MEDIA_CACHE_REVALIDATE_SECONDS", "3600"))
+REMOTE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_REMOTE_MAX_BYTES", str(30 * 1024 * 1024)))
+
+
+def cache_dir(db_path: str, name: str) -> str:
+    base = data_dir(db_path)
+    path = os.path.join(base, "cache", name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _atomic_write(path: str, data: bytes) -> None:
+    # A unique temp file per call: threads of one process may write the same path.
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def _derivative(db_path: str, src_path: str, max_side: int) -> str:
+    """Return a cached WebP no larger than max_side, generating it on first request.
+
+    Falls back to the original path when the file cannot be decoded as an image.
+    """
+    st = os.stat(src_path)
+    key = hashlib.sha1(f"{os.path.abspath(src_path)}:{st.st_mtime_ns}:{st.st_size}:{max_side}".encode()).hexdigest()
+    out = os.path.join(cache_dir(db_path, "derivatives"), f"{key}.webp")
+    if os.path.isfile(out):
+        return out
+
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(src_path) as im:
+            im.draft("RGB", (max_side, max_side))  # cheap JPEG DCT downscale before resampling
+            im = ImageOps.exif_transpose(im)
+            im.thumbnail((max_side, max_side))
+            if im.mode not in ("RGB", "RGBA"):
+                im = im.convert("RGBA" if "A" in im.getbands() else "RGB")
+            buf = BytesIO()
+            im.save(buf, format="WEBP", quality=WEBP_QUALITY, method=4)
+    except Exception:
+        return src_path
+    _atomic_write(out, buf.getvalue())
+    return out
+
+
+def thumbnail_for_file(db_path: str, file_path: str, max_side: int = THUMB_MAX_SIDE) -> str:
+    return _derivative(db_path, file_path, max_side)
+
+
+def _load_meta(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def fetch_remote(db_path: str, url: str, timeout: int = 30) -> Optional[str]:
+    """Download a remote image once into the cache and return its local path.
+
+    Cached copies are revalidated with the stored ETag/Last-Modified after
+    REMOTE_REVALIDATE_SECONDS. Returns None if the URL cannot be fetched and
+    nothing is cached yet.
+    """
+    import requests
+
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    base = cache_dir(db_path, "remote")
+    body_path = os.path.join(base, key)
+    meta_path = body_path + ".json"
+
+    meta = _load_meta(meta_path)
+    have_body = os.path.isfile(body_path)
+    if have_body and time.time() - float(meta.get("checked_at", 0)) < REMOTE_REVALIDATE_SECONDS:
+        return body_path
+
+    headers: Dict[str, str] = {}
+    if have_body and meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if have_body and meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        with requests.get(url, headers=headers, timeout=timeout, stream=True) as resp:
+            if resp.status_code == 304 and have_body:
+                meta["checked_at"] = time.time()
+                _atomic_write(meta_path, json.dumps(meta).encode("utf-8"))
+                return body_path
+            resp.raise_for_status()
+            chunks = []
+            size = 0
+            for chunk in resp.iter_content(64 * 1024):
+                size += len(chunk)
+                if size > REMOTE_MAX_BYTES:
+                    raise RuntimeError(f"Remote media larger than {REMOTE_MAX_BYTES} bytes")
+                chunks.append(chunk)
+            _atomic_write(body_path, b"".join(chunks))
+            meta = {
+                "url": url,
+                "etag": resp.headers.get("ETag", ""),
+                "last_modified": resp.headers.get("Last-Modified", ""),
+                "content_type": resp.headers.get("Content-Type", ""),
+                "size": size,
+                "checked_at": time.time(),
+            }
+            _atomic_write(meta_path, json.dumps(meta).encode("utf-8"))
+            return body_path
+    except Exception:
+        # Serve a stale copy rather than nothing when the origin is down.
+        return body_path if have_body else None
+
+
+def thumbnail_for_url(db_path: str, url: str, max_side: int = THUMB_MAX_SIDE) -> Optional[str]:
+    local = fetch_remote(db_path, url)
+    if not local:
+        return None
+    return _derivative(db_path, local, max_side)
@@ -0,0 +1,180 @@
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+# Latency buckets (seconds) spanning a local SQLite call up to a long video upload.
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+RESERVOIR_SIZE = 1024
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class _Histogram:
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent: Deque[float] = deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, v: float) -> None:
+        i = 0
+        while i < len(BUCKETS) and v > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += v
+        self.count += 1
+        self.recent.append(v)
+
+    def percentile(self, q: float) -> float:
+        vals = sorted(self.recent)
+        if not vals:
+            return 0.0
+        return vals[min(len(vals) - 1, int(round(q * (len(vals) - 1))))]
+
+
+_lock = threading.Lock()
+_histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+_counters: Dict[str, Dict[LabelKey, float]] = {}
+_help: Dict[str, str] = {
+    "adg_span_seconds": "Duration of instrumented operations.",
+    "adg_upload_bytes_total": "Bytes sent to Facebook in media uploads.",
+    "adg_upload_seconds_total": "Time spent sending media uploads (bytes_total / seconds_total = throughput).",
+    "adg_upload_stalls_total": "Uploads aborted because no bytes were sent for UPLOAD_STALL_TIMEOUT seconds.",
+    "adg_publish_reconcile_total": "Page lookups for a create whose outcome was unknown, by result (found/not_found/unavailable/error).",
+    "adg_graph_batch_ambiguous_total": "Publishing Graph batches that failed as a whole and were not retried op by op.",
+    "adg_llm_tokens_total": "LLM tokens used, by type (prompt/completion).",
+    "adg_llm_requests_total": "LLM completion requests, by provider and result (ok/error).",
+    "adg_llm_provider_seconds": "Latency of successful LLM completions, by provider.",
+    "adg_llm_hedges_total": "LLM requests also sent to this provider because the first one was slow.",
+    "adg_llm_prompt_trimmed_total": "Caption prompts cut to LLM_PROMPT_TOKEN_BUDGET, by part trimmed.",
+    "adg_llm_json_total": "LLM caption replies by parse result (valid/repaired/invalid); invalid ones are retried.",
+    "adg_llm_json_repairs_total": "Local fixes applied to malformed LLM JSON, by fix.",
+    "adg_db_writes_total": "Writes through the single DB writer, by result (ok/error).",
+    "adg_db_write_batches_total": "Transactions committed by the single DB writer (writes_total / batches_total = group size).",
+    "adg_db_write_commit_seconds": "Duration of one grouped write transaction, commit included.",
+    "adg_retries_total": "Retries, by operation.",
+    "adg_errors_total": "Failed instrumented operations.",
+    "adg_cache_total": "Cache lookups, by cache and result.",
+}
+
+
+def observe(name: str, value: float, **labels: Any) -> None:
+    with _lock:
+        h = _histograms.setdefault(name, {}).get(_key(labels))
+        if h is None:
+            h = _histograms[name][_key(labels)] = _Histogram()
+        h.observe(value)
+
+
+def inc(name: str, value: float = 1, **labels: Any) -> None:
+    with _lock:
+        series = _counters.setdefault(name, {})
+        k = _key(labels)
+        series[k] = series.get(k, 0) + value
+
+
+@contextmanager
+def span(name: str, **labels: Any):
+    """Time a block into adg_span_seconds{span=name}; failures also bump adg_errors_total."""
+    t0 = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        inc("adg_errors_total", span=name)
+        raise
+    finally:
+        observe("adg_span_seconds", time.perf_counter() - t0, span=name, status=status, **labels)
+
+
+def timed(name: Optional[str] = None) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorator form of span(); defaults to the function's module.qualname."""
+
+    def deco(fn: Callable[..., Any]) -> Callable[..., Any]:
+        span_name = name or f"{fn.__module__}.{fn.__qualname__}"
+
+        @wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(span_name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return deco
+
+
+def _fmt_labels(k: LabelKey, extra: Optional[Dict[str, str]] = None) -> str:
+    items = list(k) + sorted((extra or {}).items())
+    if not items:
+        return ""
+    body = ",".join('%s="%s"' % (n, str(v).replace("\\", "\\\\").replace('"', '\\"')) for n, v in items)
+    return "{" + body + "}"
+
+
+def render_prometheus() -> str:
+    """Prometheus text exposition format (0.0.4)."""
+    lines: List[str] = []
+    with _lock:
+        for name, series in sorted(_histograms.items()):
+            lines.append(f"# HELP {name} {_help.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for k, h in sorted(series.items()):
+                cum = 0
+                for b, c in zip(BUCKETS, h.counts):
+                    cum += c
+                    lines.append(f"{name}_bucket{_fmt_labels(k, {'le': repr(float(b))})} {cum}")
+                lines.append(f"{name}_bucket{_fmt_labels(k, {'le': '+Inf'})} {h.count}")
+                lines.append(f"{name}_sum{_fmt_labels(k)} {h.sum}")
+                lines.append(f"{name}_count{_fmt_labels(k)} {h.count}")
+        for name, series in sorted(_counters.items()):
+            lines.append(f"# HELP {name} {_help.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+            for k, v in sorted(series.items()):
+                lines.append(f"{name}{_fmt_labels(k)} {v}")
+    return "\n".join(lines) + "\n"
+
+
+def summary() -> Dict[str, Any]:
+    """Per-span latency percentiles (ms) plus all counters, for CLI/JSON output."""
+    out: Dict[str, Any] = {"spans": {}, "counters": {}}
+    with _lock:
+        for k, h in _histograms.get("adg_span_seconds", {}).items():
+            labels = dict(k)
+            label = labels.pop("span")
+            if labels.get("status") == "ok":
+                labels.pop("status")
+            if labels:
+                label += _fmt_labels(_key(labels))
+            out["spans"][label] = {
+                "count": h.count,
+                "p50_ms": round(h.percentile(0.50) * 1000, 1),
+                "p95_ms": round(h.percentile(0.95) * 1000, 1),
+                "p99_ms": round(h.percentile(0.99) * 1000, 1),
+                "max_ms": round(max(h.recent, default=0.0) * 1000, 1),
+            }
+        for name, series in _counters.items():
+            for k, v in series.items():
+                out["counters"][name + _fmt_labels(k)] = v
+        parsed = {dict(k).get("result"): v for k, v in _counters.get("adg_llm_json_total", {}).items()}
+    if parsed:
+        # Share of malformed replies fixed locally instead of by another completion.
+        malformed = parsed.get("repaired", 0) + parsed.get("invalid", 0)
+        out["llm_json"] = {
+            **{r: parsed.get(r, 0) for r in ("valid", "repaired", "invalid")},
+            "repair_hit_rate": round(parsed.get("repaired", 0) / malformed, 3) if malformed else None,
+        }
+    return out
+
+
+def reset() -> None:
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
@@ -0,0 +1,168 @@
+import os
+import hashlib
+import logging
+import mimetypes
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+from db import list_post_media, now_iso, update_post_media
+from repository import data_dir
+
+if TYPE_CHECKING:
+    import requests
+
+# Facebook rejects photos above ~10 MB and non-resumable video uploads above 1 GB.
+MAX_BYTES = {
+    "image_url": int(os.getenv("PREFETCH_MAX_IMAGE_BYTES", str(10 * 1024 * 1024))),
+    "video_url": int(os.getenv("PREFETCH_MAX_VIDEO_BYTES", str(1024 * 1024 * 1024))),
+}
+CONTENT_TYPE_PREFIX = {"image_url": ("image/",), "video_url": ("video/", "application/octet-stream")}
+# Content types that say nothing about the format; the file extension then
+# comes from the URL path, else from the file's first bytes.
+GENERIC_CONTENT_TYPES = ("", "application/octet-stream", "binary/octet-stream")
+TIMEOUT = (5, 30)  # (connect, read)
+
+_background = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+
+
+def _prefetch_dir(db_path: str) -> str:
+    base = data_dir(db_path)
+    path = os.path.join(base, "uploads", "prefetch")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _check_headers(kind: str, status: int, headers: Any) -> Dict[str, Any]:
+    if status >= 400:
+        raise RuntimeError(f"HTTP {status}")
+    ctype = (headers.get("Content-Type") or "").split(";")[0].strip().lower()
+    if ctype and not ctype.startswith(CONTENT_TYPE_PREFIX[kind]):
+        raise RuntimeError(f"Unexpected Content-Type {ctype!r}")
+    size = int(headers.get("Content-Length") or 0)
+    if size > MAX_BYTES[kind]:
+        raise RuntimeError(f"Too large ({size} bytes > {MAX_BYTES[kind]})")
+    return {"content_type": ctype, "size_bytes": size}
+
+
+def _sniff_extension(head: bytes) -> str:
+    """Extension for the common image/video signatures ("" if unknown)."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if head.startswith(b"\x89PNG"):
+        return ".png"
+    if head.startswith(b"GIF8"):
+        return ".gif"
+    if head.startswith(b"RIFF") and head[8:12] in (b"WEBP", b"AVI "):
+        return ".webp" if head[8:12] == b"WEBP" else ".avi"
+    if head[4:8] == b"ftyp":
+        return ".mov" if head[8:12] == b"qt  " else ".mp4"
+    if head.startswith(b"\x1aE\xdf\xa3"):
+        return ".webm"
+    return ""
+
+
+def _extension(url: str, ctype: str, head: bytes) -> str:
+    if ctype not in GENERIC_CONTENT_TYPES:
+        ext = mimetypes.guess_extension(ctype)
+        if ext:
+            return ext
+    ext = os.path.splitext(urlparse(url).path)[1].lower()
+    if (mimetypes.guess_type("x" + ext)[0] or "").startswith(("image/", "video/")):
+        return ext
+    return _sniff_extension(head)
+
+
+def _download(db_path: str, kind: str, url: str, resp: "requests.Response", ctype: str) -> Dict[str, Any]:
+    name = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    folder = _prefetch_dir(db_path)
+    # Unique per download: two threads may fetch the same URL at once.
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix=name + ".", suffix=".tmp")
+    size = 0
+    head = b""
+    h = hashlib.sha256()
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in resp.iter_content(256 * 1024):
+                size += len(chunk)
+                if size > MAX_BYTES[kind]:
+                    raise RuntimeError(f"Too large (> {MAX_BYTES[kind]} bytes)")
+                if len(head) < 16:
+                    head += chunk[: 16 - len(head)]
+                h.update(chunk)
+                f.write(chunk)
+        # The extension is what later uploads go by (photo vs video, format).
+        fn = name + _extension(url, ctype, head)
+        os.replace(tmp, os.path.join(folder, fn))
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return {"local_file": os.path.join("prefetch", fn), "size_bytes": size, "content_hash": h.hexdigest()}
+
+
+def validate_media(db_path: str, media: Dict[str, Any], download: bool = True) -> Dict[str, Any]:
+    """HEAD (falling back to GET) a remote media URL, optionally caching it locally.
+
+    Returns the post_media updates; never raises.
+    """
+    import requests
+
+    kind = media["kind"]
+    url = media["source"]
+    updates: Dict[str, Any] = {"validated_at": now_iso()}
+    try:
+        info: Dict[str, Any] = {}
+        if not download:
+            head = requests.head(url, allow_redirects=True, timeout=TIMEOUT)
+            # Many CDNs don't implement HEAD or omit Content-Type; fall back to GET below.
+            if head.status_code < 400 and head.headers.get("Content-Type"):
+                info = _check_headers(kind, head.status_code, head.headers)
+        if not info:
+            with requests.get(url, stream=True, allow_redirects=True, timeout=TIMEOUT) as resp:
+                info = _check_headers(kind, resp.status_code, resp.headers)
+                if download:
+                    info.update(_download(db_path, kind, url, resp, info["content_type"]))
+        updates.update(info)
+        updates.update({"validation_status": "OK", "validation_error": ""})
+    except Exception as e:
+        updates.update({"validation_status": "INVALID", "validation_error": str(e)[:500], "local_file": ""})
+    return updates
+
+
+def prefetch_post_media(db_path: str, post_id: int, download: bool = True, max_workers: int = 8) -> List[Dict[str, Any]]:
+    """Validate (and optionally download) all remote media of a post concurrently."""
+    rows = [m for m in list_post_media(db_path, post_id) if m["kind"] in ("image_url", "video_url")]
+    if not rows:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(rows))) as ex:
+        results = list(ex.map(lambda m: validate_media(db_path, m, download), rows))
+    out = []
+    for m, updates in zip(rows, results):
+        update_post_media(db_path, int(m["id"]), updates)
+        out.append({"id": m["id"], "source": m["source"], **updates})
+    return out
+
+
+def schedule_prefetch(db_path: str, post_id: int, download: Optional[bool] = None) -> None:
+    """Fire-and-forget prefetch, e.g. right after a post is APPROVED."""
+    if os.getenv("PREFETCH_MEDIA", "1").strip().lower() in ("0", "false", "no"):
+        return
+    if download is None:
+        download = os.getenv("PREFETCH_DOWNLOAD", "1").strip().lower() not in ("0", "false", "no")
+
+    def run() -> None:
+        try:
+            prefetch_post_media(db_path, post_id, download=download)
+        except Exception:
+            logging.exception("Prefetch failed for post %s", post_id)
+
+    _background.submit(run)
+
+
+def prefetched_path(upload_dir: str, media: Dict[str, Any]) -> Optional[str]:
+    """Local copy of a validated remote media row, if it is still on disk."""
+    if media.get("validation_status") != "OK" or not media.get("local_file"):
+        return None
+    path = os.path.join(upload_dir, media["local_file"])
+    return path if os.path.isfile(path) else None
@@ -0,0 +1,186 @@
+import os
+import math
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+# Size control for the caption prompt. Tokens are counted locally: exactly
+# with tiktoken when it is installed (optional), otherwise estimated from the
+# UTF-8 length, which over-counts rather than under-counts Vietnamese text.
+PROMPT_TOKEN_BUDGET = int(os.getenv("LLM_PROMPT_TOKEN_BUDGET", "3000"))
+# Passed as max_tokens; 0 = let the provider decide.
+MAX_COMPLETION_TOKENS = int(os.getenv("LLM_MAX_COMPLETION_TOKENS", "1200"))
+# SEO keywords beyond this many are dropped even when the budget allows them;
+# the first MIN_KEYWORDS are only dropped after the brief has been cut.
+MAX_KEYWORDS = 10
+MIN_KEYWORDS = 3
+# Chat framing per message (role, separators) and per request.
+MESSAGE_OVERHEAD_TOKENS = 4
+REQUEST_OVERHEAD_TOKENS = 3
+# A rejected reply is echoed back in the retry turn, cut to this length, if
+# it fits; the first request leaves room for the retry instruction itself.
+RETRY_REPLY_TOKENS = 200
+RETRY_RESERVE_TOKENS = 64
+BYTES_PER_TOKEN_ESTIMATE = 3
+TRUNCATION_MARK = " …"
+
+EXTRA_REQUIREMENTS_HEADING = "Yêu cầu bổ sung (từ trang duyệt):"
+
+_encodings: Dict[str, Any] = {}
+_encodings_lock = threading.Lock()
+_no_tiktoken = False
+
+
+def _encoding(model: str) -> Optional[Any]:
+    """tiktoken encoding for `model`, or None when tiktoken is unavailable."""
+    global _no_tiktoken
+    if _no_tiktoken:
+        return None
+    with _encodings_lock:
+        if model in _encodings:
+            return _encodings[model]
+        try:
+            import tiktoken
+
+            try:
+                enc = tiktoken.encoding_for_model(model)
+            except KeyError:
+                enc = tiktoken.get_encoding("o200k_base")  # non-OpenAI model names
+        except Exception:
+            # Not installed, or its BPE files cannot be fetched (offline).
+            _no_tiktoken = True
+            return None
+        _encodings[model] = enc
+        return enc
+
+
+def count_tokens(text: str, model: str = "") -> int:
+    enc = _encoding(model)
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return math.ceil(len(text.encode("utf-8")) / BYTES_PER_TOKEN_ESTIMATE)
+
+
+def count_message_tokens(messages: List[Dict[str, str]], model: str = "") -> int:
+    return REQUEST_OVERHEAD_TOKENS + sum(
+        count_tokens(m["content"], model) + MESSAGE_OVERHEAD_TOKENS for m in messages
+    )
+
+
+def truncate_tokens(text: str, max_tokens: int, model: str = "") -> str:
+    """`text` cut to at most `max_tokens` tokens (including the truncation mark)."""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    room = max_tokens - count_tokens(TRUNCATION_MARK, model)
+    if room <= 0:
+        return ""
+    enc = _encoding(model)
+    if enc is not None:
+        return enc.decode(enc.encode(text, disallowed_special=())[:room]).rstrip() + TRUNCATION_MARK
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(text[:mid], model) <= room:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo].rstrip() + TRUNCATION_MARK
+
+
+@dataclass
+class CaptionPrompt:
+    """Messages for one caption request, within the token budget where possible."""
+
+    messages: List[Dict[str, str]]
+    model: str
+    budget: int
+    tokens: int  # local count of `messages`
+    keywords_used: int
+    trimmed: List[str] = field(default_factory=list)  # parts cut: keywords, main, extra_requirements
+
+    def retry_messages(self, bad_reply: str, instruction: str) -> List[Dict[str, str]]:
+        """The base messages plus one retry turn (earlier retry turns are not kept).
+
+        The rejected reply is included, shortened, when it still fits the budget.
+        """
+        reply = truncate_tokens(bad_reply.strip(), RETRY_REPLY_TOKENS, self.model)
+        turn = [{"role": "assistant", "content": reply}] if reply else []
+        turn.append({"role": "user", "content": instruction})
+        messages = self.messages + turn
+        if len(turn) > 1 and count_message_tokens(messages, self.model) > self.budget:
+            messages = self.messages + turn[-1:]
+            if "retry" not in self.trimmed:
+                self.trimmed.append("retry")
+        return messages
+
+
+def build_caption_prompt(
+    template: str,
+    system: str,
+    topic: str,
+    main: str,
+    extra_requirements: str,
+    mandatory: str,
+    seo_keywords: List[str],
+    model: str = "",
+    budget: int = PROMPT_TOKEN_BUDGET,
+) -> CaptionPrompt:
+    """Format the caption prompt and trim it to `budget` tokens.
+
+    Trimmed in order: SEO keywords down to MIN_KEYWORDS (last ones first),
+    the brief (`main`, keeping its start), the remaining keywords, then the
+    reviewer's extra requirements. The template and system prompt are never
+    cut. RETRY_RESERVE_TOKENS of the budget are kept free for a retry turn.
+    """
+    keywords = [k.strip() for k in seo_keywords if str(k or "").strip()]
+    trimmed: List[str] = []
+    if len(keywords) > MAX_KEYWORDS:
+        keywords = keywords[:MAX_KEYWORDS]
+        trimmed.append("keywords")
+
+    def render(main_text: str, extra_text: str, kws: List[str]) -> List[Dict[str, str]]:
+        combined = main_text
+        if extra_text:
+            combined = f"{main_text}\n\n{EXTRA_REQUIREMENTS_HEADING}\n{extra_text}".strip()
+        prompt = template.format(
+            topic=topic,
+            main=combined,
+            mandatory=mandatory,
+            seo_keywords=", ".join(kws) if kws else "(không có)",
+        )
+        return [{"role": "system", "content": system}, {"role": "user", "content": prompt}]
+
+    main = main.strip()
+    extra = extra_requirements.strip()
+    limit = budget - RETRY_RESERVE_TOKENS
+    messages = render(main, extra, keywords)
+    tokens = count_message_tokens(messages, model)
+
+    for part in ("keywords", "main", "keywords", "extra_requirements"):
+        if tokens <= limit:
+            break
+        if part == "keywords":
+            floor = MIN_KEYWORDS if "main" not in trimmed else 0
+            while tokens > limit and len(keywords) > floor:
+                keywords.pop()
+                if "keywords" not in trimmed:
+                    trimmed.append("keywords")
+                messages = render(main, extra, keywords)
+                tokens = count_message_tokens(messages, model)
+            continue
+        text = main if part == "main" else extra
+        if not text:
+            continue
+        keep = max(0, count_tokens(text, model) - (tokens - limit))
+        text = truncate_tokens(text, keep, model)
+        if part == "main":
+            main = text
+        else:
+            extra = text
+        trimmed.append(part)
+        messages = render(main, extra, keywords)
+        tokens = count_message_tokens(messages, model)
+
+    return CaptionPrompt(
+        messages=messages, model=model, budget=budget, tokens=tokens, keywords_used=len(keywords), trimmed=trimmed
+    )
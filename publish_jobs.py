@@ -0,0 +1,238 @@
+import os
+import json
+import time
+import datetime as dt
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, Optional, Set
+
+from db import (
+    now_iso,
+    get_post,
+    claim_publish_job,
+    create_publish_job,
+    expire_publish_job,
+    update_publish_job,
+    get_publish_job,
+    list_publish_jobs,
+)
+from worker import load_config, post_to_facebook_multi, publish_approved_post, token_fingerprint
+
+# Publishing runs here instead of the caller's thread (e.g. the Streamlit
+# script), so uploads survive UI reruns and browser refreshes. Jobs queued
+# without request tokens are unassigned: this process starts on one right
+# away, and any scheduler sharing the database may claim it first
+# (claim_publish_job), which spreads publishing over hosts with PostgreSQL.
+PUBLISH_JOB_WORKERS = int(os.getenv("PUBLISH_JOB_WORKERS", "2"))
+# Live progress is written to publish_jobs.progress_json at most this often.
+PROGRESS_FLUSH_SECONDS = 0.5
+# An unassigned job nobody claimed for this long (e.g. the process that
+# queued it exited and no scheduler polls the database) is failed by
+# recovery, so the post can be published again.
+QUEUED_JOB_STALE_SECONDS = int(os.getenv("PUBLISH_JOB_STALE_SECONDS", "3600"))
+
+_executor = ThreadPoolExecutor(max_workers=PUBLISH_JOB_WORKERS, thread_name_prefix="publish-job")
+_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+_recovered: Set[str] = set()
+# Unassigned jobs queued on _executor by this process and not claimed yet.
+_queued_here: Set[int] = set()
+_recover_lock = threading.Lock()
+
+
+class JobProgress:
+    """Accumulates worker progress events and persists them (throttled) to the job row.
+
+    State: {"targets": {<token fp>: {"page_id", "page_name", "stage", "status",
+    "error", "post_url", "media": {<media id>: {"name", "bytes_sent",
+    "bytes_total", "bytes_per_sec", "status"}}}}}
+    """
+
+    def __init__(self, db_path: str, job_id: int) -> None:
+        self.db_path = db_path
+        self.job_id = job_id
+        self.state: Dict[str, Any] = {"targets": {}}
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+
+    def __call__(self, event: str, target: str = "", **fields: Any) -> None:
+        with self._lock:
+            t = self.state["targets"].setdefault(
+                target, {"page_id": "", "page_name": "", "stage": "", "status": "running", "error": "", "media": {}}
+            )
+            if event == "stage":
+                t["stage"] = fields.get("stage", "")
+            elif event == "page":
+                t.update({k: v for k, v in fields.items() if v})
+            elif event == "media":
+                t["media"][str(fields.get("media_id"))] = {
+                    k: fields.get(k) for k in ("name", "bytes_sent", "bytes_total", "bytes_per_sec", "status")
+                }
+            elif event == "done":
+                t.update({"status": "done", "stage": "", "post_url": fields.get("post_url", "")})
+            elif event == "failed":
+                t.update({"status": "failed", "error": str(fields.get("error", ""))[:500]})
+        self.flush(force=event in ("done", "failed"))
+
+    def flush(self, force: bool = False) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_flush < PROGRESS_FLUSH_SECONDS:
+                return
+            self._last_flush = now
+            payload = json.dumps(self.state, ensure_ascii=False)
+        try:
+            update_publish_job(self.db_path, self.job_id, {"progress_json": payload})
+        except Exception:
+            logging.exception("Could not save progress of publish job %s", self.job_id)
+
+
+def _owner_alive(owner: str) -> bool:
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return True  # another machine: cannot tell, leave it alone
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _job_age(job: Dict[str, Any]) -> float:
+    try:
+        created = dt.datetime.strptime(str(job["created_at"]), "%Y-%m-%dT%H:%M:%S%z")
+    except ValueError:
+        return 0.0
+    return time.time() - created.timestamp()
+
+
+def _recover(db_path: str, job: Dict[str, Any]) -> bool:
+    """Fail an active job nobody is going to finish. True if it was failed."""
+    owner = str(job["owner"] or "")
+    if not owner:
+        if int(job["id"]) in _queued_here or _job_age(job) < QUEUED_JOB_STALE_SECONDS:
+            return False
+        return expire_publish_job(
+            db_path, int(job["id"]), f"Not picked up by any publisher within {QUEUED_JOB_STALE_SECONDS}s"
+        )
+    if owner == _OWNER or _owner_alive(owner):
+        return False
+    update_publish_job(db_path, int(job["id"]), {
+        "status": "FAILED",
+        "error": "Interrupted: the process running this job exited",
+        "finished_at": now_iso(),
+    })
+    return True
+
+
+def recover_interrupted_jobs(db_path: str) -> int:
+    """Mark jobs whose process died (e.g. app restart), or that nobody claimed, as FAILED. Returns how many."""
+    return sum(1 for job in list_publish_jobs(db_path, active_only=True, limit=1000) if _recover(db_path, job))
+
+
+def _run(db_path: str, job_id: int, post_id: int, tokens: List[str]) -> None:
+    progress = JobProgress(db_path, job_id)
+    update_publish_job(db_path, job_id, {"status": "RUNNING", "started_at": now_iso()})
+    status, error, result = "DONE", "", {}
+    try:
+        if len(tokens) >= 2:
+            result = post_to_facebook_multi(post_id, tokens, progress=progress)
+        else:
+            token = tokens[0] if tokens else ""
+            target = token_fingerprint(token or load_config().fb_page_access_token)
+            try:
+                # Target pages report under their own token's fingerprint.
+                result = publish_approved_post(post_id, token or None, progress=partial(progress, target=target))
+            except Exception as e:
+                progress("failed", target=target, error=str(e))
+                raise
+        failed, skipped = result.get("failed", 0), result.get("skipped", 0)
+        if failed or skipped:
+            # Skipped pages (no token, or published by another worker) are not done either.
+            total = len(result.get("results") or []) or len(tokens)
+            reasons = sorted({str(r.get("reason")) for r in result.get("results") or [] if r.get("skipped")})
+            parts = [f"{failed} failed"] if failed else []
+            if skipped:
+                parts.append(f"{skipped} skipped ({', '.join(reasons)})")
+            status, error = "FAILED", f"{failed + skipped}/{total} page(s) not posted: {'; '.join(parts)}"
+    except Exception as e:
+        logging.exception("Publish job %s failed", job_id)
+        status, error = "FAILED", str(e)
+    progress.flush(force=True)
+    update_publish_job(db_path, job_id, {
+        "status": status,
+        "error": error[:2000],
+        "result_json": json.dumps(result, ensure_ascii=False, default=str),
+        "finished_at": now_iso(),
+    })
+
+
+def run_queued_job(db_path: str, job_id: Optional[int] = None) -> bool:
+    """Claim and run the oldest unassigned job (or job `job_id`). False if another publisher had it.
+
+    The job publishes with the configured Page tokens (FB_PAGE_ACCESS_TOKEN(S)).
+    """
+    try:
+        job = claim_publish_job(db_path, _OWNER, job_id)
+    finally:
+        if job_id is not None:
+            _queued_here.discard(job_id)
+    if job is None:
+        return False
+    _run(db_path, int(job["id"]), int(job["post_id"]), [])
+    return True
+
+
+def submit_publish(db_path: str, post_id: int, page_access_tokens: Optional[List[str]] = None) -> int:
+    """Queue a publish of an APPROVED post (one or more Page tokens) and return the job id.
+
+    Tokens only live in memory for the duration of the job, so a job with
+    tokens always runs in this process.
+    """
+    with _recover_lock:
+        if db_path not in _recovered:
+            _recovered.add(db_path)
+            recover_interrupted_jobs(db_path)
+
+    post = get_post(db_path, post_id)
+    if not post:
+        raise RuntimeError("Post not found")
+    if str(post.get("status", "")).strip() != "APPROVED":
+        raise RuntimeError("Post must be APPROVED before posting")
+    active = list_publish_jobs(db_path, post_id=post_id, active_only=True, limit=1)
+    if active and not _recover(db_path, active[0]):
+        raise RuntimeError("A publish job for this post is already queued or running")
+
+    tokens = [str(t or "").strip() for t in (page_access_tokens or []) if str(t or "").strip()]
+    if not tokens:
+        job_id = create_publish_job(db_path, post_id, 1, "")
+        _queued_here.add(job_id)
+        _executor.submit(run_queued_job, db_path, job_id)
+        return job_id
+    job_id = create_publish_job(db_path, post_id, len(tokens), _OWNER)
+    _executor.submit(_run, db_path, job_id, post_id, tokens)
+    return job_id
+
+
+def get_job(db_path: str, job_id: int) -> Optional[Dict[str, Any]]:
+    """Job row with progress/result decoded."""
+    job = get_publish_job(db_path, job_id)
+    return _decode(job) if job else None
+
+
+def list_jobs(db_path: str, post_id: Optional[int] = None, active_only: bool = False, limit: int = 20) -> List[Dict[str, Any]]:
+    return [_decode(j) for j in list_publish_jobs(db_path, post_id=post_id, active_only=active_only, limit=limit)]
+
+
+def _decode(job: Dict[str, Any]) -> Dict[str, Any]:
+    out = dict(job)
+    for col, key in (("progress_json", "progress"), ("result_json", "result")):
+        try:
+            out[key] = json.loads(out.pop(col) or "{}")
+        except Exception:
+            out[key] = {}
+    return out
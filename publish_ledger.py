@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import uuid
+import socket
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from db import acquire_publish_checkpoint, update_publish_checkpoint
+from graph_client import FacebookAPIError, list_recent_page_posts
+from metrics import inc
+
+# A Graph create (feed post, photo, video) that times out may still have gone
+# through. Every publish of a post's media to one Page is an operation with a
+# stable key (post, Page, media); its checkpoints live in publish_checkpoints
+# so a retry, or another worker, resumes it instead of publishing again.
+
+# How long a worker owns an operation before another one may take it over.
+# The owner renews it every LEASE_SECONDS / 3 while it publishes, so uploads
+# longer than the lease (up to timeouts.MAX_READ_SECONDS) keep it; a worker
+# that died loses it after at most LEASE_SECONDS.
+LEASE_SECONDS = int(os.getenv("PUBLISH_LEASE_SECONDS", "300"))
+# Unpublished photos staged by an earlier attempt are attached instead of
+# re-uploaded while younger than this.
+STAGED_MEDIA_MAX_AGE_SECONDS = 6 * 3600
+# The feed is searched from this long before the pending create was sent
+# (clock skew between us and Graph).
+RECONCILE_SLACK_SECONDS = 120
+
+_OWNER_PREFIX = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class PublishInProgressError(RuntimeError):
+    """Another worker holds the lease on the same post/Page operation."""
+
+
+def operation_key(post_id: int, page_id: str, media_rows: List[Dict[str, Any]]) -> str:
+    """Idempotency key of publishing `media_rows` of a post to one Page.
+
+    Only what the post says to publish goes in: columns filled in later
+    (content_hash by the prefetch, fb_media_id, ...) must not give a retry a
+    new key, or it would skip the reconciliation of the earlier attempt.
+    """
+    h = hashlib.sha256(f"{post_id}:{page_id}".encode("utf-8"))
+    for media in sorted({f"{m['kind']}:{m['source']}" for m in media_rows}):
+        h.update(f"|{media}".encode("utf-8"))
+    return f"{post_id}:{page_id}:{h.hexdigest()[:16]}"
+
+
+def _same_message(a: str, b: str) -> bool:
+    # Graph normalises line endings and trailing whitespace.
+    return " ".join(a.split()) == " ".join(b.split())
+
+
+class PublishOperation:
+    """Checkpointed Graph writes for one post on one Page (see publish_checkpoints)."""
+
+    def __init__(self, db_path: str, post_id: int, page_id: str, page_access_token: str) -> None:
+        self.db_path = db_path
+        self.post_id = post_id
+        self.page_id = page_id
+        self.page_access_token = page_access_token
+        self.owner = f"{_OWNER_PREFIX}:{uuid.uuid4().hex[:8]}"
+        self.key = ""
+        self.row: Dict[str, Any] = {}
+        self._stop_renewing = threading.Event()
+        self._renewer: Optional[threading.Thread] = None
+
+    def acquire(self, media_rows: List[Dict[str, Any]]) -> None:
+        """Take the operation's lease; raises if another worker is publishing the same thing."""
+        self.key = operation_key(self.post_id, self.page_id, media_rows)
+        row = acquire_publish_checkpoint(self.db_path, self.key, self.post_id, self.page_id, self.owner, LEASE_SECONDS)
+        if row is None:
+            raise PublishInProgressError(f"Post {self.post_id} is already being published to page {self.page_id}")
+        if row["stage"] == "DONE":
+            # A finished operation: publishing the same content again is a new one.
+            row.update({"stage": "", "media_ids_json": "[]", "staged_at": 0, "results_json": "[]", "pending_index": -1})
+            self._save({k: row[k] for k in ("stage", "media_ids_json", "staged_at", "results_json", "pending_index")})
+        self.row = row
+        self._renewer = threading.Thread(target=self._renew, name="publish-lease", daemon=True)
+        self._renewer.start()
+
+    def _renew(self) -> None:
+        """Extend the lease until finish()/release(); stops if another worker took it over."""
+        while not self._stop_renewing.wait(LEASE_SECONDS / 3):
+            try:
+                lease = {"lease_until": time.time() + LEASE_SECONDS}
+                if not update_publish_checkpoint(self.db_path, self.key, self.owner, lease):
+                    logging.warning("Publish lease %s was taken over", self.key)
+                    return
+            except Exception:
+                logging.exception("Could not renew publish lease %s", self.key)
+
+    def _stop_renewal(self) -> None:
+        self._stop_renewing.set()
+        if self._renewer is not None and self._renewer is not threading.current_thread():
+            self._renewer.join()
+
+    def _save(self, updates: Dict[str, Any]) -> None:
+        if not update_publish_checkpoint(self.db_path, self.key, self.owner, updates):
+            raise RuntimeError(f"Lost the publish lease for post {self.post_id} on page {self.page_id}")
+        self.row.update(updates)
+
+    # --- media staging ---
+
+    def staged_media_ids(self, count: int) -> List[str]:
+        """Photo ids staged by an earlier attempt, if all `count` are there and still fresh."""
+        ids = json.loads(self.row.get("media_ids_json") or "[]")
+        if len(ids) == count and time.time() - float(self.row.get("staged_at") or 0) < STAGED_MEDIA_MAX_AGE_SECONDS:
+            return ids
+        return []
+
+    def media_staged(self, media_ids: List[str]) -> None:
+        self._save({"stage": "MEDIA_STAGED", "media_ids_json": json.dumps(media_ids), "staged_at": time.time()})
+
+    # --- creates ---
+
+    def create(self, index: int, message: str, video: bool, call: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """Run the `index`-th create of this operation at most once.
+
+        A create that already went through returns its recorded response. One
+        whose outcome is unknown is looked up on the Page first and only sent
+        again if it is not there.
+        """
+        results: List[Dict[str, Any]] = json.loads(self.row.get("results_json") or "[]")
+        if index < len(results):
+            return results[index]
+        if int(self.row.get("pending_index", -1)) == index:
+            found = self._reconcile()
+            if found is not None:
+                self._save({"results_json": json.dumps(results + [found]), "pending_index": -1})
+                return found
+
+        self._save({
+            "stage": "CREATING",
+            "pending_index": index,
+            "pending_message": message,
+            "pending_kind": "video" if video else "feed",
+            "pending_since": time.time(),
+        })
+        try:
+            resp = call()
+        except FacebookAPIError as e:
+            if e.status_code < 500:
+                # Rejected, so nothing was created. Staged photos may be the
+                # reason (expired), so the next attempt uploads them again.
+                self._save({"pending_index": -1, "media_ids_json": "[]", "staged_at": 0})
+            raise
+        self._save({"results_json": json.dumps(results + [resp]), "pending_index": -1})
+        return resp
+
+    def _reconcile(self) -> Optional[Dict[str, Any]]:
+        since = float(self.row.get("pending_since") or 0) - RECONCILE_SLACK_SECONDS
+        message = str(self.row.get("pending_message") or "")
+        video = self.row.get("pending_kind") == "video"
+        try:
+            recent = list_recent_page_posts(self.page_id, self.page_access_token, since, videos=video)
+        except FacebookAPIError as e:
+            if e.status_code >= 500:
+                raise self._unchecked(e) from e
+            # The token cannot read the feed (e.g. no pages_read_engagement):
+            # there is nothing to check against, so publish as before.
+            inc("adg_publish_reconcile_total", result="unavailable")
+            logging.warning("post %s: cannot read page %s to reconcile (%s)", self.post_id, self.page_id, e)
+            return None
+        except Exception as e:
+            raise self._unchecked(e) from e
+        for p in recent:
+            if p["id"] and _same_message(p["message"], message):
+                inc("adg_publish_reconcile_total", result="found")
+                logging.info("post %s: page %s already has %s from an earlier attempt", self.post_id, self.page_id, p["id"])
+                return {"id": p["id"], "post_id": p["id"], "reconciled": True}
+        inc("adg_publish_reconcile_total", result="not_found")
+        return None
+
+    def _unchecked(self, err: Exception) -> RuntimeError:
+        # Without the lookup a duplicate cannot be ruled out: do not send again yet.
+        inc("adg_publish_reconcile_total", result="error")
+        return RuntimeError(f"Could not check page {self.page_id} for an earlier post: {err}")
+
+    # --- end ---
+
+    def finish(self) -> None:
+        """Mark the operation complete and release the lease (after the outcome is stored)."""
+        self._stop_renewal()
+        updates = {"stage": "DONE", "pending_index": -1, "lease_until": 0}
+        if update_publish_checkpoint(self.db_path, self.key, self.owner, updates):
+            self.row.update(updates)
+        else:
+            logging.warning("Publish lease %s was taken over before it finished", self.key)
+
+    def release(self) -> None:
+        """Give up the lease, keeping the checkpoints for the next attempt."""
+        self._stop_renewal()
+        if self.key and self.row.get("stage") != "DONE":
+            try:
+                update_publish_checkpoint(self.db_path, self.key, self.owner, {"lease_until": 0})
+            except Exception:
+                logging.exception("Could not release publish lease %s", self.key)
@@ -1,28 +1,282 @@
 import os
+import time
+import signal
 import logging
-from apscheduler.schedulers.blocking import BlockingScheduler
+import threading
+import datetime as dt
+from typing import Any, Callable, Dict, Set
+
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
+from apscheduler.executors.pool import ProcessPoolExecutor, ThreadPoolExecutor
+from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
-from worker import post_next_approved
+
+from attempt_log import attempt_logger
+from db import (
+    get_post,
+    list_due_posts,
+    list_posts_pending_prefetch,
+    list_posts_with_due_targets,
+    list_publish_jobs,
+    list_uncaptioned_drafts,
+)
+from http_client import session
+from llm_client import llm_client, llm_providers
+from metrics import span
+from prefetch import prefetch_post_media
+from publish_jobs import run_queued_job
+from worker import (
+    CAPTION_VARIANTS,
+    AppConfig,
+    generate_preview,
+    load_config,
+    pin_config,
+    publish_approved_post,
+    warm_page_token_cache,
+)
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+# One "Running job ... executed" pair per scan every few seconds is noise.
+logging.getLogger("apscheduler.executors").setLevel(logging.WARNING)
 
-def job():
-    try:
-        result = post_next_approved()
-        logging.info("job: %s", result.get("status"))
-        if result.get("post_url"):
-            logging.info("posted: %s", result["post_url"])
-    except Exception as e:
-        logging.exception("Job failed: %s", e)
+# Publishing, caption generation and prefetching run on the "work" executor:
+# "thread" (default) or "process" (one warm worker process per slot). The
+# scans that find work run on a small thread pool in the daemon itself.
+# Draining stops new work in _submit. With "thread", work items still queued
+# on the executor are skipped too; with "process" the drain flag only exists
+# in the daemon, so items already handed to the pool run to completion.
+SCHEDULER_EXECUTOR = os.getenv("SCHEDULER_EXECUTOR", "thread").strip().lower()
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "4"))
+# Scan intervals in seconds; 0 disables the job.
+DUE_POLL_SECONDS = int(os.getenv("SCHEDULER_DUE_POLL_SECONDS", "30"))
+PREGENERATE_SECONDS = int(os.getenv("SCHEDULER_PREGENERATE_SECONDS", "300"))
+PREFETCH_SECONDS = int(os.getenv("SCHEDULER_PREFETCH_SECONDS", "120"))
+# Publish jobs queued from the UI/API of any host, claimed one at a time.
+JOB_POLL_SECONDS = int(os.getenv("SCHEDULER_JOB_POLL_SECONDS", "10"))
+SCAN_BATCH = 10
+# A post whose generation/prefetch failed is not retried before this.
+RETRY_BACKOFF_SECONDS = 900
+# Runs late by more than this (e.g. the daemon was down) are skipped, and a
+# backlog of missed runs collapses into one (coalesce). The daily publish gets
+# a wider window so a restart shortly after SCHEDULE_HOUR still publishes.
+MISFIRE_GRACE_SECONDS = int(os.getenv("SCHEDULER_MISFIRE_GRACE_SECONDS", "60"))
+DAILY_MISFIRE_GRACE_SECONDS = 3600
+# On SIGTERM/SIGINT, in-flight uploads get this long to finish.
+DRAIN_TIMEOUT_SECONDS = float(os.getenv("SCHEDULER_DRAIN_TIMEOUT", "600"))
+
+_sched: Any = None
+_draining = threading.Event()
+_state_lock = threading.Lock()
+_inflight: Set[str] = set()
+_backoff: Dict[str, float] = {}
+
+
+def warm() -> AppConfig:
+    """Load config once, and prepare the DB schema, Page token cache and HTTP/LLM clients."""
+    pin_config(None)
+    cfg = load_config()
+    pin_config(cfg)
+    session()
+    for p in llm_providers(cfg):
+        llm_client(p.api_key, p.base_url)
+    tokens = [t for t in [cfg.fb_page_access_token, *cfg.fb_page_access_tokens] if t]
+    if tokens:
+        for r in warm_page_token_cache(cfg.db_path, tokens, cfg.fb_app_token):
+            logging.info("token %s: %s", r["token_fp"][:8], "ok" if r["ok"] else r.get("error"))
+    return cfg
+
+
+# --- work items (run on the "work" executor) ---
+
+def publish_post(post_id: int) -> None:
+    if _draining.is_set():
+        logging.info("draining: not starting publish of post %s", post_id)
+        return
+    cfg = load_config()
+    post = get_post(cfg.db_path, post_id)
+    if not post or post.get("status") != "APPROVED":
+        return
+    if list_publish_jobs(cfg.db_path, post_id=post_id, active_only=True, limit=1):
+        return  # already being published from the UI/API
+    t0 = time.perf_counter()
+    # Fan-out posts publish the targets that are due; the rest wait for their own schedule.
+    with span("scheduler.publish"):
+        result = publish_approved_post(post_id, only_due=True)
+    if result.get("status") == "multi_posted":
+        logging.info(
+            "published post %s to %d page(s) in %.2fs (%d not posted yet)",
+            post_id, result["posted"], time.perf_counter() - t0, result["pending"],
+        )
+        if result["failed"] or result["skipped"]:
+            # Failed or token-less targets: back off instead of retrying every scan.
+            raise RuntimeError(f"{result['failed'] + result['skipped']} page(s) not posted for post {post_id}")
+        return
+    logging.info("published post %s in %.2fs: %s", post_id, time.perf_counter() - t0, result.get("post_url", ""))
+
+
+def publish_queued_job(job_id: int) -> None:
+    if _draining.is_set():
+        return
+    with span("scheduler.publish_job"):
+        ran = run_queued_job(load_config().db_path, job_id)
+    if ran:
+        logging.info("ran publish job %s", job_id)
+
+
+def generate_caption(post_id: int) -> None:
+    if _draining.is_set():
+        return
+    with span("scheduler.generate"):
+        generate_preview(post_id, variants=CAPTION_VARIANTS)
+    logging.info("caption generated for draft %s", post_id)
+
+
+def prefetch_media(post_id: int) -> None:
+    if _draining.is_set():
+        return
+    with span("scheduler.prefetch"):
+        prefetch_post_media(load_config().db_path, post_id)
+
+
+# --- scans (run in the daemon, hand work to the "work" executor) ---
+
+def _submit(kind: str, fn: Callable[[int], None], post_id: int) -> None:
+    if _draining.is_set():
+        return
+    job_id = f"{kind}-{post_id}"
+    with _state_lock:
+        if job_id in _inflight or _backoff.get(job_id, 0) > time.monotonic():
+            return
+        _inflight.add(job_id)
+    _sched.add_job(fn, args=[post_id], id=job_id, executor="work", misfire_grace_time=None)
+
+
+def _on_job_event(event: Any) -> None:
+    with _state_lock:
+        if event.job_id not in _inflight:
+            return
+        _inflight.discard(event.job_id)
+        if event.code == EVENT_JOB_ERROR:
+            _backoff[event.job_id] = time.monotonic() + RETRY_BACKOFF_SECONDS
+    if event.code == EVENT_JOB_ERROR:
+        logging.error("%s failed: %s", event.job_id, event.exception)
+
+
+def dispatch_due() -> None:
+    """Publish APPROVED posts whose scheduled_at (or a post target's) has passed."""
+    db_path = load_config().db_path
+    for p in list_due_posts(db_path, limit=SCAN_BATCH):
+        _submit("publish", publish_post, int(p["id"]))
+    for post_id in list_posts_with_due_targets(db_path, limit=SCAN_BATCH):
+        _submit("publish", publish_post, post_id)
+
+
+def dispatch_publish_jobs() -> None:
+    """Run unassigned publish jobs (queued without request tokens) that no other publisher has taken."""
+    for job in list_publish_jobs(load_config().db_path, active_only=True, limit=SCAN_BATCH):
+        if job["status"] == "QUEUED" and not job["owner"]:
+            _submit("publish-job", publish_queued_job, int(job["id"]))
+
+
+def dispatch_daily() -> None:
+    """The original daily slot: publish the next APPROVED post (scheduled or not)."""
+    due = list_due_posts(load_config().db_path, limit=1, include_unscheduled=True)
+    if due:
+        _submit("publish", publish_post, int(due[0]["id"]))
+
+
+def dispatch_pregenerate() -> None:
+    """Generate captions for new DRAFTs so they are ready for review."""
+    cfg = load_config()
+    if not llm_providers(cfg):
+        return
+    for p in list_uncaptioned_drafts(cfg.db_path, limit=SCAN_BATCH):
+        _submit("generate", generate_caption, int(p["id"]))
+
+
+def dispatch_prefetch() -> None:
+    """Validate and cache remote media of DRAFT/APPROVED posts ahead of publishing."""
+    for post_id in list_posts_pending_prefetch(load_config().db_path, limit=SCAN_BATCH):
+        _submit("prefetch", prefetch_media, post_id)
+
+
+def build_scheduler(tz: str) -> BackgroundScheduler:
+    work = (
+        ProcessPoolExecutor(SCHEDULER_WORKERS)
+        if SCHEDULER_EXECUTOR == "process"
+        else ThreadPoolExecutor(SCHEDULER_WORKERS)
+    )
+    sched = BackgroundScheduler(
+        executors={"default": ThreadPoolExecutor(4), "work": work},
+        job_defaults={"coalesce": True, "max_instances": 1, "misfire_grace_time": MISFIRE_GRACE_SECONDS},
+        timezone=tz,
+    )
+    sched.add_listener(_on_job_event, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
 
-def main():
     hour = int(os.getenv("SCHEDULE_HOUR", "8"))
     minute = int(os.getenv("SCHEDULE_MINUTE", "0"))
-    tz = os.getenv("TIMEZONE", "Asia/Bangkok")
-    sched = BlockingScheduler(timezone=tz)
-    sched.add_job(job, CronTrigger(hour=hour, minute=minute))
-    logging.info("Scheduler started (daily %02d:%02d). Ctrl+C to stop.", hour, minute)
-    sched.start()
+    sched.add_job(
+        dispatch_daily, CronTrigger(hour=hour, minute=minute), id="daily",
+        misfire_grace_time=DAILY_MISFIRE_GRACE_SECONDS,
+    )
+    for job_id, fn, every in (
+        ("due", dispatch_due, DUE_POLL_SECONDS),
+        ("publish_jobs", dispatch_publish_jobs, JOB_POLL_SECONDS),
+        ("pregenerate", dispatch_pregenerate, PREGENERATE_SECONDS),
+        ("prefetch", dispatch_prefetch, PREFETCH_SECONDS),
+    ):
+        if every > 0:
+            # First scan right away rather than one interval after start-up.
+            sched.add_job(fn, "interval", seconds=every, id=job_id, next_run_time=dt.datetime.now(dt.timezone.utc))
+    return sched
+
+
+def drain(sched: BackgroundScheduler, timeout: float = DRAIN_TIMEOUT_SECONDS) -> bool:
+    """Stop scheduling and wait up to `timeout` for running jobs. True if all finished."""
+    _draining.set()
+    with _state_lock:
+        running = sorted(_inflight)
+    logging.info("Draining %d job(s): %s", len(running), ", ".join(running) or "-")
+    t = threading.Thread(target=sched.shutdown, kwargs={"wait": True}, name="scheduler-drain", daemon=True)
+    t.start()
+    t.join(timeout)
+    attempt_logger.flush()
+    if t.is_alive():
+        with _state_lock:
+            logging.warning("Drain timed out after %.0fs; still running: %s", timeout, ", ".join(sorted(_inflight)))
+        return False
+    return True
+
+
+def main():
+    global _sched
+    stop = threading.Event()
+
+    def on_signal(signum: int, _frame: Any) -> None:
+        if stop.is_set():
+            logging.warning("Second signal: exiting without waiting")
+            os._exit(1)
+        logging.info("Received %s, shutting down", signal.Signals(signum).name)
+        stop.set()
+
+    # Installed before warming up, so a stop during start-up is also clean.
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+
+    warm()
+    if stop.is_set():
+        return
+    _sched = build_scheduler(os.getenv("TIMEZONE", "Asia/Bangkok"))
+    _sched.start()
+    logging.info(
+        "Scheduler started (daily %s:%s, %s executor x%d). Ctrl+C / SIGTERM to stop.",
+        os.getenv("SCHEDULE_HOUR", "8"), os.getenv("SCHEDULE_MINUTE", "0"), SCHEDULER_EXECUTOR, SCHEDULER_WORKERS,
+    )
+    while not stop.wait(1.0):
+        pass
+    ok = drain(_sched)
+    logging.info("Scheduler stopped%s.", "" if ok else " (some jobs were interrupted)")
+
 
 if __name__ == "__main__":
     main()
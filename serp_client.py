@@ -0,0 +1,36 @@
+import os
+from typing import List
+
+from http_client import session
+from metrics import timed
+from timeouts import api_timeout
+
+SERPAPI_URL = os.getenv("SERPAPI_URL") or "https://serpapi.com/search.json"
+
+
+@timed()
+def serpapi_keywords(serpapi_key: str, query: str, max_keywords: int = 8) -> List[str]:
+    url = SERPAPI_URL
+    params = {"engine": "google", "q": query, "hl": "vi", "gl": "vn", "api_key": serpapi_key}
+    resp = session().get(url, params=params, timeout=api_timeout(30))
+    resp.raise_for_status()
+    data = resp.json()
+
+    kws: List[str] = []
+    for item in data.get("related_searches", []) or []:
+        q = item.get("query")
+        if q and q not in kws:
+            kws.append(q)
+
+    for item in data.get("organic_results", []) or []:
+        t = item.get("title")
+        if t and t not in kws:
+            kws.append(t)
+
+    cleaned: List[str] = []
+    for k in kws:
+        k2 = str(k).strip()
+        if k2 and k2 not in cleaned:
+            cleaned.append(k2)
+
+    return cleaned[:max_keywords]
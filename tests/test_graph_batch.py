@@ -0,0 +1,80 @@
+import json
+
+import pytest
+import requests
+
+import graph_batch
+from benchmarks.fake_services import FakeServices
+from graph_batch import BatchOp, execute_batch
+
+PAGE = "page1"
+
+
+@pytest.fixture
+def svc(monkeypatch):
+    s = FakeServices().start()
+    monkeypatch.setattr(graph_batch, "GRAPH_BASE_URL", s.base_url)
+    yield s
+    s.stop()
+
+
+def _photo(i, published=False, token=None):
+    body = {"url": f"https://example.com/{i}.jpg"}
+    if not published:
+        body["published"] = "false"
+    return BatchOp("POST", f"{PAGE}/photos", body, name=f"photo{i}", access_token=token)
+
+
+def _album_ops(n=2):
+    ops = [_photo(i) for i in range(n)]
+    body = {"message": "hello"}
+    for i in range(n):
+        body[f"attached_media[{i}]"] = json.dumps({"media_fbid": f"{{result=photo{i}:$.id}}"})
+    ops.append(BatchOp("POST", f"{PAGE}/feed", body, name="feed"))
+    return ops
+
+
+def _feed_posts(svc):
+    return svc.published.get((PAGE, "feed"), [])
+
+
+def test_batch_publishes_album_in_one_request(svc):
+    results = execute_batch(_album_ops(), "tok")
+    assert all(r["ok"] for r in results)
+    assert svc.requests["graph_batch"] == 1 and svc.requests["graph"] == 0
+    assert len(_feed_posts(svc)) == 1
+
+
+@pytest.mark.parametrize("failure", ["5xx", "reset", "garbage"])
+def test_failed_batch_with_feed_create_is_not_resent(svc, failure):
+    svc.batch_failure = failure
+    with pytest.raises((requests.RequestException, RuntimeError)):
+        execute_batch(_album_ops(), "tok")
+    # Graph applied the batch; sending the ops again would post twice.
+    assert len(_feed_posts(svc)) == 1
+    assert svc.requests["graph"] == 0
+
+
+@pytest.mark.parametrize("failure", ["5xx", "reset", "garbage"])
+def test_failed_batch_of_unpublished_uploads_falls_back(svc, failure):
+    svc.batch_failure = failure
+    results = execute_batch([_photo(i) for i in range(3)], "tok")
+    assert all(r["ok"] and r.get("fallback") for r in results)
+    assert svc.requests["graph"] == 3
+
+
+def test_failed_sub_request_is_retried_alone(svc):
+    ops = [_photo(0), _photo(1, token="invalid"), _photo(2, published=True)]
+    results = execute_batch(ops, "tok")
+    assert [r["ok"] for r in results] == [True, False, True]
+    assert results[1]["status"] == 400 and results[1].get("fallback")
+    assert svc.requests["graph"] == 1
+    assert len(_feed_posts(svc)) == 1
+
+
+def test_publishes():
+    assert graph_batch._publishes(BatchOp("POST", f"{PAGE}/feed"))
+    assert graph_batch._publishes(BatchOp("POST", f"{PAGE}/videos"))
+    assert graph_batch._publishes(_photo(0, published=True))
+    assert not graph_batch._publishes(_photo(0))
+    assert not graph_batch._publishes(BatchOp("GET", f"{PAGE}/feed"))
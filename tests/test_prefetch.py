@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+from prefetch import _download
+
+MP4_HEAD = b"\x00\x00\x00\x18ftypmp42" + b"\x00" * 64
+JPEG_HEAD = b"\xff\xd8\xff\xe0" + b"\x00" * 64
+
+
+class _Body:
+    def __init__(self, data):
+        self.data = data
+
+    def iter_content(self, size):
+        for i in range(0, len(self.data), 5):
+            yield self.data[i:i + 5]
+
+
+@pytest.mark.parametrize("url, ctype, data, ext", [
+    ("https://cdn.example.com/clip.mp4?sig=1", "application/octet-stream", b"anything", ".mp4"),
+    ("https://cdn.example.com/media/123", "application/octet-stream", MP4_HEAD, ".mp4"),
+    ("https://cdn.example.com/get.php?id=1", "", JPEG_HEAD, ".jpg"),
+    ("https://cdn.example.com/media/123", "video/mp4", b"anything", ".mp4"),
+    ("https://cdn.example.com/media/123", "application/octet-stream", b"unknown", ""),
+])
+def test_download_extension(tmp_path, url, ctype, data, ext):
+    db_path = str(tmp_path / "app.db")
+    out = _download(db_path, "video_url", url, _Body(data), ctype)
+    assert os.path.splitext(out["local_file"])[1] == ext
+    assert out["size_bytes"] == len(data)
+    folder = tmp_path / "uploads" / "prefetch"
+    assert [p.name for p in folder.iterdir()] == [os.path.basename(out["local_file"])]
@@ -0,0 +1,91 @@
+import sys
+
+import pytest
+
+import graph_batch
+import graph_client
+from benchmarks.fake_services import FakeServices
+from db import create_post, get_post, init_db, list_post_targets, update_post, upsert_post_targets
+
+# The fake Graph API names the Page of a token after its last 8 characters.
+TOKENS = ["tokenAAA", "tokenBBB"]
+PAGES = ["page_tokenAAA", "page_tokenBBB"]
+POST = {"topic": "t", "main": "m", "status": "APPROVED", "image_urls": ["https://cdn.example.com/a.jpg"]}
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    svc = FakeServices().start()
+    monkeypatch.setattr(graph_batch, "GRAPH_BASE_URL", svc.base_url)
+    monkeypatch.setattr(graph_client, "GRAPH_BASE_URL", svc.base_url)
+    path = str(tmp_path / "app.db")
+    monkeypatch.setenv("DB_PATH", path)
+    monkeypatch.setenv("FB_PAGE_ACCESS_TOKEN", TOKENS[0])
+    monkeypatch.setenv("FB_PAGE_ACCESS_TOKENS", TOKENS[1])
+    monkeypatch.setenv("DEFAULT_PAGE_ID", "")
+    monkeypatch.setenv("PREFETCH_MEDIA", "0")
+    init_db(path)
+    yield path
+    svc.stop()
+
+
+def _targeted_post(db_path):
+    pid = create_post(db_path, POST)
+    update_post(db_path, pid, {"caption": "Caption"})
+    upsert_post_targets(db_path, pid, [{"page_id": p} for p in PAGES])
+    return pid
+
+
+def _assert_targets_posted(db_path, pid):
+    assert {t["page_id"]: t["status"] for t in list_post_targets(db_path, pid)} == dict.fromkeys(PAGES, "POSTED")
+    assert get_post(db_path, pid)["status"] == "POSTED"
+
+
+def test_api_publishes_targets(db_path):
+    from fastapi.testclient import TestClient
+
+    import api
+
+    pid = _targeted_post(db_path)
+    resp = TestClient(api.app).post(f"/posts/{pid}/post")
+    assert resp.status_code == 200 and resp.json()["status"] == "multi_posted"
+    _assert_targets_posted(db_path, pid)
+
+
+def test_cli_publishes_targets(db_path, monkeypatch, capsys):
+    import main
+
+    pid = _targeted_post(db_path)
+    monkeypatch.setattr(sys, "argv", ["main.py", "post", "--id", str(pid), "--no-progress"])
+    main.main()
+    assert '"multi_posted"' in capsys.readouterr().out
+    _assert_targets_posted(db_path, pid)
+
+
+def test_post_without_targets_goes_to_one_page(db_path):
+    from worker import publish_approved_post
+
+    pid = create_post(db_path, POST)
+    update_post(db_path, pid, {"caption": "Caption"})
+    assert publish_approved_post(pid)["status"] == "posted"
+    assert get_post(db_path, pid)["status"] == "POSTED" and list_post_targets(db_path, pid) == []
+
+
+def test_publish_resolves_pages_from_the_cache(db_path, monkeypatch):
+    from worker import post_to_facebook_multi
+
+    monkeypatch.setenv("FB_APP_TOKEN", "app|secret")
+    names = {graph_client.get_page_info_cached(db_path, t)["name"] for t in TOKENS}
+    graph_client.warm_page_token_cache(db_path, TOKENS, "app|secret")  # startup, via /debug_token
+    assert {graph_client.get_page_info_cached(db_path, t)["name"] for t in TOKENS} == names
+
+    def no_graph(*args, **kwargs):
+        raise AssertionError("publish asked Graph for a cached page")
+
+    monkeypatch.setattr(graph_client, "debug_page_token", no_graph)
+    monkeypatch.setattr(graph_client, "get_page_info_from_token", no_graph)
+    pid = create_post(db_path, POST)
+    update_post(db_path, pid, {"caption": "Caption"})
+    out = post_to_facebook_multi(pid, TOKENS)
+    assert out["failed"] == 0
+    _assert_targets_posted(db_path, pid)
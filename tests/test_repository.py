@@ -0,0 +1,156 @@
+import os
+import threading
+
+import pytest
+
+import db
+from db import changes_since, claim_publish_job, create_post, create_publish_job, get_change_counter, init_db
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def db_path(request, tmp_path):
+    if request.param == "sqlite":
+        path = str(tmp_path / "app.db")
+    else:
+        path = os.getenv("PG_TEST_URL", "")
+        if not path:
+            pytest.skip("PG_TEST_URL is not set")
+    init_db(path)
+    return path
+
+
+def _run(n, target):
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def _read_all(db_path, since, limit=500):
+    seqs = []
+    while True:
+        res = changes_since(db_path, since, limit)
+        assert not res["reset"]
+        seqs += [c["seq"] for c in res["changes"]]
+        since = res["last_seq"]
+        if not res["more"]:
+            return seqs, since
+
+
+def test_init_db_runs_once(db_path):
+    init_db(db_path)
+    assert db_path in db._initialized
+    if db.repository(db_path).dialect == "postgres":
+        conn = db.connect(db_path)
+        try:
+            assert db._postgres_schema_version(conn) == db.POSTGRES_SCHEMA_VERSION
+        finally:
+            conn.close()
+
+
+def test_due_posts_index_exists(db_path):
+    if db.repository(db_path).dialect == "postgres":
+        sql = "SELECT indexname FROM pg_indexes WHERE indexname = 'idx_posts_due'"
+    else:
+        sql = "SELECT name FROM sqlite_master WHERE type = 'index' AND name = 'idx_posts_due'"
+    conn = db.connect(db_path)
+    try:
+        assert conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+def test_concurrent_claims_take_each_job_once(db_path):
+    pid = create_post(db_path, {"topic": "t", "main": "m"})
+    jobs = [create_publish_job(db_path, pid, 1, "") for _ in range(40)]
+    claimed = []
+    lock = threading.Lock()
+
+    def claim(n):
+        while True:
+            job = claim_publish_job(db_path, f"worker-{n}")
+            if job is None:
+                return
+            assert job["owner"] == f"worker-{n}" and job["status"] == "RUNNING"
+            with lock:
+                claimed.append(job["id"])
+
+    _run(8, claim)
+    assert len(claimed) == len(set(claimed))
+    assert set(jobs) <= set(claimed)
+    assert claim_publish_job(db_path, "late") is None
+
+
+def test_claim_by_id(db_path):
+    pid = create_post(db_path, {"topic": "t", "main": "m"})
+    first, second = create_publish_job(db_path, pid, 1, ""), create_publish_job(db_path, pid, 1, "")
+    assert claim_publish_job(db_path, "me", job_id=second)["id"] == second
+    assert claim_publish_job(db_path, "other", job_id=second) is None
+    assert claim_publish_job(db_path, "me", job_id=first)["id"] == first
+
+
+def test_changes_since_pages_in_seq_order(db_path):
+    start = get_change_counter(db_path)
+    pids = [create_post(db_path, {"topic": f"t{i}", "main": "m", "image_urls": [f"https://x/{i}.jpg"]}) for i in range(5)]
+    res = changes_since(db_path, start, limit=3)
+    assert len(res["changes"]) == 3 and res["more"] and not res["reset"]
+    assert res["last_seq"] == res["changes"][-1]["seq"]
+    seqs, last = _read_all(db_path, start, limit=3)
+    assert seqs == sorted(set(seqs)) and seqs[0] > start
+    assert last == get_change_counter(db_path)
+    assert set(pids) <= set(changes_since(db_path, start, limit=len(seqs))["post_ids"])
+    caught_up = changes_since(db_path, last)
+    assert caught_up["changes"] == [] and not caught_up["more"] and caught_up["last_seq"] == last
+
+
+def test_changes_since_resets_when_ahead(db_path):
+    res = changes_since(db_path, get_change_counter(db_path) + 1000)
+    assert res["reset"] and res["last_seq"] == get_change_counter(db_path)
+
+
+def test_polling_consumer_sees_every_change(db_path):
+    start = get_change_counter(db_path)
+    done = threading.Event()
+    seen = []
+
+    def consume():
+        since = start
+        while True:
+            finished = done.is_set()
+            res = changes_since(db_path, since, 50)
+            assert not res["reset"]
+            seen.extend(c["seq"] for c in res["changes"])
+            since = res["last_seq"]
+            if finished and not res["more"]:
+                return
+
+    reader = threading.Thread(target=consume)
+    reader.start()
+    _run(6, lambda n: [create_post(db_path, {"topic": f"c{n}-{i}", "main": "m"}) for i in range(15)])
+    done.set()
+    reader.join()
+    everything, _ = _read_all(db_path, start)
+    assert seen == everything
+
+
+def test_open_transaction_does_not_block_or_lose_changes(db_path):
+    if db.repository(db_path).dialect != "postgres":
+        pytest.skip("SQLite writes go through one writer")
+    a = create_post(db_path, {"topic": "a", "main": "m"})
+    b = create_post(db_path, {"topic": "b", "main": "m"})
+    start = get_change_counter(db_path)
+    conn = db.connect(db_path)
+    try:
+        conn.execute("UPDATE posts SET caption = 'slow' WHERE id = ?", (a,))
+        other = threading.Thread(target=db.update_post, args=(db_path, b, {"caption": "fast"}))
+        other.start()
+        other.join(timeout=10)
+        assert not other.is_alive()
+        res = changes_since(db_path, start)
+        assert res["post_ids"] == [b]
+        conn.commit()
+    finally:
+        conn.close()
+    # The change committed last gets the higher seq, so resuming after b's still sees a's.
+    assert changes_since(db_path, res["last_seq"])["post_ids"] == [a]
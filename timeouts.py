@@ -0,0 +1,83 @@
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from db import get_bandwidth_estimate, put_bandwidth_estimate
+
+# requests/urllib3 take timeout=(connect, read). urllib3 keeps the *connect*
+# timeout on the socket while the request body is being written, and each
+# write is at most one upload_progress chunk, so the first value is also the
+# upload stall limit: the upload fails only when no bytes move for that long,
+# however big the file is. The read timeout starts once the body is sent and
+# covers Graph processing the upload before it answers.
+CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+UPLOAD_STALL_SECONDS = float(os.getenv("UPLOAD_STALL_TIMEOUT", "30"))
+
+# Read budget for an upload: RESPONSE_BASE_SECONDS plus SAFETY_FACTOR times
+# the time the payload takes at the estimated bandwidth, clamped.
+RESPONSE_BASE_SECONDS = 30.0
+SAFETY_FACTOR = 3.0
+MAX_READ_SECONDS = 3600.0
+
+# Bandwidth estimate (bytes/s per upload connection): an EWMA of observed
+# uploads, persisted in the DB so a restart does not forget it.
+DEFAULT_UPLOAD_BPS = 512 * 1024
+MIN_UPLOAD_BPS = 32 * 1024
+EWMA_ALPHA = 0.3
+# Small uploads are dominated by latency, not bandwidth: don't learn from them.
+MIN_SAMPLE_BYTES = 256 * 1024
+
+BANDWIDTH_KEY = "graph_upload"
+
+_estimates: Dict[str, float] = {}
+_lock = threading.Lock()
+
+
+def api_timeout(read: float) -> Tuple[float, float]:
+    """(connect, read) for a plain Graph/API call without a file body."""
+    return (CONNECT_TIMEOUT_SECONDS, read)
+
+
+def _observed(db_path: Optional[str]) -> Optional[float]:
+    key = db_path or ""
+    with _lock:
+        if key in _estimates:
+            return _estimates[key]
+    bps = None
+    if db_path:
+        row = get_bandwidth_estimate(db_path, BANDWIDTH_KEY)
+        if row and float(row["bytes_per_sec"] or 0) > 0:
+            bps = float(row["bytes_per_sec"])
+    if bps is not None:
+        with _lock:
+            _estimates.setdefault(key, bps)
+    return bps
+
+
+def upload_bandwidth(db_path: Optional[str] = None) -> float:
+    """Current upload bandwidth estimate in bytes/s (DEFAULT_UPLOAD_BPS until observed)."""
+    bps = _observed(db_path)
+    return max(MIN_UPLOAD_BPS, bps if bps is not None else DEFAULT_UPLOAD_BPS)
+
+
+def record_upload(db_path: Optional[str], nbytes: int, seconds: float) -> None:
+    """Fold one finished upload into the bandwidth estimate."""
+    if nbytes < MIN_SAMPLE_BYTES or seconds <= 0:
+        return
+    sample = nbytes / seconds
+    prev = _observed(db_path)
+    bps = sample if prev is None else prev + EWMA_ALPHA * (sample - prev)
+    with _lock:
+        _estimates[db_path or ""] = bps
+    if db_path:
+        put_bandwidth_estimate(db_path, BANDWIDTH_KEY, bps)
+
+
+def upload_timeout(nbytes: int, db_path: Optional[str] = None) -> Tuple[float, float]:
+    """(stall, read) for uploading `nbytes`; the read budget is sized from the bandwidth estimate.
+
+    The stall limit also bounds connecting, since urllib3 uses one value for both.
+    """
+    expected = nbytes / upload_bandwidth(db_path)
+    read = min(MAX_READ_SECONDS, RESPONSE_BASE_SECONDS + SAFETY_FACTOR * expected)
+    return (UPLOAD_STALL_SECONDS, read)
@@ -0,0 +1,127 @@
+import os
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+# on_progress(bytes_sent, bytes_total, bytes_per_sec)
+UploadCallback = Callable[[int, int, float], None]
+
+# Callbacks fire at most this often (plus once at the end of the body).
+REPORT_INTERVAL_SECONDS = 0.25
+# Throughput is measured over this trailing window ("instantaneous" rate).
+RATE_WINDOW_SECONDS = 2.0
+# Default read size. urllib3 asks for its own (smaller) blocksize and gets
+# exactly that: every socket write must finish within the stall timeout (see
+# timeouts.py), so chunks stay small enough for slow links.
+CHUNK_SIZE = 64 * 1024
+
+
+class ThroughputMeter:
+    """Bytes/s over a short trailing window."""
+
+    def __init__(self, window: float = RATE_WINDOW_SECONDS) -> None:
+        self.window = window
+        self.t0 = time.monotonic()
+        self._samples: Deque[Tuple[float, int]] = deque([(self.t0, 0)])
+
+    def add(self, total_sent: int) -> float:
+        now = time.monotonic()
+        self._samples.append((now, total_sent))
+        while len(self._samples) > 2 and now - self._samples[0][0] > self.window:
+            self._samples.popleft()
+        t_first, b_first = self._samples[0]
+        dt = now - t_first
+        return (total_sent - b_first) / dt if dt > 0 else 0.0
+
+
+class MultipartFileBody:
+    """Streaming multipart/form-data body with one file part.
+
+    requests sends any object with read() and a known length chunk by chunk
+    (with a Content-Length header), so the file is never loaded into memory
+    and every chunk handed to the socket is reported to `on_progress`.
+    """
+
+    def __init__(
+        self,
+        fields: Dict[str, Any],
+        file_field: str,
+        file_path: str,
+        on_progress: Optional[UploadCallback] = None,
+    ) -> None:
+        self.boundary = uuid.uuid4().hex
+        self.file_path = file_path
+        self.on_progress = on_progress
+        parts = []
+        for k, v in fields.items():
+            parts.append(
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode("utf-8")
+            )
+        filename = os.path.basename(file_path).replace('"', "")
+        parts.append(
+            (
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+                "Content-Type: application/octet-stream\r\n\r\n"
+            ).encode("utf-8")
+        )
+        self._head = b"".join(parts)
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+        self.file_size = os.path.getsize(file_path)
+        self.total = len(self._head) + self.file_size + len(self._tail)
+        self.sent = 0
+        self.meter = ThroughputMeter()
+        self.started_at = 0.0  # monotonic time of the first read
+        self._f = None
+        self._stage = 0  # 0 = head, 1 = file, 2 = tail, 3 = done
+        self._last_report = 0.0
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return self.total
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size <= 0:
+            size = CHUNK_SIZE
+        if not self.started_at:
+            self.started_at = time.monotonic()
+        out = b""
+        while len(out) < size and self._stage < 3:
+            if self._stage == 0:
+                out += self._head
+                self._stage = 1
+                self._f = open(self.file_path, "rb")
+            elif self._stage == 1:
+                chunk = self._f.read(size - len(out))
+                if chunk:
+                    out += chunk
+                else:
+                    self._f.close()
+                    self._stage = 2
+            else:
+                out += self._tail
+                self._stage = 3
+        if out:
+            self.sent += len(out)
+            self._report(final=self._stage == 3)
+        return out
+
+    def _report(self, final: bool) -> None:
+        rate = self.meter.add(self.sent)
+        if self.on_progress is None:
+            return
+        now = time.monotonic()
+        if not final and now - self._last_report < REPORT_INTERVAL_SECONDS:
+            return
+        self._last_report = now
+        try:
+            self.on_progress(self.sent, self.total, rate)
+        except Exception:
+            pass  # a broken progress consumer must not abort the upload
+
+    def close(self) -> None:
+        if self._f is not None and not self._f.closed:
+            self._f.close()
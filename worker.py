@@ -1,15 +1,62 @@
 \
 import os
 import json
+import time
+import threading
 import datetime as dt
-from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
-
-import requests
-from dotenv import load_dotenv
-from openai import OpenAI
-
-from db import init_db, get_post, list_posts, update_post, set_status
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from attempt_log import record_attempt
+from db import (
+    now_iso,
+    utc_now_iso,
+    init_db,
+    insert_llm_usage,
+    save_caption_variants,
+    get_post,
+    list_post_media,
+    list_due_posts,
+    update_post,
+    update_post_media,
+    claim_post_target,
+    list_post_targets,
+    update_post_target,
+    upsert_post_targets,
+)
+from image_optimizer import optimize_images
+from metrics import timed
+from prefetch import prefetched_path
+from publish_ledger import PublishInProgressError, PublishOperation
+from repository import data_dir
+from upload_progress import UploadCallback
+
+# The Graph, LLM and SerpAPI clients live in their own modules and import
+# requests/openai on first use; they are re-exported here for existing callers.
+from graph_client import (
+    PAGE_CACHE_NEGATIVE_TTL_SECONDS,
+    PAGE_CACHE_TTL_SECONDS,
+    FacebookAPIError,
+    create_feed_post_with_attached_media,
+    debug_page_token,
+    get_page_info_cached,
+    get_page_info_from_token,
+    post_photo_by_file,
+    post_photo_by_url,
+    post_video_by_file,
+    post_video_by_url,
+    publish_photos_by_url_batch,
+    token_fingerprint,
+    upload_photo_unpublished_by_file,
+    upload_photo_unpublished_by_url,
+    warm_page_token_cache,
+)
+from llm_client import DEFAULT_PROMPT_TEMPLATE, generate_ai_json
+from llm_router import LLMProvider, providers_from_env
+from serp_client import SERPAPI_URL, serpapi_keywords
 
 
 @dataclass
@@ -23,320 +70,140 @@ class AppConfig:
 
     fb_page_access_token: str
     default_page_id: str
+    fb_app_token: Optional[str]
 
     timezone: str
     db_path: str
 
     prompt_template: Optional[str]
 
+    optimize_images: bool
+
+    # Extra Page tokens (FB_PAGE_ACCESS_TOKENS, comma-separated) for publishing
+    # post_targets without a UI session, e.g. from the scheduler.
+    fb_page_access_tokens: List[str] = field(default_factory=list)
+
+    # OpenAI-compatible endpoints in order of preference (LLM_PROVIDERS, see
+    # llm_router); defaults to the single OPENAI_* endpoint.
+    llm_providers: List[LLMProvider] = field(default_factory=list)
 
-DEFAULT_PROMPT_TEMPLATE = """\
-Bạn là 1 Content Creator của công ty ADG, chuyên về các sản phẩm thiết bị trong nhà (cửa cuốn, bếp, cửa sổ, solar...).
-Bạn viết nội dung để đăng tải lên 1 trang Facebook Fanpage.
 
-Hãy viết cho tôi 1 Status Facebook chia sẻ về chủ đề: {topic}
-Bao gồm các nội dung chính sau:
-{main}
+# Set by pin_config(): long-running processes (the scheduler daemon) load the
+# config once instead of re-reading .env and re-running init_db on every call.
+_pinned_config: Optional[AppConfig] = None
 
-Yêu cầu bắt buộc:
-- Trả kết quả bằng tiếng Việt.
-- Xuống dòng ở tiêu đề.
-- Status là văn bản thuần, không dùng in đậm/in nghiêng/ký hiệu * hoặc **.
-- Nếu có danh sách ý chính, hãy dùng emoji ở ĐẦU dòng để làm nổi bật (ví dụ: ♥️, 🍀, 🏵️, ⭐), không chèn emoji ở cuối câu.
-- Giữ nội dung ngắn gọn, thu hút, dễ đọc, câu không quá dài.
-- Đảm bảo đúng chính tả, ngữ pháp tiếng Việt.
-- Luôn kèm 5 hashtag phù hợp và phổ biến.
-- Tham khảo gợi ý từ khóa SEO (nếu có): {seo_keywords}
 
-Đoạn “Nội dung bắt buộc” (nếu có) sẽ được nối ở cuối bài, không chỉnh sửa nội dung đó.
-"""
+def pin_config(cfg: Optional[AppConfig]) -> None:
+    """Make load_config() return `cfg` (None = reload on every call again)."""
+    global _pinned_config
+    _pinned_config = cfg
 
 
 def load_config() -> AppConfig:
+    if _pinned_config is not None:
+        return _pinned_config
+    from dotenv import load_dotenv
+
     dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
     load_dotenv(dotenv_path=dotenv_path, override=True)
 
     def opt(key: str) -> str:
         return (os.getenv(key) or "").strip()
 
+    openai_api_key = opt("OPENAI_API_KEY")
+    openai_model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    openai_base_url = os.getenv("OPENAI_BASE_URL") or None
     cfg = AppConfig(
-        openai_api_key=opt("OPENAI_API_KEY"),
-        openai_model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+        openai_api_key=openai_api_key,
+        openai_model=openai_model,
         openai_temperature=float(os.getenv("OPENAI_TEMPERATURE", "0.7")),
-        openai_base_url=os.getenv("OPENAI_BASE_URL") or None,
+        openai_base_url=openai_base_url,
         serpapi_key=os.getenv("SERPAPI_KEY") or None,
         fb_page_access_token=(os.getenv("FB_PAGE_ACCESS_TOKEN") or "").strip(),
         default_page_id=os.getenv("DEFAULT_PAGE_ID", "").strip(),
+        fb_app_token=(os.getenv("FB_APP_TOKEN") or "").strip() or None,
         timezone=os.getenv("TIMEZONE", "Asia/Bangkok"),
         db_path=os.getenv("DB_PATH", "./data/app.db"),
         prompt_template=os.getenv("PROMPT_TEMPLATE") or None,
+        optimize_images=os.getenv("IMAGE_OPTIMIZE", "0").strip().lower() in ("1", "true", "yes"),
+        fb_page_access_tokens=[t.strip() for t in opt("FB_PAGE_ACCESS_TOKENS").split(",") if t.strip()],
+        llm_providers=providers_from_env(LLMProvider("default", openai_base_url, openai_api_key, openai_model)),
     )
 
     init_db(cfg.db_path)
     return cfg
 
 
-def serpapi_keywords(serpapi_key: str, query: str, max_keywords: int = 8) -> List[str]:
-    url = "https://serpapi.com/search.json"
-    params = {"engine": "google", "q": query, "hl": "vi", "gl": "vn", "api_key": serpapi_key}
-    resp = requests.get(url, params=params, timeout=30)
-    resp.raise_for_status()
-    data = resp.json()
-
-    kws: List[str] = []
-    for item in data.get("related_searches", []) or []:
-        q = item.get("query")
-        if q and q not in kws:
-            kws.append(q)
-
-    for item in data.get("organic_results", []) or []:
-        t = item.get("title")
-        if t and t not in kws:
-            kws.append(t)
-
-    cleaned: List[str] = []
-    for k in kws:
-        k2 = str(k).strip()
-        if k2 and k2 not in cleaned:
-            cleaned.append(k2)
-
-    return cleaned[:max_keywords]
-
-
-def _extract_json_str(s: str) -> str:
-    s = s.strip()
-    if s.startswith("{") and s.endswith("}"):
-        return s
-    a = s.find("{")
-    b = s.rfind("}")
-    if a != -1 and b != -1 and b > a:
-        return s[a:b + 1]
-    return s
-
-
-def generate_ai_json(cfg: AppConfig, topic: str, main: str, mandatory: str, seo_keywords: List[str]) -> Dict[str, str]:
-    if not cfg.openai_api_key:
-        raise RuntimeError("Missing OPENAI_API_KEY (required for text generation)")
-    if str(cfg.openai_api_key).startswith("gsk_") and ("openai.com" in (cfg.openai_base_url or "")):
-        raise RuntimeError(
-            "You are using a Groq key ('gsk_...') with OpenAI base URL. "
-            "Fix: set OPENAI_BASE_URL to https://api.groq.com/openai/v1 (or your OpenAI-compatible provider), "
-            "or use an OpenAI API key (sk-...) with https://api.openai.com/v1."
-        )
-    client = OpenAI(api_key=cfg.openai_api_key, base_url=cfg.openai_base_url)
-
-    prompt_template = cfg.prompt_template or DEFAULT_PROMPT_TEMPLATE
-    prompt = prompt_template.format(
-        topic=topic,
-        main=main,
-        mandatory=mandatory,
-        seo_keywords=", ".join(seo_keywords) if seo_keywords else "(không có)",
-    )
-
-    system = (
-        "Bạn là trợ lý viết nội dung mạng xã hội. "
-        "BẮT BUỘC trả về đúng 1 JSON object hợp lệ, không thêm văn bản nào khác. "
-        "JSON phải có đúng 2 key: title, content (đều là string)."
-    )
-
-    messages = [{"role": "system", "content": system}, {"role": "user", "content": prompt}]
-
-    last_err = None
-    for _ in range(2):
-        resp = client.chat.completions.create(
-            model=cfg.openai_model,
-            temperature=cfg.openai_temperature,
-            messages=messages,
-            response_format={"type": "json_object"},
-        )
-        txt = resp.choices[0].message.content or ""
-        try:
-            j = json.loads(_extract_json_str(txt))
-            title = str(j.get("title", "")).strip()
-            content = str(j.get("content", "")).strip()
-            if not title or not content:
-                raise ValueError("Missing title/content")
-            return {"title": title, "content": content}
-        except Exception as e:
-            last_err = e
-            messages.append({
-                "role": "user",
-                "content": 'Chỉ trả về JSON hợp lệ, không markdown, không giải thích. Schema: {"title":"...","content":"..."}'
-            })
-
-    raise RuntimeError(f"Failed to parse JSON from model. Last error: {last_err}")
-
-
 def build_caption(title: str, content: str, mandatory: str) -> str:
     mandatory = (mandatory or "").strip()
     base = f"{title}\n\n{content}".strip()
     return f"{base}\n{mandatory}" if mandatory else base
 
 
-def post_photo_by_url(page_id: str, page_access_token: str, image_url: str, message: str, graph_api_version: str = "v20.0") -> Dict[str, Any]:
-    endpoint = f"https://graph.facebook.com/{graph_api_version}/{page_id}/photos"
-    payload = {"url": image_url, "message": message, "access_token": page_access_token}
-    resp = requests.post(endpoint, data=payload, timeout=60)
-    try:
-        data = resp.json()
-    except Exception:
-        data = {"raw": resp.text}
-    if resp.status_code >= 400:
-        raise RuntimeError(f"Facebook API error {resp.status_code}: {data}")
-    return data
-
-
-def upload_photo_unpublished_by_url(
-    page_id: str,
-    page_access_token: str,
-    image_url: str,
-    graph_api_version: str = "v20.0",
-) -> Dict[str, Any]:
-    endpoint = f"https://graph.facebook.com/{graph_api_version}/{page_id}/photos"
-    payload = {
-        "url": image_url,
-        "published": "false",
-        "access_token": page_access_token,
-    }
-    resp = requests.post(endpoint, data=payload, timeout=120)
-    try:
-        data = resp.json()
-    except Exception:
-        data = {"raw": resp.text}
-    if resp.status_code >= 400:
-        raise RuntimeError(f"Facebook API error {resp.status_code}: {data}")
-    return data
-
-
-def upload_photo_unpublished_by_file(
-    page_id: str,
-    page_access_token: str,
-    file_path: str,
-    graph_api_version: str = "v20.0",
-) -> Dict[str, Any]:
-    endpoint = f"https://graph.facebook.com/{graph_api_version}/{page_id}/photos"
-    with open(file_path, "rb") as f:
-        files = {"source": f}
-        data = {
-            "published": "false",
-            "access_token": page_access_token,
-        }
-        resp = requests.post(endpoint, data=data, files=files, timeout=180)
-    try:
-        out = resp.json()
-    except Exception:
-        out = {"raw": resp.text}
-    if resp.status_code >= 400:
-        raise RuntimeError(f"Facebook API error {resp.status_code}: {out}")
-    return out
-
-
-def create_feed_post_with_attached_media(
-    page_id: str,
-    page_access_token: str,
-    message: str,
-    media_fbids: List[str],
-    graph_api_version: str = "v20.0",
-) -> Dict[str, Any]:
-    if not media_fbids:
-        raise RuntimeError("No media ids for attached_media")
-    endpoint = f"https://graph.facebook.com/{graph_api_version}/{page_id}/feed"
-    payload: Dict[str, Any] = {
-        "message": message,
-        "access_token": page_access_token,
-    }
-    for idx, mid in enumerate(media_fbids):
-        payload[f"attached_media[{idx}]"] = json.dumps({"media_fbid": mid})
-
-    resp = requests.post(endpoint, data=payload, timeout=120)
-    try:
-        out = resp.json()
-    except Exception:
-        out = {"raw": resp.text}
-    if resp.status_code >= 400:
-        raise RuntimeError(f"Facebook API error {resp.status_code}: {out}")
-    return out
-
-
-def post_photo_by_file(page_id: str, page_access_token: str, file_path: str, message: str, graph_api_version: str = "v20.0") -> Dict[str, Any]:
-    endpoint = f"https://graph.facebook.com/{graph_api_version}/{page_id}/photos"
-    with open(file_path, "rb") as f:
-        files = {"source": f}
-        data = {"message": message, "access_token": page_access_token}
-        resp = requests.post(endpoint, data=data, files=files, timeout=120)
-
-    try:
-        out = resp.json()
-    except Exception:
-        out = {"raw": resp.text}
-    if resp.status_code >= 400:
-        raise RuntimeError(f"Facebook API error {resp.status_code}: {out}")
-    return out
-
-
-def post_video_by_url(page_id: str, page_access_token: str, video_url: str, message: str, graph_api_version: str = "v20.0") -> Dict[str, Any]:
-    endpoint = f"https://graph.facebook.com/{graph_api_version}/{page_id}/videos"
-    payload = {"file_url": video_url, "description": message, "access_token": page_access_token}
-    resp = requests.post(endpoint, data=payload, timeout=300)
-    try:
-        data = resp.json()
-    except Exception:
-        data = {"raw": resp.text}
-    if resp.status_code >= 400:
-        raise RuntimeError(f"Facebook API error {resp.status_code}: {data}")
-    return data
+# Max parallel unpublished photo uploads per post (album staging).
+PUBLISH_UPLOAD_CONCURRENCY = int(os.getenv("PUBLISH_UPLOAD_CONCURRENCY", "4"))
 
+# Optional publish progress callback, called as progress(event, **fields):
+#   "stage"  stage=<name>                     a pipeline stage started
+#   "page"   page_id=..., [page_name=...]     target page resolved
+#   "media"  media_id, name, bytes_sent, bytes_total, bytes_per_sec, status (uploading|done)
+#   "done"   post_url=...                     "failed" error=... (targets only)
+ProgressFn = Callable[..., None]
 
-def post_video_by_file(page_id: str, page_access_token: str, file_path: str, message: str, graph_api_version: str = "v20.0") -> Dict[str, Any]:
-    endpoint = f"https://graph.facebook.com/{graph_api_version}/{page_id}/videos"
-    with open(file_path, "rb") as f:
-        files = {"source": f}
-        data = {"description": message, "access_token": page_access_token}
-        resp = requests.post(endpoint, data=data, files=files, timeout=300)
 
+def _report(progress: Optional[ProgressFn], event: str, **fields: Any) -> None:
+    if progress is None:
+        return
     try:
-        out = resp.json()
+        progress(event, **fields)
     except Exception:
-        out = {"raw": resp.text}
-    if resp.status_code >= 400:
-        raise RuntimeError(f"Facebook API error {resp.status_code}: {out}")
-    return out
-
+        pass  # progress reporting must never break a publish
+
+
+def _report_media(
+    progress: Optional[ProgressFn],
+    m: Dict[str, Any],
+    bytes_total: int,
+    done: bool,
+    bytes_sent: int = 0,
+    bytes_per_sec: float = 0.0,
+) -> None:
+    _report(
+        progress,
+        "media",
+        media_id=int(m["id"]),
+        name=os.path.basename(str(m["source"])),
+        bytes_sent=bytes_total if done else bytes_sent,
+        bytes_total=bytes_total,
+        bytes_per_sec=round(bytes_per_sec),
+        status="done" if done else "uploading",
+    )
 
-def get_page_info_from_token(page_access_token: str, graph_api_version: str = "v20.0") -> Dict[str, str]:
-    """Best-effort resolve Page id/name from a Page access token.
 
-    For a Page access token, /me returns the Page object.
-    """
-    token = (page_access_token or "").strip()
-    if not token:
-        raise RuntimeError("Empty page access token")
+def _upload_callback(progress: Optional[ProgressFn], m: Dict[str, Any]) -> Optional[UploadCallback]:
+    """Forward byte-level upload progress of media row `m` as "media" events."""
+    if progress is None:
+        return None
 
-    endpoint = f"https://graph.facebook.com/{graph_api_version}/me"
-    params = {"fields": "id,name", "access_token": token}
-    resp = requests.get(endpoint, params=params, timeout=30)
-    try:
-        data = resp.json()
-    except Exception:
-        data = {"raw": resp.text}
-    if resp.status_code >= 400:
-        raise RuntimeError(f"Facebook API error {resp.status_code}: {data}")
+    def on_progress(sent: int, total: int, bytes_per_sec: float) -> None:
+        _report_media(progress, m, total, done=False, bytes_sent=sent, bytes_per_sec=bytes_per_sec)
 
-    pid = str(data.get("id", "")).strip()
-    name = str(data.get("name", "")).strip()
-    if not pid:
-        raise RuntimeError(f"Could not resolve Page id from token: {data}")
-    return {"id": pid, "name": name}
+    return on_progress
 
 
 def _uploads_dir(cfg: AppConfig) -> str:
-    base = os.path.dirname(cfg.db_path) or "."
+    base = data_dir(cfg.db_path)
     path = os.path.join(base, "uploads")
     os.makedirs(path, exist_ok=True)
     return path
 
 
-def generate_preview(post_id: int) -> Dict[str, Any]:
+@timed()
+def generate_preview(post_id: int, variants: int = 1) -> Dict[str, Any]:
+    """Generate the caption of a post; with variants > 1, alternatives from the same LLM call.
+
+    All variants are stored in caption_variants; the first becomes the caption.
+    """
     cfg = load_config()
     post = get_post(cfg.db_path, post_id)
     if not post:
@@ -349,10 +216,6 @@ def generate_preview(post_id: int) -> Dict[str, Any]:
     if not (topic and main):
         raise RuntimeError("Missing topic/main")
 
-    combined_main = main
-    if extra_requirements:
-        combined_main = f"{main}\n\nYêu cầu bổ sung (từ trang duyệt):\n{extra_requirements}".strip()
-
     seo: List[str] = []
     if cfg.serpapi_key:
         try:
@@ -360,115 +223,281 @@ def generate_preview(post_id: int) -> Dict[str, Any]:
         except Exception as e:
             seo = [f"(SerpAPI lỗi: {e})"]
 
-    ai = generate_ai_json(cfg, topic, combined_main, mandatory, seo)
+    t0 = time.perf_counter()
+    ai = generate_ai_json(
+        cfg, topic, main, mandatory, seo, extra_requirements=extra_requirements, variants=variants
+    )
+    usage = dict(ai.pop("usage", {}), duration_ms=round((time.perf_counter() - t0) * 1000, 1))
+    insert_llm_usage(cfg.db_path, post_id, usage)
     caption = build_caption(ai["title"], ai["content"], mandatory)
 
-    update_post(cfg.db_path, post_id, {
-        "seo_keywords_json": json.dumps(seo, ensure_ascii=False),
-        "ai_title": ai["title"],
-        "ai_content": ai["content"],
-        "caption": caption,
-        "last_error": "",
-    })
+    stored = save_caption_variants(
+        cfg.db_path,
+        post_id,
+        [
+            dict(v, caption=build_caption(v["title"], v["content"], mandatory),
+                 provider=usage.get("provider", ""), model=usage.get("model", ""))
+            for v in ai.pop("variants")
+        ],
+        {
+            "seo_keywords_json": json.dumps(seo, ensure_ascii=False),
+            "ai_title": ai["title"],
+            "ai_content": ai["content"],
+            "caption": caption,
+            "last_error": "",
+        },
+    )
 
-    return {"post_id": post_id, "seo_keywords": seo, "ai": ai, "caption": caption}
+    return {
+        "post_id": post_id, "seo_keywords": seo, "ai": ai, "caption": caption, "variants": stored, "usage": usage,
+    }
 
 
-def post_to_facebook(post_id: int, page_access_token_override: Optional[str] = None) -> Dict[str, Any]:
-    cfg = load_config()
-    post = get_post(cfg.db_path, post_id)
-    if not post:
-        raise RuntimeError("Post not found")
+class _StageTimer:
+    """Wall-clock duration (ms) per publish stage; stages may run on different threads."""
 
-    status = str(post.get("status", "")).strip()
-    if status not in ("APPROVED",):
-        raise RuntimeError("Post must be APPROVED before posting")
+    def __init__(self, progress: Optional[ProgressFn] = None) -> None:
+        self.durations: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+        self._progress = progress
 
-    page_access_token = (page_access_token_override or "").strip() or cfg.fb_page_access_token
-    if not page_access_token:
-        raise RuntimeError(
-            "Missing FB page access token (provide it from UI per post, or set FB_PAGE_ACCESS_TOKEN in .env)"
-        )
+    @contextmanager
+    def stage(self, name: str):
+        _report(self._progress, "stage", stage=name)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.durations[name] = round((time.perf_counter() - t0) * 1000, 1)
 
+    def as_json(self) -> str:
+        out = dict(self.durations)
+        out["total"] = round((time.perf_counter() - self._t0) * 1000, 1)
+        return json.dumps(out)
+
+
+def _resolve_page(cfg: AppConfig, post: Dict[str, Any], page_access_token: str) -> str:
     page_id = (str(post.get("page_id", "")).strip() or cfg.default_page_id)
     if not page_id:
         # If user provides a Page token, we can resolve the Page id automatically.
-        page_id = get_page_info_from_token(page_access_token).get("id", "").strip()
+        page_id = get_page_info_cached(cfg.db_path, page_access_token).get("id", "").strip()
     if not page_id:
         raise RuntimeError("Missing page_id (set in post or DEFAULT_PAGE_ID)")
+    return page_id
+
 
+def _ensure_caption(cfg: AppConfig, post_id: int, post: Dict[str, Any]) -> str:
     caption = str(post.get("caption", "")).strip()
     if not caption:
         generate_preview(post_id)
         post = get_post(cfg.db_path, post_id) or post
         caption = str(post.get("caption", "")).strip()
+    return caption
 
-    image_url = str(post.get("image_url", "")).strip()
-    image_file_name = str(post.get("image_file_name", "")).strip()
-    image_urls: List[str] = []
-    image_file_names: List[str] = []
 
-    try:
-        image_urls = [str(x).strip() for x in (json.loads(post.get("image_urls_json") or "[]") or []) if str(x).strip()]
-    except Exception:
-        image_urls = []
-    try:
-        image_file_names = [
-            str(x).strip()
-            for x in (json.loads(post.get("image_file_names_json") or "[]") or [])
-            if str(x).strip()
-        ]
-    except Exception:
-        image_file_names = []
-
-    # Backward compatibility
-    if not image_urls and image_url:
-        image_urls = [image_url]
-    if not image_file_names and image_file_name:
-        image_file_names = [image_file_name]
-    video_url = str(post.get("video_url", "")).strip()
-    video_file_name = str(post.get("video_file_name", "")).strip()
-
-    video_urls: List[str] = []
-    video_file_names: List[str] = []
-    try:
-        video_urls = [str(x).strip() for x in (json.loads(post.get("video_urls_json") or "[]") or []) if str(x).strip()]
-    except Exception:
-        video_urls = []
-    try:
-        video_file_names = [
-            str(x).strip()
-            for x in (json.loads(post.get("video_file_names_json") or "[]") or [])
-            if str(x).strip()
-        ]
-    except Exception:
-        video_file_names = []
+def _stage_unpublished_photos(
+    cfg: AppConfig,
+    page_id: str,
+    page_access_token: str,
+    image_rows: List[Dict[str, Any]],
+    file_paths: List[str],
+    progress: Optional[ProgressFn] = None,
+) -> List[str]:
+    """Upload photo files as unpublished media (in parallel) and return their ids in order."""
+
+    def upload(item: Tuple[Dict[str, Any], str]) -> str:
+        m, file_path = item
+        size = _file_bytes([file_path])
+        _report_media(progress, m, size, done=False)
+        up = upload_photo_unpublished_by_file(
+            page_id, page_access_token, file_path,
+            on_progress=_upload_callback(progress, m), db_path=cfg.db_path,
+        )
+        mid = str(up.get("id") or "").strip()
+        if not mid:
+            raise RuntimeError(f"Upload photo returned no id: {up}")
+        update_post_media(cfg.db_path, int(m["id"]), {"fb_media_id": mid})
+        _report_media(progress, m, size, done=True)
+        return mid
+
+    workers = max(1, min(PUBLISH_UPLOAD_CONCURRENCY, len(file_paths)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fb-upload") as ex:
+        return list(ex.map(upload, zip(image_rows, file_paths)))
+
+
+def _record_attempt(
+    cfg: AppConfig,
+    attempt: Dict[str, Any],
+    timings_json: str,
+    err: Optional[Exception] = None,
+    fb_post_id: str = "",
+    fb_post_url: str = "",
+) -> None:
+    timings = json.loads(timings_json)
+    row = dict(attempt)
+    row.update({
+        "status": "FAILED" if err else "POSTED",
+        "finished_at": now_iso(),
+        "duration_ms": timings.get("total", 0),
+        "stage_timings_json": timings_json,
+        "fb_post_id": fb_post_id,
+        "fb_post_url": fb_post_url,
+        "error": str(err)[:2000] if err else "",
+    })
+    if isinstance(err, FacebookAPIError):
+        row["http_status"] = err.status_code
+        row["graph_error_code"] = err.error_code
+    record_attempt(cfg.db_path, row)
 
-    # Backward compatibility
-    if not video_urls and video_url:
-        video_urls = [video_url]
-    if not video_file_names and video_file_name:
-        video_file_names = [video_file_name]
 
-    try:
-        upload_dir = _uploads_dir(cfg)
-        fb_resp: Dict[str, Any]
+def _fail(cfg: AppConfig, post_id: int, err: Exception, timer: _StageTimer, attempt: Dict[str, Any]) -> None:
+    timings = timer.as_json()
+    update_post(cfg.db_path, post_id, {
+        "status": "FAILED",
+        "last_error": str(err),
+        "publish_timings_json": timings,
+    })
+    _record_attempt(cfg, attempt, timings, err=err)
 
-        fb_resps: List[Dict[str, Any]] = []
-        post_ids: List[str] = []
-        post_urls: List[str] = []
 
-        if video_file_names or video_urls:
+def _file_bytes(paths: List[str]) -> int:
+    total = 0
+    for p in paths:
+        try:
+            total += os.path.getsize(p)
+        except OSError:
+            pass
+    return total
+
+
+def _stage_media(
+    cfg: AppConfig,
+    op: PublishOperation,
+    needs_caption: bool,
+    timer: _StageTimer,
+    attempt: Dict[str, Any],
+    progress: Optional[ProgressFn] = None,
+) -> Dict[str, Any]:
+    """Load the post's media, take the operation's lease and stage what can go up before the caption is known.
+
+    Photos can be uploaded unpublished before the caption exists; the final
+    feed post attaches them. A single photo with a ready caption is posted in
+    one request instead. Videos need the caption in the same request. Photos
+    staged by an earlier attempt of the same operation are reused.
+    """
+    post_id, page_id, page_access_token = op.post_id, op.page_id, op.page_access_token
+    upload_dir = _uploads_dir(cfg)
+    media_rows = list_post_media(cfg.db_path, post_id)
+    op.acquire(media_rows)
+    attempt["idempotency_key"] = op.key
+    # Remote URLs prefetched after approval are uploaded from the local copy
+    # instead. Only when the post has no uploaded files of that kind: those
+    # take precedence over URLs, and must keep doing so however far the
+    # prefetch got.
+    for url_kind, file_kind in (("image_url", "image_file"), ("video_url", "video_file")):
+        url_rows = [m for m in media_rows if m["kind"] == url_kind]
+        if any(m["kind"] == file_kind for m in media_rows):
+            continue
+        if url_rows and all(prefetched_path(upload_dir, m) for m in url_rows):
+            media_rows = [
+                {**m, "kind": file_kind, "source": m["local_file"]} if m["kind"] == url_kind else m
+                for m in media_rows
+            ]
+    staged: Dict[str, Any] = {
+        "upload_dir": upload_dir,
+        "image_url_rows": [m for m in media_rows if m["kind"] == "image_url"],
+        "image_file_rows": [m for m in media_rows if m["kind"] == "image_file"],
+        "video_url_rows": [m for m in media_rows if m["kind"] == "video_url"],
+        "video_file_rows": [m for m in media_rows if m["kind"] == "video_file"],
+        "image_files": [],
+        "media_ids": [],
+    }
+    has_videos = bool(staged["video_file_rows"] or staged["video_url_rows"])
+    staged["has_videos"] = has_videos
+    image_file_rows = staged["image_file_rows"]
+    image_url_rows = staged["image_url_rows"]
+
+    with timer.stage("stage_media"):
+        if not has_videos and image_file_rows:
+            image_files = [os.path.join(upload_dir, m["source"]) for m in image_file_rows]
+            if cfg.optimize_images:
+                hashes = {p: m["content_hash"] for p, m in zip(image_files, image_file_rows) if m["content_hash"]}
+                image_files = optimize_images(cfg.db_path, image_files, hashes)
+            staged["image_files"] = image_files
+            attempt["bytes_sent"] = _file_bytes(image_files)
+            if len(image_files) > 1 or needs_caption:
+                media_ids = op.staged_media_ids(len(image_files))
+                if not media_ids:
+                    media_ids = _stage_unpublished_photos(
+                        cfg, page_id, page_access_token, image_file_rows, image_files, progress
+                    )
+                    op.media_staged(media_ids)
+                staged["media_ids"] = media_ids
+        elif not has_videos and image_url_rows and needs_caption:
+            media_ids = op.staged_media_ids(len(image_url_rows))
+            if not media_ids:
+                media_ids, _ = publish_photos_by_url_batch(
+                    page_id, page_access_token, [m["source"] for m in image_url_rows]
+                )
+                op.media_staged(media_ids)
+            for m, mid in zip(image_url_rows, media_ids):
+                update_post_media(cfg.db_path, int(m["id"]), {"fb_media_id": mid})
+                _report_media(progress, m, 0, done=True)
+            staged["media_ids"] = media_ids
+    return staged
+
+
+def _create_post(
+    cfg: AppConfig,
+    op: PublishOperation,
+    staged: Dict[str, Any],
+    caption: str,
+    timer: _StageTimer,
+    attempt: Dict[str, Any],
+    progress: Optional[ProgressFn] = None,
+) -> Dict[str, Any]:
+    """Create the Page post(s) from staged media, each through op.create() (at most once).
+
+    Returns {"fb", "post_id", "post_url"} plus "post_ids"/"post_urls"/"fb_list"
+    when several videos became several posts.
+    """
+    page_id, page_access_token = op.page_id, op.page_access_token
+    upload_dir = staged["upload_dir"]
+    image_url_rows = staged["image_url_rows"]
+    image_file_rows = staged["image_file_rows"]
+    video_url_rows = staged["video_url_rows"]
+    video_file_rows = staged["video_file_rows"]
+    image_files = staged["image_files"]
+    media_ids = staged["media_ids"]
+
+    fb_resp: Dict[str, Any]
+
+    fb_resps: List[Dict[str, Any]] = []
+    post_ids: List[str] = []
+    post_urls: List[str] = []
+
+    with timer.stage("create_post"):
+        if staged["has_videos"]:
             # Facebook only supports 1 video per post. If user provides multiple videos,
             # we post them sequentially as multiple posts.
-            if video_file_names:
-                for fn in video_file_names:
-                    file_path = os.path.join(upload_dir, fn)
-                    r = post_video_by_file(page_id, page_access_token, file_path, caption)
+            if video_file_rows:
+                attempt["bytes_sent"] = _file_bytes([os.path.join(upload_dir, m["source"]) for m in video_file_rows])
+                for i, m in enumerate(video_file_rows):
+                    file_path = os.path.join(upload_dir, m["source"])
+                    size = _file_bytes([file_path])
+                    _report_media(progress, m, size, done=False)
+                    r = op.create(i, caption, True, partial(
+                        post_video_by_file, page_id, page_access_token, file_path, caption,
+                        on_progress=_upload_callback(progress, m), db_path=cfg.db_path,
+                    ))
+                    _report_media(progress, m, size, done=True)
                     fb_resps.append(r)
             else:
-                for u in video_urls:
-                    r = post_video_by_url(page_id, page_access_token, u, caption)
+                for i, m in enumerate(video_url_rows):
+                    r = op.create(i, caption, True, partial(post_video_by_url, page_id, page_access_token, m["source"], caption))
+                    _report_media(progress, m, 0, done=True)
                     fb_resps.append(r)
 
             for r in fb_resps:
@@ -477,44 +506,131 @@ def post_to_facebook(post_id: int, page_access_token_override: Optional[str] = N
                 post_urls.append(f"https://www.facebook.com/{pid_fb}" if pid_fb else "")
 
             fb_resp = fb_resps[-1] if fb_resps else {}
+        elif media_ids:
+            fb_resp = op.create(0, caption, False, partial(
+                create_feed_post_with_attached_media, page_id, page_access_token, caption, media_ids
+            ))
+        elif image_files:
+            size = _file_bytes(image_files[:1])
+            _report_media(progress, image_file_rows[0], size, done=False)
+            fb_resp = op.create(0, caption, False, partial(
+                post_photo_by_file, page_id, page_access_token, image_files[0], caption,
+                on_progress=_upload_callback(progress, image_file_rows[0]), db_path=cfg.db_path,
+            ))
+            _report_media(progress, image_file_rows[0], size, done=True)
+        elif len(image_url_rows) > 1:
+            # Uploads + feed post in one HTTP request.
+            def batch_create() -> Dict[str, Any]:
+                batch_ids, batch_feed = publish_photos_by_url_batch(
+                    page_id, page_access_token, [m["source"] for m in image_url_rows], caption
+                )
+                for m, mid in zip(image_url_rows, batch_ids):
+                    update_post_media(cfg.db_path, int(m["id"]), {"fb_media_id": mid})
+                return batch_feed or {}
+
+            fb_resp = op.create(0, caption, False, batch_create)
+            for m in image_url_rows:
+                _report_media(progress, m, 0, done=True)
+        elif image_url_rows:
+            fb_resp = op.create(0, caption, False, partial(
+                post_photo_by_url, page_id, page_access_token=page_access_token,
+                image_url=image_url_rows[0]["source"], message=caption,
+            ))
+            _report_media(progress, image_url_rows[0], 0, done=True)
         else:
-            # Images only (single or multiple)
-            if image_file_names:
-                if len(image_file_names) == 1:
-                    file_path = os.path.join(upload_dir, image_file_names[0])
-                    fb_resp = post_photo_by_file(page_id, page_access_token, file_path, caption)
-                else:
-                    media_ids: List[str] = []
-                    for fn in image_file_names:
-                        file_path = os.path.join(upload_dir, fn)
-                        up = upload_photo_unpublished_by_file(page_id, page_access_token, file_path)
-                        mid = str(up.get("id") or "").strip()
-                        if not mid:
-                            raise RuntimeError(f"Upload photo returned no id: {up}")
-                        media_ids.append(mid)
-                    fb_resp = create_feed_post_with_attached_media(page_id, page_access_token, caption, media_ids)
-            elif image_urls:
-                if len(image_urls) == 1:
-                    fb_resp = post_photo_by_url(page_id, page_access_token=page_access_token, image_url=image_urls[0], message=caption)
-                else:
-                    media_ids = []
-                    for u in image_urls:
-                        up = upload_photo_unpublished_by_url(page_id, page_access_token, u)
-                        mid = str(up.get("id") or "").strip()
-                        if not mid:
-                            raise RuntimeError(f"Upload photo returned no id: {up}")
-                        media_ids.append(mid)
-                    fb_resp = create_feed_post_with_attached_media(page_id, page_access_token, caption, media_ids)
-            else:
-                raise RuntimeError("Missing media (image/video)")
+            raise RuntimeError("Missing media (image/video)")
+
+    post_id_fb = str(fb_resp.get("post_id") or fb_resp.get("id") or "")
+    post_url = f"https://www.facebook.com/{post_id_fb}" if post_id_fb else ""
+    if post_ids:
+        post_id_fb = post_ids[0]
+        post_url = post_urls[0]
+
+    out: Dict[str, Any] = {"fb": fb_resp, "post_id": post_id_fb, "post_url": post_url}
+    if post_urls:
+        out["post_ids"] = post_ids
+        out["post_urls"] = post_urls
+        out["fb_list"] = fb_resps
+    return out
 
-        post_id_fb = str(fb_resp.get("post_id") or fb_resp.get("id") or "")
-        post_url = f"https://www.facebook.com/{post_id_fb}" if post_id_fb else ""
-        if post_ids:
-            post_id_fb = post_ids[0]
-            post_url = post_urls[0]
+
+@timed()
+def post_to_facebook(
+    post_id: int,
+    page_access_token_override: Optional[str] = None,
+    progress: Optional[ProgressFn] = None,
+) -> Dict[str, Any]:
+    """Publish an APPROVED post as a staged pipeline.
+
+    resolve page -> stage media -> ensure caption -> create post. Caption
+    generation runs concurrently with page resolution and unpublished photo
+    uploads; per-stage timings are stored in posts.publish_timings_json.
+    `progress` receives stage/media events (see ProgressFn).
+    """
+    cfg = load_config()
+    post = get_post(cfg.db_path, post_id)
+    if not post:
+        raise RuntimeError("Post not found")
+
+    status = str(post.get("status", "")).strip()
+    if status not in ("APPROVED",):
+        raise RuntimeError("Post must be APPROVED before posting")
+
+    page_access_token = (page_access_token_override or "").strip() or cfg.fb_page_access_token
+    if not page_access_token:
+        raise RuntimeError(
+            "Missing FB page access token (provide it from UI per post, or set FB_PAGE_ACCESS_TOKEN in .env)"
+        )
+
+    timer = _StageTimer(progress)
+    attempt: Dict[str, Any] = {
+        "post_id": post_id,
+        "token_fp": token_fingerprint(page_access_token),
+        "started_at": now_iso(),
+    }
+    needs_caption = not str(post.get("caption", "")).strip()
+
+    def ensure_caption() -> str:
+        with timer.stage("ensure_caption"):
+            return _ensure_caption(cfg, post_id, post)
+
+    ex = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fb-caption")
+    try:
+        caption_fut = ex.submit(ensure_caption)
+
+        with timer.stage("resolve_page"):
+            page_id = _resolve_page(cfg, post, page_access_token)
+        attempt["page_id"] = page_id
+        _report(progress, "page", page_id=page_id)
+
+        op = PublishOperation(cfg.db_path, post_id, page_id, page_access_token)
+        try:
+            try:
+                staged = _stage_media(cfg, op, needs_caption, timer, attempt, progress)
+                # Time spent blocked on the LLM after media was staged.
+                with timer.stage("caption_wait"):
+                    caption = caption_fut.result()
+            except PublishInProgressError:
+                raise  # the other worker owns the outcome
+            except Exception as e:
+                _fail(cfg, post_id, e, timer, attempt)
+                raise
+        except BaseException:
+            op.release()
+            raise
+    finally:
+        # Don't hold the caller on an LLM call whose caption is no longer needed.
+        ex.shutdown(wait=False, cancel_futures=True)
+
+    try:
+        created = _create_post(cfg, op, staged, caption, timer, attempt, progress)
+        post_id_fb = created["post_id"]
+        post_url = created["post_url"]
+        post_ids = created.get("post_ids", [])
+        post_urls = created.get("post_urls", [])
 
         posted_at = dt.datetime.now(dt.timezone.utc).astimezone().isoformat(timespec="seconds")
+        timings = timer.as_json()
         update_post(cfg.db_path, post_id, {
             "status": "POSTED",
             "page_id": page_id,
@@ -524,68 +640,287 @@ def post_to_facebook(post_id: int, page_access_token_override: Optional[str] = N
             "fb_post_urls_json": json.dumps([u for u in post_urls if u], ensure_ascii=False) if post_urls else json.dumps([post_url], ensure_ascii=False),
             "posted_at": posted_at,
             "last_error": "",
+            "publish_timings_json": timings,
         })
-
-        out: Dict[str, Any] = {"status": "posted", "post_id": post_id, "fb": fb_resp, "post_url": post_url}
+        # Only once POSTED is stored: until then a retry reuses the recorded post.
+        op.finish()
+        _record_attempt(cfg, attempt, timings, fb_post_id=str(post_id_fb), fb_post_url=post_url)
+        _report(progress, "done", post_url=post_url)
+
+        out: Dict[str, Any] = {
+            "status": "posted",
+            "post_id": post_id,
+            "fb": created["fb"],
+            "post_url": post_url,
+            "timings_ms": json.loads(timings),
+        }
         if post_urls:
             out["post_urls"] = post_urls
-            out["fb_list"] = fb_resps
+            out["fb_list"] = created["fb_list"]
         return out
     except Exception as e:
-        set_status(cfg.db_path, post_id, "FAILED", str(e))
+        _fail(cfg, post_id, e, timer, attempt)
         raise
+    finally:
+        op.release()
 
 
-def post_to_facebook_multi(post_id: int, page_access_tokens: List[str]) -> Dict[str, Any]:
-    """Post the same content to multiple fanpages, one per Page access token.
+# Caption alternatives generated per request for drafts under review (the
+# Duyệt tab and the scheduler's pre-generation); see generate_preview().
+CAPTION_VARIANTS = int(os.getenv("CAPTION_VARIANTS", "3"))
 
-    Tokens are NOT stored in DB. DB status is set to POSTED only if all succeed.
-    """
-    cfg = load_config()
+# Max Pages published to in parallel when a post fans out to several targets.
+PUBLISH_TARGET_CONCURRENCY = int(os.getenv("PUBLISH_TARGET_CONCURRENCY", "4"))
+
+
+def _approved_post(cfg: AppConfig, post_id: int) -> Dict[str, Any]:
     post = get_post(cfg.db_path, post_id)
     if not post:
         raise RuntimeError("Post not found")
-
-    status = str(post.get("status", "")).strip()
-    if status not in ("APPROVED",):
+    if str(post.get("status", "")).strip() != "APPROVED":
         raise RuntimeError("Post must be APPROVED before posting")
+    return post
 
+
+def _target_due(post: Dict[str, Any], target: Dict[str, Any], now: str) -> bool:
+    when = str(target.get("scheduled_at") or "") or str(post.get("scheduled_at") or "")
+    return not when or when <= now
+
+
+def _publish_target(
+    cfg: AppConfig,
+    post: Dict[str, Any],
+    target: Dict[str, Any],
+    page_access_token: str,
+    caption: str,
+    progress: Optional[ProgressFn] = None,
+) -> Dict[str, Any]:
+    """Claim one post_targets row and publish the post to its Page. Never raises."""
+    post_id = int(post["id"])
+    page_id = str(target["page_id"])
+    out: Dict[str, Any] = {"target_id": int(target["id"]), "page_id": page_id, "page_name": target.get("page_name", "")}
+    if not claim_post_target(cfg.db_path, int(target["id"])):
+        return {**out, "ok": False, "skipped": True, "reason": "in_progress", "error": "Already being published"}
+
+    timer = _StageTimer(progress)
+    attempt: Dict[str, Any] = {
+        "post_id": post_id,
+        "page_id": page_id,
+        "token_fp": token_fingerprint(page_access_token),
+        "started_at": now_iso(),
+    }
+    _report(progress, "page", page_id=page_id, page_name=target.get("page_name", ""))
+    caption = str(target.get("caption_override") or "").strip() or caption
+    op = PublishOperation(cfg.db_path, post_id, page_id, page_access_token)
+    try:
+        staged = _stage_media(cfg, op, False, timer, attempt, progress)
+        created = _create_post(cfg, op, staged, caption, timer, attempt, progress)
+        update_post_target(cfg.db_path, int(target["id"]), {
+            "status": "POSTED",
+            "fb_post_id": created["post_id"],
+            "fb_post_url": created["post_url"],
+            "posted_at": dt.datetime.now(dt.timezone.utc).astimezone().isoformat(timespec="seconds"),
+            "last_error": "",
+        })
+        op.finish()
+    except Exception as e:
+        timings = timer.as_json()
+        update_post_target(cfg.db_path, int(target["id"]), {"status": "FAILED", "last_error": str(e)[:2000]})
+        _record_attempt(cfg, attempt, timings, err=e)
+        _report(progress, "failed", error=str(e))
+        return {**out, "ok": False, "error": str(e)}
+    finally:
+        op.release()
+
+    timings = timer.as_json()
+    _record_attempt(cfg, attempt, timings, fb_post_id=created["post_id"], fb_post_url=created["post_url"])
+    _report(progress, "done", post_url=created["post_url"])
+    return {**out, "ok": True, "post_url": created["post_url"], "fb": created["fb"], "timings_ms": json.loads(timings)}
+
+
+def _publish_tokens(cfg: AppConfig, page_access_tokens: Optional[List[str]]) -> List[str]:
+    """`page_access_tokens` followed by FB_PAGE_ACCESS_TOKEN(S), without duplicates."""
     tokens = [str(t or "").strip() for t in (page_access_tokens or []) if str(t or "").strip()]
-    if not tokens:
-        raise RuntimeError("No FB_PAGE_ACCESS_TOKEN provided")
+    return tokens + [t for t in [cfg.fb_page_access_token, *cfg.fb_page_access_tokens] if t and t not in tokens]
 
-    results: List[Dict[str, Any]] = []
-    failures: List[Dict[str, Any]] = []
 
-    for token in tokens:
+def _resolve_pages(cfg: AppConfig, tokens: List[str]) -> List[Dict[str, Any]]:
+    """Page of each token through the page/token cache (Graph only on a miss); one summary per token."""
+
+    def resolve(token: str) -> Dict[str, Any]:
+        fp = token_fingerprint(token)
         try:
-            info = get_page_info_from_token(token)
-            out = post_to_facebook(post_id, page_access_token_override=token)
+            info = get_page_info_cached(cfg.db_path, token)
+            return {"token_fp": fp, "ok": True, "page_id": info["id"], "page_name": info["name"]}
+        except Exception as e:
+            return {"token_fp": fp, "ok": False, "error": str(e)}
+
+    if not tokens:
+        return []
+    with ThreadPoolExecutor(max_workers=min(8, len(tokens)), thread_name_prefix="fb-page") as ex:
+        return list(ex.map(resolve, tokens))
+
+
+@timed()
+def publish_targets(
+    post_id: int,
+    page_access_tokens: Optional[List[str]] = None,
+    progress: Optional[ProgressFn] = None,
+    only_due: bool = False,
+) -> Dict[str, Any]:
+    """Publish an APPROVED post to each of its post_targets Pages, in parallel.
+
+    POSTED targets are skipped, so calling this again only retries the Pages
+    that failed (or were not due yet with `only_due`). Each Page needs a token
+    among `page_access_tokens` and FB_PAGE_ACCESS_TOKEN(S); targets without one
+    stay PENDING. The post becomes POSTED once every target is. Progress
+    events carry target=<token fingerprint>.
+    """
+    cfg = load_config()
+    post = _approved_post(cfg, post_id)
+    tokens = _publish_tokens(cfg, page_access_tokens)
+    return _publish_targets(cfg, post, tokens, _resolve_pages(cfg, tokens), progress, only_due)
+
+
+def _publish_targets(
+    cfg: AppConfig,
+    post: Dict[str, Any],
+    tokens: List[str],
+    pages: List[Dict[str, Any]],
+    progress: Optional[ProgressFn],
+    only_due: bool,
+) -> Dict[str, Any]:
+    post_id = int(post["id"])
+    token_by_fp = {token_fingerprint(t): t for t in tokens}
+    token_by_page: Dict[str, str] = {}
+    for r in pages:
+        if r.get("ok") and r.get("page_id"):
+            token_by_page.setdefault(str(r["page_id"]), token_by_fp[r["token_fp"]])
+
+    now = utc_now_iso()
+    targets = [
+        t for t in list_post_targets(cfg.db_path, post_id)
+        if t["status"] != "POSTED" and (not only_due or _target_due(post, t, now))
+    ]
+    results: List[Dict[str, Any]] = []
+    runnable: List[Tuple[Dict[str, Any], str]] = []
+    for t in targets:
+        token = token_by_page.get(str(t["page_id"]), "")
+        if token:
+            runnable.append((t, token))
+        else:
             results.append({
-                "page_id": info.get("id"),
-                "page_name": info.get("name"),
-                "post_url": out.get("post_url", ""),
-                "fb": out.get("fb", {}),
-                "ok": True,
+                "target_id": int(t["id"]), "page_id": t["page_id"], "page_name": t.get("page_name", ""),
+                "ok": False, "skipped": True, "reason": "no_token", "error": "No Page access token for this page",
             })
-        except Exception as e:
-            # Keep going so user can see partial results.
-            failures.append({"ok": False, "error": str(e)})
-            results.append({"ok": False, "error": str(e)})
 
-    if failures:
-        set_status(cfg.db_path, post_id, "FAILED", f"Multi-post failures: {len(failures)}/{len(tokens)}")
-    else:
-        # Store a quick summary of URLs for convenience.
-        urls = [r.get("post_url", "") for r in results if r.get("ok") and r.get("post_url")]
-        update_post(cfg.db_path, post_id, {"status": "POSTED", "fb_post_url": "\n".join(urls), "last_error": ""})
+    caption = ""
+    if any(not str(t.get("caption_override") or "").strip() for t, _ in runnable):
+        caption = _ensure_caption(cfg, post_id, post)
+
+    def run(item: Tuple[Dict[str, Any], str]) -> Dict[str, Any]:
+        t, token = item
+        target_progress = partial(progress, target=token_fingerprint(token)) if progress else None
+        return _publish_target(cfg, post, t, token, caption, target_progress)
+
+    if runnable:
+        workers = max(1, min(PUBLISH_TARGET_CONCURRENCY, len(runnable)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fb-target") as ex:
+            results = list(ex.map(run, runnable)) + results
+
+    final = list_post_targets(cfg.db_path, post_id)
+    posted = [t for t in final if t["status"] == "POSTED"]
+    failed = [r for r in results if not r["ok"] and not r.get("skipped")]
+    missing = [r for r in results if r.get("reason") == "no_token"]
+    updates: Dict[str, Any] = {
+        "fb_post_ids_json": json.dumps([t["fb_post_id"] for t in posted if t["fb_post_id"]], ensure_ascii=False),
+        "fb_post_urls_json": json.dumps([t["fb_post_url"] for t in posted if t["fb_post_url"]], ensure_ascii=False),
+    }
+    if final and len(posted) == len(final):
+        updates.update({
+            "status": "POSTED",
+            "fb_post_id": posted[0]["fb_post_id"],
+            "fb_post_url": posted[0]["fb_post_url"],
+            "posted_at": dt.datetime.now(dt.timezone.utc).astimezone().isoformat(timespec="seconds"),
+            "last_error": "",
+        })
+    elif failed or missing:
+        first = (failed or missing)[0]
+        updates["last_error"] = (
+            f"{len(failed) + len(missing)}/{len(final)} page(s) not posted; {first['page_id']}: {first['error']}"
+        )[:2000]
+    update_post(cfg.db_path, post_id, updates)
+
+    return {
+        "status": "multi_posted",
+        "post_id": post_id,
+        "results": results,
+        "failed": len(failed),
+        "skipped": len(results) - len(failed) - sum(1 for r in results if r["ok"]),
+        "posted": len(posted),
+        "pending": len(final) - len(posted),
+    }
+
+
+@timed()
+def post_to_facebook_multi(
+    post_id: int, page_access_tokens: List[str], progress: Optional[ProgressFn] = None
+) -> Dict[str, Any]:
+    """Post the same content to multiple fanpages, one per Page access token.
 
-    return {"status": "multi_posted", "post_id": post_id, "results": results, "failed": len(failures)}
+    Each token's Page becomes a post_targets row (existing targets keep their
+    caption override and schedule), then publish_targets() fans out. Tokens
+    are NOT stored in DB.
+    """
+    cfg = load_config()
+    post = _approved_post(cfg, post_id)
+
+    given = [str(t or "").strip() for t in (page_access_tokens or []) if str(t or "").strip()]
+    if not given:
+        raise RuntimeError("No FB_PAGE_ACCESS_TOKEN provided")
+
+    tokens = _publish_tokens(cfg, given)
+    resolved = _resolve_pages(cfg, tokens)
+    pages = resolved[: len(given)]
+    upsert_post_targets(cfg.db_path, post_id, [
+        {"page_id": r["page_id"], **({"page_name": r["page_name"]} if r.get("page_name") else {})}
+        for r in pages if r.get("ok") and r.get("page_id")
+    ])
+    out = _publish_targets(cfg, post, tokens, resolved, progress, False)
+
+    bad = [r for r in pages if not r.get("ok")]
+    for r in bad:
+        _report(partial(progress, target=r["token_fp"]) if progress else None, "failed", error=r.get("error", ""))
+        out["results"].append({"ok": False, "token_fp": r["token_fp"], "error": r.get("error", "")})
+    out["failed"] += len(bad)
+    return out
+
+
+@timed()
+def publish_approved_post(
+    post_id: int,
+    page_access_token: Optional[str] = None,
+    progress: Optional[ProgressFn] = None,
+    only_due: bool = False,
+) -> Dict[str, Any]:
+    """Publish an APPROVED post where it belongs.
+
+    A post with post_targets goes to those Pages (publish_targets, `only_due`
+    applies there); any other post goes to its one Page (post_to_facebook).
+    `page_access_token` is tried before FB_PAGE_ACCESS_TOKEN(S).
+    """
+    cfg = load_config()
+    token = (page_access_token or "").strip()
+    if list_post_targets(cfg.db_path, post_id):
+        return publish_targets(post_id, [token] if token else None, progress, only_due)
+    return post_to_facebook(post_id, token or None, progress)
 
 
+@timed()
 def post_next_approved() -> Dict[str, Any]:
+    """Publish one APPROVED post: the most overdue scheduled one, else the newest unscheduled one."""
     cfg = load_config()
-    approved = list_posts(cfg.db_path, status="APPROVED", limit=1)
+    approved = list_due_posts(cfg.db_path, limit=1, include_unscheduled=True)
     if not approved:
         return {"status": "no_approved_posts"}
-    return post_to_facebook(int(approved[0]["id"]))
+    return publish_approved_post(int(approved[0]["id"]))